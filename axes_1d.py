@@ -1,8 +1,22 @@
-from PyQt5.QtCore import QPoint
+import numpy as np
+from functools import partial
+from PyQt5.QtCore import QPoint, QTimer
 from PyQt5.QtWidgets import QMenu
 
+from myGUIApplication_ver2.plot_data import read_1d, read_envelope, get_x_axis_dataset, TraceData
+from myGUIApplication_ver2.data_loader import DataLoader
+
 
 class Axes1D(object):
+    """
+    Traces much longer than the canvas is wide are drawn as a min/max
+    envelope with one bin per pixel. After zooming or panning the envelope
+    of the visible range, and as much on both sides, is read again.
+    """
+    # decimated above this many samples per pixel
+    MIN_SAMPLES_PER_BIN = 4
+    REFINE_DELAY = 100
+
     def __init__(self, ax, parent):
         self.ax = ax
         self.parent = parent
@@ -11,22 +25,100 @@ class Axes1D(object):
         self.plot_obj, = self.ax.plot(self.x, self.y)
         self.title = ''
         self.plot_list = []
+        self.overview = None
+        self.refined = None
+        self.shown_range = None
+        self.refine_loader = DataLoader(parent)
+        self.refine_loader.loaded.connect(self.show_refined)
+        self.refine_loader.failed.connect(print)
+        self.refine_timer = QTimer(parent)
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.setInterval(self.REFINE_DELAY)
+        self.refine_timer.timeout.connect(self.refine)
+        self._connect_view_callbacks()
+
+    @classmethod
+    def load_data(cls, obj, file, is_cancelled=None, target_shape=None):
+        # runs in a worker thread
+        n_bins = target_shape[1] if target_shape else None
+        if n_bins is None or obj.shape[0] <= cls.MIN_SAMPLES_PER_BIN * n_bins:
+            x, y = read_1d(obj, file, is_cancelled)
+            return TraceData(x, y, None, None, None)
+        trace = read_envelope(obj, n_bins, x_obj=get_x_axis_dataset(obj, file), is_cancelled=is_cancelled)
+        return trace._replace(source=(obj, file))
 
     def update_plot(self, obj, file):
-        self.y = obj[()]
-        self.x = obj.attrs.get('x_axis', None)
-        try:
-            self.x = file[obj.attrs['x_axis']][()]
-            assert len(self.x) == len(self.y)
-        except (AssertionError, TypeError, KeyError):
-            self.x = range(len(self.y))
+        self.show_data(self.load_data(obj, file))
 
+    def show_data(self, trace):
+        self.refine_loader.cancel()
+        self.overview = trace if trace.source is not None else None
+        self.refined = None
+        self.shown_range = None
+        self.x, self.y = trace.x, trace.y
         self.plot_obj.set_xdata(self.x)
         self.plot_obj.set_ydata(self.y)
         self.ax.relim()  # Recalculate limits
         self.ax.autoscale_view(True, True, True)
         self.parent.draw()
 
+    def _connect_view_callbacks(self):
+        # cla() drops the callbacks of the axes
+        self.ax.callbacks.connect('xlim_changed', self.on_view_changed)
+
+    def on_view_changed(self, ax):
+        if self.overview is not None:
+            self.refine_timer.start()
+
+    def refine(self):
+        overview = self.overview
+        if overview is None:
+            return
+        x_min, x_max = sorted(self.ax.get_xlim())
+        # visible samples are looked up in the finest trace that covers the view
+        trace = overview
+        if self.refined is not None and len(self.refined.x) and \
+                self.refined.x[0] <= x_min and x_max <= self.refined.x[-1]:
+            trace = self.refined
+        x = np.asarray(trace.x)
+        if np.any(np.diff(x) < 0):
+            # the visible samples are only found on a monotonic x axis
+            return
+        obj, file = overview.source
+        first = trace.indices[max(0, np.searchsorted(x, x_min) - 1)]
+        last = trace.indices[min(len(x) - 1, np.searchsorted(x, x_max))] + 1
+        width = last - first
+        start, stop = max(0, first - width), min(obj.shape[0], last + width)
+        if start == 0 and stop == obj.shape[0]:
+            if self.shown_range is not None:
+                self.refine_loader.cancel()
+                self.refined = None
+                self.shown_range = None
+                self._set_line(overview.x, overview.y)
+            return
+        if self.shown_range is not None and self.shown_range[0] <= first and last <= self.shown_range[1] \
+                and self.shown_range[1] - self.shown_range[0] <= 3 * width:
+            return
+        self.refine_loader.load(partial(self._load_range, obj, file, 3 * overview.n_bins, (start, stop)))
+
+    @staticmethod
+    def _load_range(obj, file, n_bins, index_range, is_cancelled):
+        trace = read_envelope(obj, n_bins, index_range, get_x_axis_dataset(obj, file), is_cancelled)
+        return trace, index_range
+
+    def show_refined(self, result):
+        self.refined, self.shown_range = result
+        self._set_line(self.refined.x, self.refined.y)
+        # the first refinement is located on overview bins, the next one is exact
+        self.refine_timer.start()
+
+    def _set_line(self, x, y):
+        # the view limits are kept, only the samples change
+        self.x, self.y = x, y
+        self.plot_obj.set_xdata(x)
+        self.plot_obj.set_ydata(y)
+        self.parent.draw_idle()
+
     def context_menu(self, event):
         menu = QMenu()
         y = self.parent.parent().height()
@@ -38,6 +130,12 @@ class Axes1D(object):
 
     def redraw_graph(self):
         self.ax.cla()
+        self._connect_view_callbacks()
+        if self.overview is not None:
+            self.refine_loader.cancel()
+            self.refined = None
+            self.shown_range = None
+            self.x, self.y = self.overview.x, self.overview.y
         self.plot_obj = self.ax.plot(self.x, self.y)[0]
         self.ax.relim()
         self.ax.autoscale_view(True, True, True)
@@ -1,46 +1,101 @@
 import numpy as np
-from PyQt5.QtCore import QPoint
-from PyQt5.QtWidgets import QMenu, QWidget, QVBoxLayout, QSizePolicy, QMessageBox
+from collections import OrderedDict
+from functools import partial
+from PyQt5.QtCore import QPoint, QTimer
+from PyQt5.QtWidgets import QMenu, QWidget, QVBoxLayout, QSizePolicy, QMessageBox, QApplication, QInputDialog
 from matplotlib.backends.backend_qt5 import NavigationToolbar2QT as NavigationToolbar
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 from matplotlib.widgets import RectangleSelector
-from scipy.optimize import curve_fit
 
 from myGUIApplication_ver2.colormap_window import ColormapWindow
+from myGUIApplication_ver2.plot_data import read_2d, read_strided, read_array, get_step, get_region, \
+    get_region_extent, get_2d_axes, DisplayData
+from myGUIApplication_ver2.data_loader import DataLoader
+from myGUIApplication_ver2.cut_engine import CutEngine
+from myGUIApplication_ver2.line_selector import LineSelector
+from myGUIApplication_ver2.fit_models import MODELS, DEFAULT_MODEL, lorentzian, three_lorentzians, \
+    get_parameter_names, fit_profile
+from myGUIApplication_ver2.batch_fit import FitSetup
+from myGUIApplication_ver2.raster_image import raster_imshow
 
 
 class Axes2D(object):
+    """
+    Large images are shown as an overview sized to the canvas first. When
+    the view is zoomed into an overview, the visible region is read again
+    at the resolution of the screen and drawn over it. The cut rectangle,
+    or the line of a line profile, is blitted, and the cut is updated at
+    most once per screen refresh while it is dragged. With fast rendering,
+    images are drawn as RasterImage, and a new frame of the same extent in
+    an unchanged view is blitted without drawing the rest of the figure.
+    """
+    DETAIL_DELAY = 150
+    DEFAULT_FRAME_INTERVAL = 16
+    # ranges and logs of the last images, kept for images that are shown again
+    MAX_DISPLAY_DATA = 8
+
     def __init__(self, ax, parent):
         self.ax = ax
         self.parent = parent
+        self.image = None
+        self.detail_obj = None
+        self.detail_loader = DataLoader(parent)
+        self.detail_loader.loaded.connect(self.show_detail)
+        self.detail_loader.failed.connect(print)
+        self.detail_timer = QTimer(parent)
+        self.detail_timer.setSingleShot(True)
+        self.detail_timer.setInterval(self.DETAIL_DELAY)
+        self.detail_timer.timeout.connect(self.load_detail)
+        self._connect_view_callbacks()
 
         self.params_2d = {}
         self.y, self.x1, self.x2, self.data = [], [], [], []
         self.rectangle_coordinates = None
         self.RectangleSelector = None
+        self.rectangle_cids = []
+        # 'rectangle' for cuts of rectangles, 'line' for line profiles
+        self.cut_mode = 'rectangle'
+        self.line_coordinates = None
+        self.line_width = 0
+        self.line_selector = None
+        self.dragging_cut = False
+        self.cut_timer = QTimer(parent)
+        self.cut_timer.setSingleShot(True)
+        self.cut_timer.setInterval(self.DEFAULT_FRAME_INTERVAL)
+        self.cut_timer.timeout.connect(self.update_live_cut)
         self.cut_window = None
         self.colormap_window = None
         self.apply_log_status = False
+        self.display = None
+        self.display_data = OrderedDict()
         self.plot_obj = None
+        self.fast_rendering = True
+        # the image and the view of the last draw of the figure, if the axes were shown
+        self.drawn_view = None
+        self.parent.mpl_connect('draw_event', self.on_draw)
         self.Ranges = Plot2DRangesHandler(self)
 
+    def set_cut_selector(self):
+        if self.cut_mode == 'line':
+            self.set_line_selector()
+        else:
+            self.set_rectangle()
+
     def set_rectangle(self):
+        self._remove_selectors()
         self.RectangleSelector = RectangleSelector(self.ax,
                                                    self.line_select_callback,
-                                                   drawtype='box',
+                                                   useblit=True,
                                                    button=[1],  # don't use middle button
                                                    minspanx=5,
                                                    minspany=5,
                                                    spancoords='pixels',
                                                    interactive=True)
-
-        def update_rs(event):
-            if self.RectangleSelector is not None:
-                if self.RectangleSelector.active and self.parent.status == 2:
-                    self.RectangleSelector.update()
-
-        self.parent.mpl_connect('draw_event', update_rs)
+        self.rectangle_cids = [self.parent.mpl_connect('button_press_event', self.on_rectangle_press),
+                               self.parent.mpl_connect('motion_notify_event', self.on_rectangle_move),
+                               self.parent.mpl_connect('button_release_event', self.on_rectangle_release)]
+        self.cut_timer.setInterval(self._get_frame_interval())
         if self.rectangle_coordinates is not None:
             x1, y1, x2, y2 = self.rectangle_coordinates
             self.RectangleSelector.extents = (x1, x2, y1, y2)
@@ -50,8 +105,115 @@ class Axes2D(object):
         """eclick and erelease are the press and release events"""
         assert self.cut_window is not None
         self.rectangle_coordinates = eclick.xdata, eclick.ydata, erelease.xdata, erelease.ydata
+        self.cut_timer.stop()
+        self.cut_window.canvas.update_cut_plot()
+
+    def set_line_selector(self):
+        self._remove_selectors()
+        self.line_selector = LineSelector(self.ax, self.on_profile_line_select, self.on_profile_line_move,
+                                          self.line_width)
+        self.cut_timer.setInterval(self._get_frame_interval())
+        if self.line_coordinates is not None:
+            x1, y1, x2, y2 = self.line_coordinates
+            self.line_selector.set_line((x1, y1), (x2, y2))
+
+    def on_profile_line_move(self, start, end):
+        if not self.dragging_cut:
+            self.dragging_cut = True
+            self.cut_window.canvas.start_live_update()
+        if not self.cut_timer.isActive():
+            self.cut_timer.start()
+
+    def on_profile_line_select(self, start, end):
+        self.line_coordinates = start + end
+        self.cut_timer.stop()
+        if self.dragging_cut:
+            self.dragging_cut = False
+            self.cut_window.canvas.stop_live_update()
         self.cut_window.canvas.update_cut_plot()
 
+    def get_cut_coordinates(self):
+        return self.line_coordinates if self.cut_mode == 'line' else self.rectangle_coordinates
+
+    def get_fit_setup(self):
+        """The cut and the last fit of the cut window, for batch fits, or None."""
+        coordinates = self.get_cut_coordinates() if self.cut_window is not None else None
+        if coordinates is None:
+            return None
+        fit_res = self.cut_window.canvas.fit_res
+        return FitSetup(self.cut_mode, tuple(float(value) for value in coordinates),
+                        float(self.line_width) if self.cut_mode == 'line' else 0.,
+                        self.cut_window.canvas.fit_model,
+                        None if fit_res is None else tuple(float(value) for value in fit_res[0]))
+
+    def set_cut_mode(self, mode):
+        self.cut_mode = mode
+        if self.cut_window is None:
+            return
+        self._hide_selectors()
+        self.set_cut_selector()
+        self.cut_window.canvas.update_cut_plot()
+
+    def set_line_width(self, width):
+        self.line_width = width
+        if self.line_selector is not None:
+            self.line_selector.set_width(width)
+        if self.cut_window is not None and self.cut_mode == 'line':
+            self.cut_window.canvas.update_cut_plot()
+
+    def _hide_selectors(self):
+        for selector in (self.RectangleSelector, self.line_selector):
+            if selector is not None:
+                selector.set_visible(False)
+                selector.update()
+
+    def _remove_selectors(self):
+        self.cut_timer.stop()
+        self.dragging_cut = False
+        for cid in self.rectangle_cids:
+            self.parent.mpl_disconnect(cid)
+        self.rectangle_cids = []
+        if self.RectangleSelector is not None:
+            self.RectangleSelector.disconnect_events()
+            self.RectangleSelector = None
+        if self.line_selector is not None:
+            self.line_selector.disconnect_events()
+            self.line_selector = None
+
+    def _get_frame_interval(self):
+        screen = QApplication.primaryScreen()
+        rate = screen.refreshRate() if screen is not None else 0
+        return int(1000 / rate) if rate > 0 else self.DEFAULT_FRAME_INTERVAL
+
+    def on_rectangle_press(self, event):
+        if self.RectangleSelector is None or self.cut_window is None:
+            return
+        # the selector ignores presses outside of the image and in the zoom and pan modes
+        self.dragging_cut = event.button == 1 and not self.RectangleSelector.ignore(event)
+        if self.dragging_cut:
+            self.cut_window.canvas.start_live_update()
+
+    def on_rectangle_move(self, event):
+        if self.dragging_cut and not self.cut_timer.isActive():
+            self.cut_timer.start()
+
+    def on_rectangle_release(self, event):
+        if self.dragging_cut and self.cut_window is not None:
+            self.cut_window.canvas.stop_live_update()
+        self.dragging_cut = False
+
+    def update_live_cut(self):
+        if self.cut_window is None:
+            return
+        if self.line_selector is not None:
+            self.line_coordinates = self.line_selector.coordinates
+        elif self.RectangleSelector is not None:
+            x1, x2, y1, y2 = self.RectangleSelector.extents
+            self.rectangle_coordinates = x1, y1, x2, y2
+        else:
+            return
+        self.cut_window.canvas.update_cut_plot(live=True)
+
     def context_menu(self, event):
         menu = QMenu()
         y = self.parent.parent().height()
@@ -67,6 +229,11 @@ class Axes2D(object):
         reset_action = parameter_menu.addAction("Reset parameters")
         reset_action.triggered.connect(self.reset_parameters)
 
+        fast_rendering_action = parameter_menu.addAction("Fast rendering")
+        fast_rendering_action.setCheckable(True)
+        fast_rendering_action.setChecked(self.fast_rendering)
+        fast_rendering_action.triggered.connect(self.set_fast_rendering)
+
         redraw_action = menu.addAction("Redraw graph")
         redraw_action.triggered.connect(self.redraw_2d_plot)
 
@@ -77,108 +244,228 @@ class Axes2D(object):
         menu.exec_(self.parent.parent().mapToGlobal(position))
 
     def open_colormap_window(self, event):
-        range_init, range_whole = self.Ranges.get_ranges_for_colormap(self.y)
-        self.colormap_window = ColormapWindow(range_init, range_whole, title='Colormap')
+        range_init, range_whole = self.Ranges.get_ranges_for_colormap()
+        self.colormap_window = ColormapWindow(range_init, range_whole, title='Colormap',
+                                              histogram=self.display.get_histogram(self.apply_log_status),
+                                              get_percentiles=partial(self.display.get_percentiles,
+                                                                      log=self.apply_log_status))
         self.colormap_window.set_callback(self.colormap_callback)
         self.colormap_window.show()
 
     def redraw_2d_plot(self):
         self.ax.cla()
-        self.plot_obj = self.ax.imshow(self.y, **self.params_2d)
+        self.detail_obj = None
+        self._connect_view_callbacks()
+        self.plot_obj = self._imshow(self.y, **self.params_2d)
         if self.cut_window:
-            self.set_rectangle()
+            self.set_cut_selector()
+        self.on_view_changed(self.ax)
 
-    def colormap_callback(self, range_):
+    def _imshow(self, data, **params):
+        if self.fast_rendering:
+            return raster_imshow(self.ax, data, **params)
+        return self.ax.imshow(data, **params)
+
+    def set_fast_rendering(self, checked):
+        self.fast_rendering = checked
+        self.redraw_2d_plot()
+        self.parent.draw()
+
+    def colormap_callback(self, range_, percentiles=None):
+        # a preset is applied again to every image shown next
+        self.Ranges.percentiles = percentiles
         self.Ranges.update_params(range_)
         self.redraw_2d_plot()
         self.parent.draw()
 
     def change_log_status(self, event):
         self.apply_log_status = not self.apply_log_status
-        if self.apply_log_status:
-            self.y = self.apply_log(self.data)
-        else:
-            self.y = self.data
+        self.y = self._get_shown_data()
         self.Ranges.change_regime()
+        self.Ranges.update_auto_range()
         self.redraw_2d_plot()
         self.parent.draw()
 
     def reset_parameters(self, event):
         self.apply_log_status = False
+        self.Ranges.percentiles = None
         self.params_2d.pop('vmin', None)
         self.params_2d.pop('vmax', None)
         self.y = self.data
         self.redraw_2d_plot()
         self.parent.draw()
 
-    @staticmethod
-    def apply_log(data):
-        min_value = max([0.1, np.amin(data)])
-        max_value = np.amax(data)
-        return np.log(np.clip(data, min_value, max_value))
+    def _get_display_data(self, data, stats=None):
+        # arrays from the data cache are the same objects when shown again
+        key = id(data)
+        display = self.display_data.get(key)
+        if display is None or display.data is not data:
+            display = self.display_data[key] = DisplayData(data, stats)
+            while len(self.display_data) > self.MAX_DISPLAY_DATA:
+                self.display_data.popitem(last=False)
+        self.display_data.move_to_end(key)
+        return display
 
-    def update_plot(self, obj, file):
-        self.data = obj[()]
-        if self.apply_log_status:
-            self.y = self.apply_log(self.data)
-        else:
-            self.y = self.data
+    def _get_shown_data(self):
+        return self.display.get_log() if self.apply_log_status else self.data
 
-        try:
-            x_ax = file[obj.attrs['x_axis']][()]
-            y_ax = file[obj.attrs['y_axis']][()]
-            assert (len(x_ax), len(y_ax)) == self.y.shape \
-                   or (len(y_ax), len(x_ax)) == self.y.shape, 'shapes are wrong'
-            if (len(y_ax), len(x_ax)) == self.y.shape:
-                y_ax, x_ax = x_ax, y_ax
-            self.x1 = y_ax
-            self.x2 = x_ax
-        except (AssertionError, TypeError, KeyError):
-            self.params_2d.pop('extent', None)
-            self.x1 = list(range(0, self.y.shape[1]))
-            self.x2 = list(range(0, self.y.shape[0]))
-
-        except Exception as er:
-            print(er)
-            return
+    @staticmethod
+    def load_data(obj, file, is_cancelled=None, target_shape=None, with_stats=False):
+        # runs in a worker thread
+        return read_2d(obj, file, is_cancelled, target_shape, with_stats)
 
-        self.params_2d.update(dict(extent=[self.x1[0], self.x1[-1], self.x2[0], self.x2[-1]]))
+    def needs_stats(self):
+        """Whether the next images need their stats, which are then read with them."""
+        return self.Ranges.percentiles is not None
+
+    def update_plot(self, obj, file):
+        self.show_data(self.load_data(obj, file))
+
+    def show_data(self, image, display=None, hold_range=False):
+        """
+        Shows image, with its DisplayData if it was prepared in a worker
+        thread. With hold_range, the colormap range of a percentile preset
+        is not taken again from the new image.
+        """
+        self.image = image
+        self.data, self.x1, self.x2 = image.data, image.x1, image.x2
+        self.detail_loader.cancel()
+        self._remove_detail()
+        self.display = display if display is not None else self._get_display_data(self.data, image.stats)
+        self.y = self._get_shown_data()
+        auto_range = self.Ranges.percentiles is not None and not hold_range
+        if auto_range:
+            self.Ranges.update_auto_range()
+
+        self.params_2d.update(dict(extent=image.extent))
 
         if self.plot_obj is not None:
+            can_blit = self.fast_rendering and self.drawn_view == self._get_view()
             self.plot_obj.set_data(self.y)
-            self.plot_obj.set_extent(self.params_2d['extent'])
-            self.ax.relim()  # Recalculate limits
-            self.ax.autoscale_view(True, True, True)
+            if auto_range:
+                self.plot_obj.set_clim(self.params_2d['vmin'], self.params_2d['vmax'])
+            if can_blit:
+                self._blit_image()
+            else:
+                self.plot_obj.set_extent(self.params_2d['extent'])
+                self.ax.relim()  # Recalculate limits
+                self.ax.autoscale_view(True, True, True)
+                self.parent.draw()
         else:
-            self.plot_obj = self.ax.imshow(self.y, **self.params_2d)
-        self.parent.draw()
+            self.plot_obj = self._imshow(self.y, **self.params_2d)
+            self.parent.draw()
         if self.cut_window:
             self.cut_window.canvas.update_cut_plot()
 
+    def _get_view(self):
+        return self.plot_obj, tuple(self.params_2d.get('extent', ())), self.ax.get_xlim(), self.ax.get_ylim()
+
+    def on_draw(self, event):
+        self.drawn_view = self._get_view() if self.ax.get_visible() and self.plot_obj is not None else None
+
+    def _blit_image(self):
+        # only the inside of the axes changes: the image is drawn over the
+        # last frame, the selectors take it as their background
+        canvas = self.parent
+        renderer = canvas.get_renderer()
+        self.ax.patch.draw(renderer)
+        self.plot_obj.draw(renderer)
+        for spine in self.ax.spines.values():
+            # drawn again outside of the axes, the antialiased edges would darken
+            clip_box, clip_on = spine.get_clip_box(), spine.get_clip_on()
+            spine.set_clip_box(self.ax.bbox)
+            spine.set_clip_on(True)
+            spine.draw(renderer)
+            spine.set_clip_box(clip_box)
+            spine.set_clip_on(clip_on)
+        background = canvas.copy_from_bbox(self.ax.bbox)
+        if self.RectangleSelector is not None:
+            self.RectangleSelector._save_blit_background(background)
+            artists = self.RectangleSelector.artists
+        elif self.line_selector is not None:
+            self.line_selector.background = background
+            artists = self.line_selector.artists
+        else:
+            artists = []
+        for artist in artists:
+            if artist.get_visible():
+                self.ax.draw_artist(artist)
+        canvas.blit(self.ax.bbox)
+
+    def _connect_view_callbacks(self):
+        # cla() drops the callbacks of the axes
+        self.ax.callbacks.connect('xlim_changed', self.on_view_changed)
+        self.ax.callbacks.connect('ylim_changed', self.on_view_changed)
+
+    def on_view_changed(self, ax):
+        if self.image is not None and self.image.step > 1:
+            self.detail_timer.start()
+
+    def load_detail(self):
+        image = self.image
+        if image is None or self.plot_obj is None:
+            return
+        obj, file = image.source
+        r0, r1, c0, c1 = get_region(image.extent, obj.shape, self.ax.get_xlim(), self.ax.get_ylim())
+        bbox = self.ax.get_window_extent()
+        step = get_step((r1 - r0, c1 - c0), (bbox.height, bbox.width))
+        if step >= image.step or r1 <= r0 or c1 <= c0:
+            # the overview is already as fine as the screen
+            self.detail_loader.cancel()
+            if self.detail_obj is not None:
+                self._remove_detail()
+                self.parent.draw_idle()
+            return
+        extent = get_region_extent(image.extent, obj.shape, r0, r1, c0, c1)
+        self.detail_loader.load(partial(self._load_detail, obj, step, (r0, r1), (c0, c1), extent))
+
+    @staticmethod
+    def _load_detail(obj, step, row_range, col_range, extent, is_cancelled):
+        return read_strided(obj, step, row_range, col_range, is_cancelled), extent
+
+    def show_detail(self, result):
+        detail, extent = result
+        if self.apply_log_status:
+            detail = DisplayData(detail).get_log()
+        self._remove_detail()
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        self.detail_obj = self._imshow(detail, extent=extent, norm=self.plot_obj.norm,
+                                       cmap=self.plot_obj.get_cmap())
+        self.ax.set_xlim(xlim, emit=False)
+        self.ax.set_ylim(ylim, emit=False)
+        self.parent.draw_idle()
+
+    def _remove_detail(self):
+        if self.detail_obj is not None:
+            self.detail_obj.remove()
+            self.detail_obj = None
+
     def open_cut_window(self):
         self.cut_window = CutWindow(self)
-        self.set_rectangle()
-        if self.rectangle_coordinates:
+        self.set_cut_selector()
+        if self.get_cut_coordinates():
             self.cut_window.canvas.update_cut_plot()
 
     def on_closing_cut_window(self):
-        self.RectangleSelector.set_visible(False)
-        self.RectangleSelector.update()
-        self.RectangleSelector = None
+        self._hide_selectors()
+        self._remove_selectors()
         self.cut_window = None
 
 
 class Plot2DRangesHandler(object):
-    MIN_LOG_ARG = 0.1
+    MIN_LOG_ARG = DisplayData.MIN_LOG_ARG
     DEFAULT_PARAMS = {}
 
     def __init__(self, plotWidget):
         self.plotWidget = plotWidget
         self.absolute_range = None
         self.log_range = None
+        # (low, high) percent of a colormap preset, or None
+        self.percentiles = None
 
-    def get_ranges_for_colormap(self, data):
-        range_whole = (np.amin(data), np.amax(data))
+    def get_ranges_for_colormap(self):
+        # from the range kept for the shown image, without scanning it again
+        range_whole = self.plotWidget.display.get_range(self.plotWidget.apply_log_status)
         if 'vmax' in self.plotWidget.params_2d:
             range_init = (self.plotWidget.params_2d['vmin'], self.plotWidget.params_2d['vmax'])
         else:
@@ -199,6 +486,12 @@ class Plot2DRangesHandler(object):
         self.plotWidget.params_2d.update({'vmin': range_[0], 'vmax': range_[1]})
         self._update_params()
 
+    def update_auto_range(self):
+        # from the percentiles read with the image, without scanning it
+        if self.percentiles is not None:
+            self.update_params(self.plotWidget.display.get_percentiles(
+                *self.percentiles, log=self.plotWidget.apply_log_status))
+
     def change_regime(self):
         if 'vmax' in self.plotWidget.params_2d:
             if self.plotWidget.apply_log_status:
@@ -226,6 +519,15 @@ class CutWindow(QWidget):
 
 
 class CutCanvas(FigureCanvas):
+    """
+    Cuts are taken from the frame at full resolution. Of an image shown as an
+    overview, the full frame is read in a worker thread, and until it is
+    read the cut of the overview is shown as approximate.
+    """
+    # margin added to the limits while dragging, so that a growing cut stays within them
+    LIVE_MARGIN = 0.25
+    APPROXIMATE_TITLE = 'Approximate cut of the overview, reading the full image...'
+
     def __init__(self, plot2d_canvas, parent=None):
         self.plot2d_canvas = plot2d_canvas
         self.fig = Figure()
@@ -236,21 +538,30 @@ class CutCanvas(FigureCanvas):
         self.ax_cut = self.fig.add_subplot(111)
         self.x, self.y, self.data = [], [], []
         self.cut_y, self.cut_x = [], []
+        self.fit_res = None
+        self.fit_model = DEFAULT_MODEL
         self.cut_plot, = self.ax_cut.plot(self.cut_x, self.cut_y)
         self.plot_list = [self.cut_plot]
+        # while the rectangle is dragged, only the cut is drawn over this background
+        self.background = None
+        self.cut_engine = None
+        self.cut_engine_source = ()
+        # (key, (frame, x axis, y axis)) of the shown overview at full resolution
+        self.full_frame = None
+        self.full_frame_loading = None
+        self.full_frame_loader = DataLoader(self)
+        self.full_frame_loader.loaded.connect(self.on_full_frame_loaded)
+        self.full_frame_loader.failed.connect(print)
+        self.approximate = False
+        self.mpl_connect('draw_event', self.on_draw)
         FigureCanvas.setSizePolicy(self,
                                    QSizePolicy.Expanding,
                                    QSizePolicy.Expanding)
         FigureCanvas.updateGeometry(self)
 
-    @staticmethod
-    def lorentzian(x, a, w, x0):
-        return a / ((x - x0) ** 2 + w)
-
-    def default_fit_function(self, x, central_a, central_w, side_a, side_w, side_x0):
-        return self.lorentzian(x, central_a, central_w, 0) + \
-               self.lorentzian(x, side_a, side_w, side_x0) + \
-               self.lorentzian(x, side_a, side_w, - side_x0)
+    # module functions, so that the worker processes of batch fits can use them
+    lorentzian = staticmethod(lorentzian)
+    default_fit_function = staticmethod(three_lorentzians)
 
     def context_menu(self, event):
         if event.button == 3:
@@ -261,6 +572,15 @@ class CutCanvas(FigureCanvas):
             freeze_cut_action.triggered.connect(self.freeze_cut)
             freeze_cut_action.setEnabled(len(self.cut_y) > 0)
 
+            line_profile_action = menu.addAction(self.tr('Line profile'))
+            line_profile_action.setCheckable(True)
+            line_profile_action.setChecked(self.plot2d_canvas.cut_mode == 'line')
+            line_profile_action.triggered.connect(self.change_cut_mode)
+
+            width_action = menu.addAction(self.tr('Profile width...'))
+            width_action.triggered.connect(self.set_profile_width)
+            width_action.setEnabled(self.plot2d_canvas.cut_mode == 'line')
+
             delete_cuts_action = menu.addAction(self.tr('Delete cuts'))
             delete_cuts_action.triggered.connect(self.delete_cuts)
             delete_cuts_action.setEnabled(len(self.plot_list) > 1)
@@ -279,9 +599,25 @@ class CutCanvas(FigureCanvas):
             menu.addSeparator()
             fit_action = menu.addAction(self.tr('Plot fit'))
             fit_action.triggered.connect(self.get_fit)
-            fit_action.setEnabled(len(self.plot_list) > 0)
+            fit_action.setEnabled(len(self.plot_list) > 0 and not self.approximate)
+
+            fit_model_menu = menu.addMenu(self.tr('Fit model'))
+            for name in MODELS:
+                fit_model_action = fit_model_menu.addAction(name)
+                fit_model_action.setCheckable(True)
+                fit_model_action.setChecked(name == self.fit_model)
+                fit_model_action.triggered.connect(partial(self.set_fit_model, name))
             menu.exec_(self.parent().mapToGlobal(position))
 
+    def change_cut_mode(self, checked):
+        self.plot2d_canvas.set_cut_mode('line' if checked else 'rectangle')
+
+    def set_profile_width(self):
+        width, ok = QInputDialog.getDouble(self, 'Profile width', 'Width of the line profile in axis units:',
+                                           self.plot2d_canvas.line_width, 0, 1e12, 6)
+        if ok:
+            self.plot2d_canvas.set_line_width(width)
+
     def change_log_status(self):
         if self.apply_log_status:
             self._disable_log()
@@ -312,16 +648,20 @@ class CutCanvas(FigureCanvas):
         self.ax_cut.autoscale_view(True, True, True)
         self.draw()
 
+    def set_fit_model(self, name, checked=True):
+        self.fit_model = name
+        self.fit_res = None
+
     def get_fit(self):
         try:
-            self.fit_res = curve_fit(self.default_fit_function, self.cut_x, self.cut_y)
-            print(self.fit_res[0])
-            fitted_y = self.default_fit_function(np.array(self.cut_x), *self.fit_res[0])
+            self.fit_res = fit_profile(self.fit_model, self.cut_x, self.cut_y)
+            print(dict(zip(get_parameter_names(self.fit_model), self.fit_res[0])))
+            fitted_y = MODELS[self.fit_model].function(np.array(self.cut_x), *self.fit_res[0])
             self.plot_list.append(self.ax_cut.plot(self.cut_x, fitted_y, '--')[0])
             self.ax_cut.relim()  # Recalculate limits
             self.ax_cut.autoscale_view(True, True, True)
             self.draw()
-        except RuntimeError as er:
+        except (RuntimeError, ValueError) as er:
             QMessageBox.question(self.plot2d_canvas.parent, 'Fit error',
                                  f'Error while fitting occured: {er}',
                                  QMessageBox.Ok)
@@ -334,36 +674,113 @@ class CutCanvas(FigureCanvas):
         self.ax_cut.autoscale_view(True, True, True)
         self.draw()
 
-    def update_cut_plot(self):
-        frame = self.plot2d_canvas.data
-        x1, y1, x2, y2 = self.plot2d_canvas.rectangle_coordinates
-        x1, x2 = min([x1, x2]), max([x1, x2])
-        y1, y2 = min([y1, y2]), max([y1, y2])
-        print(f'x: {x1} {x2}; y: {y1} {y2}')
-        x_ind = np.where(self.plot2d_canvas.x1 > x1,
-                         np.where(self.plot2d_canvas.x1 < x2,
-                                  True, False), False)
-        y_ind = np.flip(np.where(self.plot2d_canvas.x2 > y1,
-                                 np.where(self.plot2d_canvas.x2 < y2,
-                                          True, False), False), axis=0)
-        try:
-            frame = frame[y_ind, :]
-            frame = frame[:, x_ind]
-        except Exception as er:
-            print(er)
-            return
+    def start_live_update(self):
+        self.cut_plot.set_animated(True)
+        self.draw()
 
-        if abs(y2 - y1) < abs(x2 - x1):
-            mean_axis = 0
-            self.cut_x = np.linspace(x1, x2, frame.shape[1])
-        else:
-            mean_axis = 1
-            self.cut_x = np.linspace(y1, y2, frame.shape[0])
+    def stop_live_update(self):
+        # the cut is in the canvas already, it is drawn as usual from now on
+        self.cut_plot.set_animated(False)
+        self.background = None
+
+    def on_draw(self, event):
+        if self.cut_plot.get_animated():
+            self.background = self.copy_from_bbox(self.ax_cut.bbox)
+            self.ax_cut.draw_artist(self.cut_plot)
+
+    def _is_cut_in_view(self):
+        if not len(self.cut_y):
+            return False
+        x_min, x_max = sorted(self.ax_cut.get_xlim())
+        y_min, y_max = sorted(self.ax_cut.get_ylim())
+        return x_min <= np.min(self.cut_x) and np.max(self.cut_x) <= x_max and \
+            y_min <= np.nanmin(self.cut_y) and np.nanmax(self.cut_y) <= y_max
+
+    def _add_live_margin(self):
+        x_min, x_max = self.ax_cut.get_xlim()
+        margin = (x_max - x_min) * self.LIVE_MARGIN
+        self.ax_cut.set_xlim(x_min - margin, x_max + margin)
+        if not self.apply_log_status:
+            y_min, y_max = self.ax_cut.get_ylim()
+            margin = (y_max - y_min) * self.LIVE_MARGIN
+            self.ax_cut.set_ylim(y_min - margin, y_max + margin)
 
-        self.cut_y = np.mean(frame, axis=mean_axis)
+    @staticmethod
+    def _get_frame_key(obj):
+        return obj.file.filename, obj.name, obj.shape
+
+    def _get_cut_source(self):
+        # the frame, x and y axes of the cuts and whether they are at full resolution
+        canvas = self.plot2d_canvas
+        image = canvas.image
+        if image is None or image.step == 1 or image.source is None:
+            return (canvas.data, canvas.x1, canvas.x2), True
+        obj, file = image.source
+        key = self._get_frame_key(obj)
+        if self.full_frame is not None and self.full_frame[0] == key:
+            return self.full_frame[1], True
+        if self.full_frame_loading != key:
+            self.full_frame_loading = key
+            self.full_frame_loader.load(partial(self._load_full_frame, obj, file, key))
+        return (canvas.data, canvas.x1, canvas.x2), False
+
+    @staticmethod
+    def _load_full_frame(obj, file, key, is_cancelled):
+        # runs in a worker thread, the frame is kept in data_cache
+        data = read_array(obj, is_cancelled)
+        x1, x2 = get_2d_axes(obj, file, obj.shape)
+        return key, (data, x1, x2)
+
+    def on_full_frame_loaded(self, result):
+        key, source = result
+        self.full_frame_loading = None
+        self.full_frame = key, source
+        self.update_cut_plot()
+
+    def get_cut_engine(self):
+        # the prefix sums are kept while the same frame is shown
+        source, exact = self._get_cut_source()
+        if self.cut_engine is None or any(old is not new for old, new in zip(self.cut_engine_source, source)):
+            self.cut_engine = CutEngine(*source)
+            self.cut_engine_source = source
+        return self.cut_engine, exact
+
+    def _set_approximate(self, approximate):
+        self.approximate = approximate
+        self.ax_cut.set_title(self.APPROXIMATE_TITLE if approximate else '', color='tab:red')
+
+    def update_cut_plot(self, live=False):
+        canvas = self.plot2d_canvas
+        coordinates = canvas.get_cut_coordinates()
+        if coordinates is None:
+            self.cut_x, self.cut_y = [], []
+        else:
+            try:
+                engine, exact = self.get_cut_engine()
+                if exact == self.approximate:
+                    # the title is drawn with the whole figure
+                    self._set_approximate(not exact)
+                    live = False
+                if canvas.cut_mode == 'line':
+                    self.cut_x, self.cut_y = engine.get_line_profile(*coordinates, canvas.line_width)
+                else:
+                    self.cut_x, self.cut_y = engine.get_cut(*coordinates)
+            except ValueError as er:
+                print(er)
+                return
         assert len(self.cut_y) == len(self.cut_x), 'cut axis lengths are wrong'
         self.cut_plot.set_ydata(self.cut_y)
         self.cut_plot.set_xdata(self.cut_x)
+        if live and self.background is not None and self._is_cut_in_view():
+            self.restore_region(self.background)
+            self.ax_cut.draw_artist(self.cut_plot)
+            self.blit(self.ax_cut.bbox)
+            return
         self.ax_cut.relim()  # Recalculate limits
         self.ax_cut.autoscale_view(True, True, True)
-        self.draw()
+        if live:
+            # while dragging, the limits change only when the cut leaves them
+            self._add_live_margin()
+            self.draw_idle()
+        else:
+            self.draw()
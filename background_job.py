@@ -0,0 +1,93 @@
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal
+
+from myGUIApplication_ver2.h5_transfer import TransferCancelled
+
+__all__ = ['BackgroundJob']
+
+PROGRESS_STEPS = 1000
+
+
+class _JobSignals(QObject):
+    progress = pyqtSignal(int, str)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class _JobTask(QRunnable):
+    def __init__(self, job, signals):
+        super(_JobTask, self).__init__()
+        self.setAutoDelete(False)
+        self.job = job
+        self.signals = signals
+        self.cancelled = False
+
+    def progress(self, done, total, message=''):
+        steps = int(PROGRESS_STEPS * done / total) if total else 0
+        self.signals.progress.emit(min(steps, PROGRESS_STEPS), message)
+
+    def run(self):
+        try:
+            result = self.job(self.progress, lambda: self.cancelled)
+        except TransferCancelled:
+            self.signals.cancelled.emit()
+        except Exception as err:
+            self.signals.failed.emit(str(err))
+        else:
+            self.signals.finished.emit(result)
+
+
+class BackgroundJob(QObject):
+    """
+    Runs job(progress, is_cancelled) in the global thread pool behind a
+    modal progress dialog with a cancel button.
+    """
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, title, job, parent=None):
+        super(BackgroundJob, self).__init__(parent)
+        self.title = title
+        self.dialog = QtWidgets.QProgressDialog(title, 'Cancel', 0, PROGRESS_STEPS, parent)
+        self.dialog.setWindowModality(Qt.WindowModal)
+        self.dialog.setAutoClose(False)
+        self.dialog.setAutoReset(False)
+        self.dialog.setMinimumDuration(300)
+        self.dialog.canceled.connect(self.cancel)
+        self.signals = _JobSignals(self)
+        self.signals.progress.connect(self._on_progress)
+        self.signals.finished.connect(self._on_finished)
+        self.signals.failed.connect(self._on_failed)
+        self.signals.cancelled.connect(self._on_cancelled)
+        self.task = _JobTask(job, self.signals)
+
+    def start(self):
+        self.dialog.setValue(0)
+        QThreadPool.globalInstance().start(self.task)
+
+    def cancel(self):
+        self.task.cancelled = True
+        self.dialog.setLabelText(f'{self.title}\nCancelling...')
+
+    def _on_progress(self, value, message):
+        if message:
+            self.dialog.setLabelText(f'{self.title}\n{message}')
+        self.dialog.setValue(value)
+
+    def _close_dialog(self):
+        self.dialog.canceled.disconnect(self.cancel)
+        self.dialog.close()
+
+    def _on_finished(self, result):
+        self._close_dialog()
+        self.finished.emit(result)
+
+    def _on_failed(self, message):
+        self._close_dialog()
+        self.failed.emit(message)
+
+    def _on_cancelled(self):
+        self._close_dialog()
+        self.cancelled.emit()
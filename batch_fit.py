@@ -0,0 +1,200 @@
+import multiprocessing
+import os
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+import h5py
+
+from myGUIApplication_ver2.cut_engine import CutEngine, get_order, get_bounds
+from myGUIApplication_ver2.fit_models import fit_profiles, get_parameter_names
+from myGUIApplication_ver2.h5_transfer import TransferCancelled
+from myGUIApplication_ver2.plot_data import get_2d_axes
+from myGUIApplication_ver2.tree_cache import list_link_names
+
+__all__ = ['FitSetup', 'RESULTS_NAME', 'RESULT_DATASETS', 'get_frame_names', 'read_profile',
+           'get_resume_state', 'batch_fit']
+
+# the group of the results, inside the fitted group
+RESULTS_NAME = 'batch_fit'
+RESULT_DATASETS = ['params', 'errors', 'done', 'names']
+# frames fitted one after another by a worker, each from the last fit
+CHUNK_FRAMES = 32
+
+# the cut mode, 'rectangle' or 'line', its (x1, y1, x2, y2) and width,
+# the name of the model in fit_models.MODELS and its initial parameters or None
+FitSetup = namedtuple('FitSetup', 'mode coordinates width model p0')
+
+
+def get_frame_names(group):
+    """Names of the images in group, in the order of its links."""
+    names = []
+    for name in list_link_names(group.id):
+        obj = group.get(name)
+        if isinstance(obj, h5py.Dataset) and obj.ndim == 2 and obj.dtype.kind in 'biuf':
+            names.append(name)
+    return names
+
+
+def read_profile(obj, file, setup):
+    """
+    The cut of setup through an image at full resolution, as the cut window
+    computes it. Of a rectangle, only the pixels inside it are read.
+    """
+    x_axis, y_axis = get_2d_axes(obj, file, obj.shape)
+    if setup.mode == 'line':
+        return CutEngine(obj[()], x_axis, y_axis).get_line_profile(*setup.coordinates, setup.width)
+    x1, y1, x2, y2 = setup.coordinates
+    # rows go from the top, from the last value of the y axis
+    rows_axis = y_axis[::-1]
+    x_order, y_order = get_order(x_axis), get_order(rows_axis)
+    if not x_order or not y_order:
+        return CutEngine(obj[()], x_axis, y_axis).get_cut(*setup.coordinates)
+    c0, c1 = get_bounds(x_axis, x_order, min(x1, x2), max(x1, x2))
+    r0, r1 = get_bounds(rows_axis, y_order, min(y1, y2), max(y1, y2))
+    region = obj[r0:r1, c0:c1]
+    return CutEngine(region, x_axis[c0:c1], rows_axis[r0:r1][::-1]).get_cut(*setup.coordinates)
+
+
+def _matches(results, names, setup):
+    try:
+        attrs = results.attrs
+        return attrs['mode'] == setup.mode and attrs['model'] == setup.model and \
+            np.allclose(attrs['coordinates'], setup.coordinates) and attrs['width'] == setup.width and \
+            list(results['names'].asstr()[()]) == names
+    except (KeyError, TypeError, ValueError):
+        return False
+
+
+def get_resume_state(group, names, setup):
+    """
+    The number of frames of group already fitted with setup, or None if the
+    results in group are of another setup or other frames.
+    """
+    results = group.get(RESULTS_NAME)
+    if results is None:
+        return 0
+    if not _matches(results, names, setup):
+        return None
+    return int(np.count_nonzero(results['done'][()]))
+
+
+def _create_results(group, names, setup):
+    if RESULTS_NAME in group:
+        del group[RESULTS_NAME]
+    results = group.create_group(RESULTS_NAME)
+    shape = (len(names), len(get_parameter_names(setup.model)))
+    results.create_dataset('params', shape, dtype=float, fillvalue=np.nan)
+    results.create_dataset('errors', shape, dtype=float, fillvalue=np.nan)
+    results.create_dataset('done', (len(names),), dtype=bool)
+    results.create_dataset('names', data=np.array(names, dtype=object), dtype=h5py.string_dtype())
+    results.attrs['mode'] = setup.mode
+    results.attrs['coordinates'] = np.asarray(setup.coordinates, dtype=float)
+    results.attrs['width'] = setup.width
+    results.attrs['model'] = setup.model
+    results.attrs['parameters'] = np.array(get_parameter_names(setup.model), dtype=h5py.string_dtype())
+    return results
+
+
+def _get_segments(todo, n_segments):
+    """
+    Runs of consecutive frames, split into at most about n_segments segments
+    of whole chunks. The chunks of a segment are fitted one after another,
+    each from the last fit of the chunk before it, the segments at once.
+    """
+    runs = [run for run in np.split(todo, np.flatnonzero(np.diff(todo) != 1) + 1) if len(run)]
+    n_chunks = -(-len(todo) // CHUNK_FRAMES)
+    segment_frames = max(1, -(-n_chunks // max(1, n_segments))) * CHUNK_FRAMES
+    segments = []
+    for run in runs:
+        for start in range(0, len(run), segment_frames):
+            segment = run[start:start + segment_frames]
+            segments.append([segment[chunk:chunk + CHUNK_FRAMES] for chunk in range(0, len(segment), CHUNK_FRAMES)])
+    return segments
+
+
+def _get_warm_start(results, frame, p0):
+    # a segment starts from the frame before, if it is fitted already
+    if frame > 0 and results['done'][frame - 1]:
+        params = results['params'][frame - 1]
+        if np.isfinite(params).all():
+            return params
+    return p0
+
+
+def batch_fit(group, setup, progress=None, is_cancelled=None, max_workers=None):
+    """
+    Fits the cut of setup through every image in group, in a pool of
+    processes, and writes the parameters, their errors and the mask of
+    fitted frames to group/RESULTS_NAME. Every fit starts from the fit of
+    the frame before, except the first frames of the segments that the
+    processes fit at once, which start from setup.p0, the last fit of the
+    cut window. The results are flushed after every chunk of frames, so
+    that a cancelled or interrupted fit of the same setup is resumed. The
+    file is read and written only by this thread.
+    Returns the name of the results group, the number of fitted frames and
+    the number of frames that could not be fitted.
+    """
+    names = get_frame_names(group)
+    results = group.get(RESULTS_NAME)
+    if results is None or not _matches(results, names, setup):
+        results = _create_results(group, names, setup)
+    file = group.file
+    finished = int(np.count_nonzero(results['done'][()]))
+    workers = max_workers or os.cpu_count() or 1
+    segments = [iter(chunks) for chunks in _get_segments(np.flatnonzero(~results['done'][()]), workers)]
+    waiting = deque(range(len(segments)))
+
+    def read_chunk(segment):
+        chunk = next(segments[segment], None)
+        if chunk is None:
+            return None
+        if is_cancelled is not None and is_cancelled():
+            raise TransferCancelled()
+        return chunk, [read_profile(group[names[frame]], file, setup) for frame in chunk]
+
+    # forking would copy the threads of the GUI
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(workers, mp_context=context) as executor:
+        pending = {}
+        # the next chunk of every running segment, read while the fits run
+        ahead = {}
+
+        def submit(segment, chunk, profiles, p0):
+            pending[executor.submit(fit_profiles, setup.model, profiles, p0)] = segment, chunk, p0
+
+        try:
+            while True:
+                while len(pending) < workers and waiting:
+                    segment = waiting.popleft()
+                    item = read_chunk(segment)
+                    if item is not None:
+                        submit(segment, *item, _get_warm_start(results, item[0][0], setup.p0))
+                if not pending:
+                    break
+                for segment, _, _ in list(pending.values()):
+                    if segment not in ahead:
+                        ahead[segment] = read_chunk(segment)
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    segment, chunk, p0 = pending.pop(future)
+                    params, errors = future.result()
+                    frames = slice(chunk[0], chunk[-1] + 1)
+                    results['params'][frames] = params
+                    results['errors'][frames] = errors
+                    results['done'][frames] = True
+                    file.flush()
+                    finished += len(chunk)
+                    if progress is not None:
+                        progress(finished, len(names), message=f'{finished}/{len(names)} frames')
+                    fitted = params[np.isfinite(params).all(axis=1)]
+                    item = ahead.pop(segment) if segment in ahead else read_chunk(segment)
+                    if item is not None:
+                        submit(segment, *item, fitted[-1] if len(fitted) else p0)
+                if is_cancelled is not None and is_cancelled():
+                    raise TransferCancelled()
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    failed = int(np.count_nonzero(~np.isfinite(results['params'][()]).all(axis=1) & results['done'][()]))
+    return results.name, finished, failed
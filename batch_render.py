@@ -0,0 +1,199 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import h5py
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from myGUIApplication_ver2.data_cache import data_cache
+from myGUIApplication_ver2.plot_data import read_1d, read_2d, read_envelope, get_x_axis_dataset, DisplayData
+from myGUIApplication_ver2.raster_image import raster_imshow
+
+__all__ = ['get_dataset_paths', 'get_output_path', 'read_render_options', 'write_render_options',
+           'is_up_to_date', 'render_dataset', 'render_datasets', 'batch_render', 'run_batch_render']
+
+# traces with more samples per pixel are drawn as a min/max envelope, as in Axes1D
+MIN_SAMPLES_PER_BIN = 4
+# datasets rendered by a worker with the file opened once
+CHUNK_DATASETS = 16
+# the cache of a worker keeps the axes that several datasets refer to
+WORKER_CACHE_BYTES = 64 * 1024 ** 2
+DEFAULT_SIZE = (6.4, 4.8)
+DEFAULT_DPI = 100
+# the options each png of out_dir was rendered with, by dataset path
+OPTIONS_NAME = '.batch_render.json'
+
+
+def get_dataset_paths(group):
+    """Paths of the numeric 1d and 2d datasets in group and below it."""
+    paths = []
+
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset) and obj.ndim in (1, 2) and obj.size and obj.dtype.kind in 'biuf':
+            paths.append(obj.name)
+
+    group.visititems(visit)
+    return paths
+
+
+def get_output_path(out_dir, path):
+    """The png of a dataset, in the hierarchy of the file under out_dir."""
+    return os.path.join(out_dir, *path.strip('/').split('/')) + '.png'
+
+
+def read_render_options(out_dir):
+    try:
+        with open(os.path.join(out_dir, OPTIONS_NAME)) as options_file:
+            return json.load(options_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_render_options(out_dir, rendered_options):
+    path = os.path.join(out_dir, OPTIONS_NAME)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(out_dir, exist_ok=True)
+        with open(tmp_path, 'w') as options_file:
+            json.dump(rendered_options, options_file)
+        os.replace(tmp_path, path)
+    except OSError as err:
+        print(f'Could not save render options {path}: {err}')
+
+
+def is_up_to_date(output, source_mtime_ns, options=None, rendered_options=None):
+    """Whether output is newer than the file and was rendered with the same options."""
+    if options != rendered_options:
+        return False
+    try:
+        return os.stat(output).st_mtime_ns >= source_mtime_ns
+    except OSError:
+        return False
+
+
+def render_dataset(fig, obj, file, log=False):
+    """
+    Draws a dataset on fig as the plot does: a trace over its x_axis, or an
+    image in the extent of its x_axis and y_axis, read at the resolution
+    of the figure.
+    """
+    ax = fig.add_subplot(111)
+    width, height = int(fig.bbox.width), int(fig.bbox.height)
+    if obj.ndim == 1:
+        if obj.shape[0] <= MIN_SAMPLES_PER_BIN * width:
+            x, y = read_1d(obj, file)
+        else:
+            trace = read_envelope(obj, width, x_obj=get_x_axis_dataset(obj, file))
+            x, y = trace.x, trace.y
+        ax.plot(x, y)
+    else:
+        image = read_2d(obj, file, target_shape=(height, width), with_stats=False)
+        data = DisplayData(image.data).get_log() if log else image.data
+        raster_imshow(ax, data, extent=image.extent)
+    ax.set_title(obj.name)
+    return ax
+
+
+def _init_worker():
+    data_cache.set_max_bytes(WORKER_CACHE_BYTES)
+
+
+def render_datasets(filename, paths, out_dir, size=DEFAULT_SIZE, dpi=DEFAULT_DPI, log=False):
+    """
+    Renders datasets of a file to png files under out_dir. Runs in the
+    worker processes of batch_render, without Qt. Returns the error
+    message of every dataset, None for the rendered ones.
+    """
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    errors = []
+    with h5py.File(filename, 'r') as file:
+        for path in paths:
+            fig.clear()
+            output = get_output_path(out_dir, path)
+            try:
+                render_dataset(fig, file[path], file, log)
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+                # a partly written png would look up to date
+                tmp_output = f'{output}.{os.getpid()}.tmp.png'
+                fig.savefig(tmp_output, dpi=dpi)
+                os.replace(tmp_output, output)
+            except (OSError, ValueError, TypeError, KeyError, IndexError) as err:
+                errors.append(f'{path}: {err}')
+            else:
+                errors.append(None)
+    return errors
+
+
+def batch_render(filename, out_dir, root='/', max_workers=None, size=DEFAULT_SIZE, dpi=DEFAULT_DPI, log=False,
+                 force=False, progress=print):
+    """
+    Renders every 1d and 2d dataset of a file under root to png files under
+    out_dir, in a pool of processes. Outputs newer than the file and
+    rendered with the same size, dpi and log are kept, unless force is
+    true. The options are kept in OPTIONS_NAME in out_dir. Returns the numbers of rendered, skipped and
+    failed datasets and the time it took.
+    """
+    start_time = time.perf_counter()
+    with h5py.File(filename, 'r') as file:
+        paths = get_dataset_paths(file[root]) if isinstance(file[root], h5py.Group) else [file[root].name]
+    source_mtime_ns = os.stat(filename).st_mtime_ns
+    options = {'size': list(size), 'dpi': dpi, 'log': log}
+    rendered_options = read_render_options(out_dir)
+    todo = [path for path in paths if force or not is_up_to_date(get_output_path(out_dir, path), source_mtime_ns,
+                                                                 options, rendered_options.get(path))]
+    skipped = len(paths) - len(todo)
+    rendered, failed = 0, 0
+    if todo:
+        workers = min(max_workers or os.cpu_count() or 1, -(-len(todo) // CHUNK_DATASETS))
+        # as in batch_fit, h5py is not safe to use in forked processes
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker) as executor:
+            futures = {executor.submit(render_datasets, filename, todo[start:start + CHUNK_DATASETS], out_dir,
+                                       size, dpi, log): todo[start:start + CHUNK_DATASETS]
+                       for start in range(0, len(todo), CHUNK_DATASETS)}
+            try:
+                for future in as_completed(futures):
+                    for path, error in zip(futures[future], future.result()):
+                        if error is None:
+                            rendered += 1
+                            rendered_options[path] = options
+                        else:
+                            failed += 1
+                            progress(error)
+                    elapsed = time.perf_counter() - start_time
+                    progress(f'{rendered + failed}/{len(todo)} datasets, {rendered / elapsed:.1f} files/s')
+            finally:
+                # also after an interrupt, for the pngs that were written
+                write_render_options(out_dir, rendered_options)
+    return rendered, skipped, failed, time.perf_counter() - start_time
+
+
+def run_batch_render(argv=None):
+    parser = argparse.ArgumentParser(description='Renders the 1d and 2d datasets of an h5 file to png files.')
+    parser.add_argument('filename', help='h5 file')
+    parser.add_argument('root', nargs='?', default='/', help='group or dataset to render, the whole file by default')
+    parser.add_argument('-o', '--out-dir', help='output directory, <file name>_png next to the file by default')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('--size', type=float, nargs=2, default=DEFAULT_SIZE, metavar=('WIDTH', 'HEIGHT'),
+                        help='figure size in inches')
+    parser.add_argument('--dpi', type=int, default=DEFAULT_DPI)
+    parser.add_argument('--log', action='store_true', help='show the log of images')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='render again the outputs that are newer than the file and have the same options')
+    args = parser.parse_args(argv)
+    out_dir = args.out_dir or os.path.splitext(args.filename)[0] + '_png'
+    rendered, skipped, failed, elapsed = batch_render(args.filename, out_dir, args.root, args.workers,
+                                                      tuple(args.size), args.dpi, args.log, args.force)
+    print(f'{rendered} rendered, {skipped} up to date, {failed} failed in {elapsed:.1f} s, '
+          f'{rendered / max(elapsed, 1e-6):.1f} files/s, to {out_dir}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    import sys
+
+    sys.exit(run_batch_render())
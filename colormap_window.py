@@ -1,38 +1,115 @@
 import sys
+import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 __all__ = ['ColormapWindow']
 
 SIZE_ = (800, 30)
+HISTOGRAM_HEIGHT = 80
+PRESETS_HEIGHT = 25
+# low and high percent of the pixels
+PERCENTILE_PRESETS = [(0, 100), (0.1, 99.9), (1, 99), (5, 95)]
 
 
 class ColormapWindow(QtWidgets.QWidget):
+    """
+    The range slider of the colormap, with the histogram of the image above
+    it and buttons for percentile presets, if they are given. The callback
+    is called as callback(range) after the slider is moved and as
+    callback(range, (low, high)) after a preset is chosen.
+    """
     clicked = QtCore.pyqtSignal()
 
-    def __init__(self, range_init, range_whole, title=None):
+    def __init__(self, range_init, range_whole, title=None, histogram=None, get_percentiles=None):
         self.callback = lambda *x: None
         self.range_init = range_init
+        self.last_range = None
+        # get_percentiles(low, high) returns the range of a preset
+        self.get_percentiles = get_percentiles
         super(ColormapWindow, self).__init__()
 
-        self.setFixedSize(*SIZE_)
         self.title = title or "Colormap"
         self.setWindowTitle(self.title)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.setSpacing(0)
         self.range_slider = QRangeSlider(range_whole, title=title, parent=self)
+        self.range_slider.setFixedHeight(SIZE_[1])
+        height = SIZE_[1]
+        if histogram is not None:
+            self.histogram = Histogram(self.range_slider, histogram, parent=self)
+            self.histogram.setFixedHeight(HISTOGRAM_HEIGHT)
+            layout.addWidget(self.histogram)
+            height += HISTOGRAM_HEIGHT
+        layout.addWidget(self.range_slider)
+        if get_percentiles is not None:
+            presets_layout = QtWidgets.QHBoxLayout()
+            for low, high in PERCENTILE_PRESETS:
+                button = QtWidgets.QPushButton(f'{low:g} - {high:g}%' if (low, high) != (0, 100) else 'Min - max')
+                button.setFixedHeight(PRESETS_HEIGHT)
+                button.clicked.connect(lambda checked, percentiles=(low, high): self.set_percentiles(percentiles))
+                presets_layout.addWidget(button)
+            layout.addLayout(presets_layout)
+            height += PRESETS_HEIGHT
+        self.setFixedSize(SIZE_[0], height)
         self.installEventFilter(self)
 
     def show(self):
         super(ColormapWindow, self).show()
         self.range_slider.setRange(*self.range_init)
+        self.last_range = self.range_slider.getRange()
 
     def set_callback(self, callback):
         self.callback = callback
 
+    def set_percentiles(self, percentiles):
+        self.range_slider.setRange(*self.get_percentiles(*percentiles))
+        self.last_range = self.range_slider.getRange()
+        self.callback(self.last_range, percentiles)
+
     def eventFilter(self, QObject, event):
         if event.type() in [76, 77]:
-            self.callback(self.range_slider.getRange())
+            # these come on every repaint, the plot is redrawn only if the range is moved
+            range_ = self.range_slider.getRange()
+            if range_ != self.last_range:
+                self.last_range = range_
+                self.callback(range_)
         return False
 
 
+class Histogram(QtWidgets.QWidget):
+    """Counts on a log scale over the range of the slider, with its start and end marked."""
+
+    def __init__(self, slider, histogram, parent=None):
+        super(Histogram, self).__init__(parent)
+        self.slider = slider
+        self.counts, self.edges = histogram
+        self.slider.startValueChanged.connect(lambda value: self.update())
+        self.slider.endValueChanged.connect(lambda value: self.update())
+
+    def paintEvent(self, event):
+        qp = QtGui.QPainter()
+        qp.begin(self)
+        qp.fillRect(self.rect(), QtGui.QColor(34, 34, 34))
+        src = (self.slider.min(), self.slider.max())
+        if src[1] > src[0]:
+            dst = (0, self.width())
+            heights = np.log1p(self.counts)
+            heights = heights / max(heights.max(), 1) * self.height()
+            left = scale(self.edges[:-1], src, dst)
+            right = scale(self.edges[1:], src, dst)
+            qp.setPen(QtCore.Qt.NoPen)
+            qp.setBrush(QtGui.QColor(150, 150, 150))
+            for x0, x1, height in zip(left, right, heights):
+                qp.drawRect(QtCore.QRectF(x0, self.height() - height, max(x1 - x0, 1), height))
+            qp.setPen(QtGui.QColor(202, 170, 85))
+            for value in self.slider.getRange():
+                if value is not None:
+                    x = int(scale(value, src, dst))
+                    qp.drawLine(x, 0, x, self.height())
+        qp.end()
+
+
 DEFAULT_CSS = """
 QRangeSlider * {
     border: 0px;
@@ -302,7 +379,8 @@ class QRangeSlider(QtWidgets.QWidget, Ui_Form):
         self._handle.setStyleSheet(style)
 
     def _valueToPos(self, value):
-        return scale(value, (self.min(), self.max()), (0, self.width()))
+        # splitter positions are whole pixels
+        return int(scale(value, (self.min(), self.max()), (0, self.width())))
 
     def _posToValue(self, xpos):
         return scale(xpos, (0, self.width()), (self.min(), self.max()))
@@ -8,8 +8,12 @@ data1 = f.create_dataset('data1', data=np.ones(10))
 group_1.create_dataset('data0', data=np.zeros(10))
 d1 = group_1.create_dataset('data_s', data=[b'1', b'2'])
 data1.attrs['ref_1'] = group_1.ref
+# listed by the tree, but cannot be opened
+group_1['dangling'] = h5py.SoftLink('/missing')
+group_1['dangling_external'] = h5py.ExternalLink('missing.h5', '/data')
 f.close()
 
 f = h5py.File('test.h5', 'r')
 print(f[f['data1'].attrs['ref_1']])
+print(f['first group'].get('dangling'), f['first group'].get('dangling_external'))
 f.close()
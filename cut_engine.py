@@ -0,0 +1,209 @@
+import numpy as np
+
+__all__ = ['CutEngine', 'get_order', 'get_bounds']
+
+
+def get_order(axis):
+    """1 for an increasing axis, -1 for a decreasing one and 0 otherwise."""
+    if len(axis) < 2 or np.all(axis[1:] >= axis[:-1]):
+        return 1
+    if np.all(axis[1:] <= axis[:-1]):
+        return -1
+    return 0
+
+
+def get_spacing(axis):
+    """First value and step of an evenly spaced axis, or None."""
+    if len(axis) < 2:
+        return None
+    step = (axis[-1] - axis[0]) / (len(axis) - 1)
+    if step != 0 and np.allclose(np.diff(axis), step, rtol=1e-6, atol=0):
+        return axis[0], step
+    return None
+
+
+def get_bounds(axis, order, low, high):
+    """Start and stop of the indices of a monotonic axis with low < value < high."""
+    if order < 0:
+        start, stop = get_bounds(axis[::-1], 1, low, high)
+        return len(axis) - stop, len(axis) - start
+    start = int(np.searchsorted(axis, low, 'right'))
+    return start, max(start, int(np.searchsorted(axis, high, 'left')))
+
+
+class CutEngine(object):
+    """
+    Averaged profiles of rectangles of a frame shown by imshow with the
+    upper origin, as the cut window draws them. The first profile of a frame,
+    often the only one while frames are stepped through, is averaged over
+    its rectangle. For the next ones, prefix sums of the frame along each
+    axis are computed once, so that the profile of any rectangle costs
+    O(length) and the frame is not copied.
+    Line profiles at any angle are sampled by bilinear interpolation.
+    """
+    # at most this many samples across the width of a line profile
+    MAX_WIDTH_SAMPLES = 256
+
+    def __init__(self, frame, x_axis, y_axis):
+        frame = np.asarray(frame)
+        if frame.ndim != 2 or frame.shape != (len(y_axis), len(x_axis)):
+            raise ValueError(f'frame of shape {frame.shape} does not match the axes '
+                             f'({len(y_axis)}, {len(x_axis)})')
+        # contiguous, for the flat gathers of line profiles
+        self.frame = np.ascontiguousarray(frame)
+        self.x_axis = np.asarray(x_axis)
+        # rows go from the top, from the last value of the y axis
+        self.y_axis = np.asarray(y_axis)[::-1]
+        self.x_order = get_order(self.x_axis)
+        self.y_order = get_order(self.y_axis)
+        self.x_spacing = get_spacing(self.x_axis) if self.x_order else None
+        self.y_spacing = get_spacing(self.y_axis) if self.y_order else None
+        self.sums = {}
+        self.nan_counts = {}
+        self.n_cuts = 0
+        # sample grids of line profiles by their number of samples
+        self.grids = {}
+        self.has_nans = frame.dtype.kind in 'fc' and bool(np.isnan(frame).any())
+
+    def _get_sums(self, axis):
+        if axis not in self.sums:
+            frame = self.frame
+            if self.has_nans:
+                nans = np.isnan(frame)
+                frame = np.where(nans, 0, frame)
+                self.nan_counts[axis] = self._prefix_sum(nans, axis, np.int64)
+            self.sums[axis] = self._prefix_sum(frame, axis, np.result_type(frame.dtype, np.float64))
+        return self.sums[axis]
+
+    @staticmethod
+    def _prefix_sum(frame, axis, dtype):
+        shape = list(frame.shape)
+        shape[axis] += 1
+        out = np.zeros(shape, dtype=dtype)
+        if axis == 1:
+            np.cumsum(frame, axis=1, dtype=dtype, out=out[:, 1:])
+            return out
+        # cumsum along the first axis is many times slower than adding rows
+        for row in range(frame.shape[0]):
+            np.add(out[row], frame[row], out=out[row + 1])
+        return out
+
+    def _mean(self, axis, start, stop, other_range):
+        length = stop - start
+        if length <= 0:
+            return np.full(other_range[1] - other_range[0], np.nan)
+        other = slice(*other_range)
+        self.n_cuts += 1
+        if self.n_cuts == 1 and axis not in self.sums:
+            # any NaN in the rectangle makes its mean NaN, as with the sums
+            region = self.frame[start:stop, other] if axis == 0 else self.frame[other, start:stop]
+            return region.sum(axis=axis, dtype=np.result_type(self.frame.dtype, np.float64)) / length
+        sums = self._get_sums(axis)
+        if axis == 0:
+            mean = (sums[stop, other] - sums[start, other]) / length
+        else:
+            mean = (sums[other, stop] - sums[other, start]) / length
+        if self.has_nans:
+            counts = self.nan_counts[axis]
+            nans = counts[stop, other] != counts[start, other] if axis == 0 else \
+                counts[other, stop] != counts[other, start]
+            mean[nans] = np.nan
+        return mean
+
+    def get_cut(self, x1, y1, x2, y2):
+        """
+        The positions and the values of the profile of a rectangle, averaged
+        across its shorter side, over the pixels strictly inside it.
+        """
+        x1, x2 = min([x1, x2]), max([x1, x2])
+        y1, y2 = min([y1, y2]), max([y1, y2])
+        if not self.x_order or not self.y_order:
+            return self._get_cut_by_mask(x1, y1, x2, y2)
+        cols = get_bounds(self.x_axis, self.x_order, x1, x2)
+        rows = get_bounds(self.y_axis, self.y_order, y1, y2)
+        if abs(y2 - y1) < abs(x2 - x1):
+            return np.linspace(x1, x2, cols[1] - cols[0]), self._mean(0, rows[0], rows[1], cols)
+        return np.linspace(y1, y2, rows[1] - rows[0]), self._mean(1, cols[0], cols[1], rows)
+
+    def _get_cut_by_mask(self, x1, y1, x2, y2):
+        # axes that are not monotonic select scattered pixels
+        x_ind = (self.x_axis > x1) & (self.x_axis < x2)
+        y_ind = (self.y_axis > y1) & (self.y_axis < y2)
+        frame = self.frame[y_ind][:, x_ind]
+        if abs(y2 - y1) < abs(x2 - x1):
+            return np.linspace(x1, x2, frame.shape[1]), np.mean(frame, axis=0)
+        return np.linspace(y1, y2, frame.shape[0]), np.mean(frame, axis=1)
+
+    def _to_index(self, values, axis, order, spacing):
+        # fractional pixel indices, -1 outside of the frame
+        if spacing is not None:
+            return (values - spacing[0]) / spacing[1]
+        indices = np.arange(len(axis), dtype=float)
+        if order < 0:
+            axis, indices = axis[::-1], indices[::-1]
+        return np.interp(values, axis, indices, left=-1, right=-1)
+
+    def _to_pixels(self, x, y):
+        if not self.x_order or not self.y_order:
+            raise ValueError('line profiles need monotonic axes')
+        return (self._to_index(y, self.y_axis, self.y_order, self.y_spacing),
+                self._to_index(x, self.x_axis, self.x_order, self.x_spacing))
+
+    def _get_grid(self, length, width):
+        key = (length, width)
+        if key not in self.grids:
+            along = np.linspace(0, 1, length)[:, None]
+            across = np.linspace(-0.5, 0.5, width)[None, :] if width > 1 else np.zeros((1, 1))
+            self.grids[key] = (along, across)
+        return self.grids[key]
+
+    def _sample(self, rows, cols):
+        # bilinear interpolation between pixel centers, zero and not valid outside of the frame
+        height, width = self.frame.shape
+        valid = (rows >= 0) & (rows <= height - 1) & (cols >= 0) & (cols <= width - 1)
+        rows = np.clip(rows, 0, height - 1)
+        cols = np.clip(cols, 0, width - 1)
+        r0 = np.minimum(rows.astype(np.intp), max(height - 2, 0))
+        c0 = np.minimum(cols.astype(np.intp), max(width - 2, 0))
+        dtype = np.result_type(self.frame.dtype, np.float32)
+        fr = (rows - r0).astype(dtype)
+        fc = (cols - c0).astype(dtype)
+        # gathers from the flat frame are the expensive part
+        flat = self.frame.ravel()
+        index = r0 * width + c0
+        right = 1 if width > 1 else 0
+        below = width if height > 1 else 0
+        top = flat[index].astype(dtype)
+        top += (flat[index + right] - top) * fc
+        bottom = flat[index + below].astype(dtype)
+        bottom += (flat[index + below + right] - bottom) * fc
+        top += (bottom - top) * fr
+        return np.where(valid, top, 0), valid
+
+    def get_line_profile(self, x1, y1, x2, y2, width=0):
+        """
+        The distances from (x1, y1) and the values along the line to
+        (x2, y2), averaged across a band of the given width in data units.
+        There is a sample about every pixel, along and across the line.
+        """
+        (r1, r2), (c1, c2) = self._to_pixels(np.array([x1, x2]), np.array([y1, y2]))
+        length_px = np.hypot(r2 - r1, c2 - c1)
+        n_along = int(min(np.ceil(length_px), 4 * max(self.frame.shape))) + 1
+        dx, dy = x2 - x1, y2 - y1
+        length = np.hypot(dx, dy)
+        n_across = 1
+        if width > 0 and length > 0:
+            # the normal of the line in data units
+            nx, ny = -dy / length * width, dx / length * width
+            (r0, r3), (c0, c3) = self._to_pixels(np.array([x1 - nx / 2, x1 + nx / 2]),
+                                                 np.array([y1 - ny / 2, y1 + ny / 2]))
+            n_across = int(min(max(1, np.ceil(np.hypot(r3 - r0, c3 - c0))), self.MAX_WIDTH_SAMPLES))
+        else:
+            nx = ny = 0
+        along, across = self._get_grid(n_along, n_across)
+        rows, cols = self._to_pixels(x1 + along * dx + across * nx, y1 + along * dy + across * ny)
+        values, valid = self._sample(rows, cols)
+        counts = valid.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            profile = values.sum(axis=1) / counts
+        return along[:, 0] * length, np.where(counts > 0, profile, np.nan)
@@ -0,0 +1,128 @@
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import h5py
+
+__all__ = ['DataCache', 'data_cache', 'get_size']
+
+
+def get_size(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(get_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_size(item) for item in value.values())
+    return sys.getsizeof(value)
+
+
+def _set_read_only(value):
+    # cached arrays are shared by every view, so none of them may change them
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _set_read_only(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _set_read_only(item)
+
+
+class DataCache(object):
+    """
+    Arrays and attributes read from h5 files, kept in the order of use up
+    to max_bytes. Entries are keyed by the filename, the address of the
+    object in the file, its shape, so that a growing SWMR dataset is read
+    again, and the selection. A value that is being read by one thread is
+    waited for by the others instead of being read twice.
+    """
+    DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.reading = {}
+        # datasets are read by the loader threads
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(obj, selection):
+        address = h5py.h5o.get_info(obj.id).addr
+        return obj.file.filename, address, getattr(obj, 'shape', None), selection
+
+    def get(self, obj, selection, read):
+        """
+        Returns the cached value of obj for a hashable selection key, or
+        calls read() and caches its result.
+        """
+        key = self.get_key(obj, selection)
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    return entry[0]
+                event = self.reading.get(key)
+                if event is None:
+                    event = self.reading[key] = threading.Event()
+                    break
+            # read by another thread, or again here if that read failed
+            event.wait()
+        try:
+            value = read()
+            self.put(key, value)
+        finally:
+            with self.lock:
+                del self.reading[key]
+            event.set()
+        return value
+
+    def get_array(self, obj):
+        return self.get(obj, (), lambda: obj[()])
+
+    def get_attrs(self, obj):
+        return self.get(obj, 'attrs', lambda: dict(obj.attrs.items()))
+
+    def put(self, key, value):
+        size = get_size(value)
+        if size > self.max_bytes:
+            return
+        _set_read_only(value)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.entries:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.size -= size
+
+    def invalidate(self, filename, address=None):
+        """Drops the entries of an object, or of the whole file if address is None."""
+        with self.lock:
+            for key in [key for key in self.entries
+                        if key[0] == filename and (address is None or key[1] == address)]:
+                self.size -= self.entries.pop(key)[1]
+
+    def invalidate_object(self, obj):
+        self.invalidate(obj.file.filename, h5py.h5o.get_info(obj.id).addr)
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+# one cache for the whole application, shared by the plot, the tables and the labels
+data_cache = DataCache()
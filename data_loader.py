@@ -0,0 +1,75 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from myGUIApplication_ver2.plot_data import LoadCancelled
+
+__all__ = ['DataLoader']
+
+
+class _LoadSignals(QObject):
+    loaded = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+
+
+class _LoadTask(QRunnable):
+    def __init__(self, generation, job, signals, is_current):
+        super(_LoadTask, self).__init__()
+        self.generation = generation
+        self.job = job
+        self.signals = signals
+        self.is_current = is_current
+
+    def run(self):
+        if not self.is_current(self.generation):
+            return
+        try:
+            result = self.job(lambda: not self.is_current(self.generation))
+        except LoadCancelled:
+            return
+        except Exception as err:
+            self.signals.failed.emit(self.generation, str(err))
+        else:
+            self.signals.loaded.emit(self.generation, result)
+
+
+class DataLoader(QObject):
+    """
+    Runs job(is_cancelled) in a worker thread for the latest request only.
+    Every new request, and cancel(), makes the previous ones stale: stale
+    jobs that did not start are skipped, running ones see is_cancelled()
+    and their results are dropped.
+    """
+    MAX_THREAD_COUNT = 2
+
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super(DataLoader, self).__init__(parent)
+        self.generation = 0
+        self.thread_pool = QThreadPool(self)
+        # one more thread than needed, so a new read does not wait for a stale one to stop
+        self.thread_pool.setMaxThreadCount(self.MAX_THREAD_COUNT)
+        self.signals = _LoadSignals(self)
+        self.signals.loaded.connect(self._on_loaded)
+        self.signals.failed.connect(self._on_failed)
+
+    def load(self, job):
+        self.generation += 1
+        self.thread_pool.start(_LoadTask(self.generation, job, self.signals, self.is_current))
+
+    def cancel(self):
+        self.generation += 1
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    def is_loading(self):
+        return self.thread_pool.activeThreadCount() > 0
+
+    def _on_loaded(self, generation, result):
+        if self.is_current(generation):
+            self.loaded.emit(result)
+
+    def _on_failed(self, generation, message):
+        if self.is_current(generation):
+            self.failed.emit(message)
@@ -0,0 +1,188 @@
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+import h5py
+
+from myGUIApplication_ver2.tree_cache import TreeSnapshot, file_identity
+from myGUIApplication_ver2.search_index import PathIndex
+
+__all__ = ['FileLoader', 'FileLoadingPanel']
+
+
+class _TaskSignals(QObject):
+    opened = pyqtSignal(str, object, object)
+    failed = pyqtSignal(str, str)
+    indexed = pyqtSignal(str, object, object)
+
+
+class OpenFileTask(QRunnable):
+    def __init__(self, filename, mode, signals, swmr=False):
+        super(OpenFileTask, self).__init__()
+        self.setAutoDelete(False)
+        self.filename = filename
+        self.mode = mode
+        self.swmr = swmr
+        self.signals = signals
+        self.cancelled = False
+
+    def run(self):
+        if self.cancelled:
+            return
+        try:
+            identity = file_identity(self.filename)
+            if self.swmr:
+                file = h5py.File(self.filename, 'r', libver='latest', swmr=True)
+            else:
+                file = h5py.File(self.filename, self.mode)
+            # read the root link count so that the first expand does not wait for it
+            file.id.get_num_objs()
+        except Exception as err:
+            self.signals.failed.emit(self.filename, str(err))
+            return
+        if self.cancelled:
+            file.close()
+            return
+        # files that are still being written are never listed from a snapshot
+        snapshot = None if self.swmr else TreeSnapshot.load(identity)
+        self.signals.opened.emit(self.filename, file, snapshot)
+        if snapshot is None:
+            snapshot = self.rebuild_snapshot(file, identity, save=not self.swmr)
+        path_index = None
+        if snapshot is not None and not self.cancelled:
+            path_index = PathIndex.from_snapshot(snapshot)
+        self.signals.indexed.emit(self.filename, snapshot, path_index)
+
+    def rebuild_snapshot(self, file, identity, save=True):
+        try:
+            snapshot = TreeSnapshot.build(file, identity, lambda: self.cancelled)
+        except Exception as err:
+            # the file may be closed while it is walked
+            if not self.cancelled:
+                print(f'Could not index {self.filename}: {err}')
+            return None
+        if snapshot is not None and save:
+            snapshot.save()
+        return snapshot
+
+
+class FileLoader(QObject):
+    """
+    Opens h5 files in a thread pool, one task per file. file_opened is
+    emitted in the GUI thread for every file as soon as it is ready, with
+    its cached tree snapshot if there is a valid one. The task then goes on
+    to rebuild a missing snapshot and to build the search index of the
+    file, and emits file_indexed.
+    """
+    file_opened = pyqtSignal(str, object, object)
+    file_failed = pyqtSignal(str, str)
+    file_indexed = pyqtSignal(str, object, object)
+    progress_changed = pyqtSignal(int, int)
+
+    def __init__(self, parent=None, max_thread_count=None):
+        super(FileLoader, self).__init__(parent)
+        self.pool = QThreadPool(self)
+        if max_thread_count:
+            self.pool.setMaxThreadCount(max_thread_count)
+        self.signals = _TaskSignals(self)
+        self.signals.opened.connect(self._on_opened)
+        self.signals.failed.connect(self._on_failed)
+        self.signals.indexed.connect(self._on_indexed)
+        self.tasks = {}
+        self.indexing_tasks = {}
+        self.done = 0
+        self.total = 0
+
+    def open(self, filename, mode='a', swmr=False):
+        if filename in self.tasks:
+            return
+        if not self.tasks:
+            self.done = 0
+            self.total = 0
+        task = OpenFileTask(filename, mode, self.signals, swmr=swmr)
+        self.tasks[filename] = task
+        self.total += 1
+        self.pool.start(task)
+        self._emit_progress()
+
+    def pending(self):
+        return list(self.tasks.keys())
+
+    def cancel(self, filename):
+        indexing_task = self.indexing_tasks.pop(filename, None)
+        if indexing_task is not None:
+            indexing_task.cancelled = True
+        task = self.tasks.pop(filename, None)
+        if task is None:
+            return
+        task.cancelled = True
+        self.pool.tryTake(task)
+        self.done += 1
+        self._emit_progress()
+
+    def cancel_all(self):
+        for filename in self.pending() + list(self.indexing_tasks.keys()):
+            self.cancel(filename)
+
+    def _on_opened(self, filename, file, snapshot):
+        task = self.tasks.pop(filename, None)
+        if task is None:
+            # cancelled after the worker had opened the file
+            file.close()
+            return
+        self.indexing_tasks[filename] = task
+        self.done += 1
+        self.file_opened.emit(filename, file, snapshot)
+        self._emit_progress()
+
+    def _on_indexed(self, filename, snapshot, path_index):
+        if self.indexing_tasks.pop(filename, None) is not None and snapshot is not None:
+            self.file_indexed.emit(filename, snapshot, path_index)
+
+    def indexing(self):
+        return list(self.indexing_tasks.keys())
+
+    def _on_failed(self, filename, message):
+        if self.tasks.pop(filename, None) is None:
+            return
+        self.done += 1
+        self.file_failed.emit(filename, message)
+        self._emit_progress()
+
+    def _emit_progress(self):
+        self.progress_changed.emit(self.done, self.total)
+
+
+class FileLoadingPanel(QtWidgets.QWidget):
+    def __init__(self, loader, parent=None):
+        super(FileLoadingPanel, self).__init__(parent)
+        self.loader = loader
+        self.loader.progress_changed.connect(self.update_progress)
+
+        self.file_list = QtWidgets.QListWidget()
+        self.file_list.setMaximumHeight(80)
+        self.progress_bar = QtWidgets.QProgressBar()
+        cancel_button = QtWidgets.QPushButton('Cancel selected')
+        cancel_button.clicked.connect(self.cancel_selected)
+        cancel_all_button = QtWidgets.QPushButton('Cancel all')
+        cancel_all_button.clicked.connect(self.loader.cancel_all)
+
+        grid = QtWidgets.QGridLayout()
+        grid.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(grid)
+        grid.addWidget(self.file_list, 0, 0, 1, 2)
+        grid.addWidget(self.progress_bar, 1, 0, 1, 2)
+        grid.addWidget(cancel_button, 2, 0)
+        grid.addWidget(cancel_all_button, 2, 1)
+        self.hide()
+
+    def update_progress(self, done, total):
+        pending = self.loader.pending()
+        self.file_list.clear()
+        self.file_list.addItems(pending)
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(done)
+        self.progress_bar.setFormat(f'Opening files: {done} / {total}')
+        self.setVisible(len(pending) > 0)
+
+    def cancel_selected(self):
+        for item in self.file_list.selectedItems():
+            self.loader.cancel(item.text())
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+import h5py
+
+__all__ = ['FilePool']
+
+
+class FilePool(object):
+    """
+    Keeps at most max_open h5 files open. Files are registered once and
+    the least recently used ones are closed when the limit is exceeded;
+    get() reopens a closed file in the mode it was first opened with.
+    Pinned files (live files, files being indexed or copied) are never
+    closed. on_closed(filename) is called after every eviction.
+    """
+    DEFAULT_MAX_OPEN = 64
+
+    def __init__(self, max_open=DEFAULT_MAX_OPEN, on_closed=None):
+        self.max_open = max_open
+        self.on_closed = on_closed or (lambda filename: None)
+        self.modes = {}
+        self.files = OrderedDict()
+        self.pins = {}
+
+    def __contains__(self, filename):
+        return filename in self.modes
+
+    def __getitem__(self, filename):
+        return self.get(filename)
+
+    def __len__(self):
+        return len(self.modes)
+
+    def filenames(self):
+        return list(self.modes)
+
+    def is_open(self, filename):
+        return filename in self.files
+
+    def mode(self, filename):
+        return self.modes[filename]
+
+    def add(self, file, pinned=False):
+        self.modes[file.filename] = file.mode
+        self.files[file.filename] = file
+        if pinned:
+            self.pin(file.filename)
+        self._evict()
+
+    def get(self, filename):
+        file = self.files.get(filename)
+        if file is None or not file.id.valid:
+            file = h5py.File(filename, self.modes[filename])
+            self.files[filename] = file
+        self.files.move_to_end(filename)
+        self._evict()
+        return file
+
+    def pin(self, filename):
+        self.pins[filename] = self.pins.get(filename, 0) + 1
+
+    def unpin(self, filename):
+        count = self.pins.pop(filename, 0) - 1
+        if count > 0:
+            self.pins[filename] = count
+        self._evict()
+
+    def set_max_open(self, max_open):
+        self.max_open = max(1, max_open)
+        self._evict()
+
+    def close(self, filename):
+        # the file stays registered and is reopened by the next get
+        file = self.files.pop(filename, None)
+        if file is not None:
+            file.close()
+
+    def close_all(self):
+        for file in self.files.values():
+            file.close()
+        self.modes = {}
+        self.files = OrderedDict()
+        self.pins = {}
+
+    def _evict(self):
+        # the most recently used file is never closed, even if it is not pinned
+        candidates = [filename for filename in list(self.files)[:-1] if filename not in self.pins]
+        for filename in candidates[:max(0, len(self.files) - self.max_open)]:
+            self.files.pop(filename).close()
+            self.on_closed(filename)
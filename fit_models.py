@@ -0,0 +1,247 @@
+from inspect import signature
+import numpy as np
+from scipy.optimize import curve_fit
+from scipy.signal import find_peaks, peak_widths
+
+__all__ = ['FitModel', 'PeakModel', 'ThreeLorentzians', 'MODELS', 'DEFAULT_MODEL', 'lorentzian',
+           'three_lorentzians', 'find_peak_guesses', 'get_parameter_names', 'fit_profile', 'fit_profiles']
+
+LN2 = np.log(2)
+
+
+def lorentzian(x, a, w, x0):
+    return a / ((x - x0) ** 2 + w)
+
+
+def three_lorentzians(x, central_a, central_w, side_a, side_w, side_x0):
+    return lorentzian(x, central_a, central_w, 0) + \
+           lorentzian(x, side_a, side_w, side_x0) + \
+           lorentzian(x, side_a, side_w, - side_x0)
+
+
+def _get_spacing(x):
+    return (x.max() - x.min()) / max(len(x) - 1, 1) or 1.
+
+
+def find_peak_guesses(x, y, n_peaks):
+    """
+    Centers, heights above the background and half widths at half maximum
+    of the n_peaks most prominent peaks of y, by their centers, and the
+    background. Missing peaks are spread evenly over x.
+    """
+    order = np.argsort(x)
+    x, y = x[order], y[order]
+    background = np.percentile(y, 5)
+    height = y - background
+    indices, properties = find_peaks(height, prominence=0)
+    indices = indices[np.argsort(properties['prominences'])[::-1][:n_peaks]]
+    spacing = _get_spacing(x)
+    span = x[-1] - x[0] or 1.
+    centers = list(x[indices])
+    heights = list(height[indices])
+    half_widths = list(np.maximum(peak_widths(height, indices, rel_height=0.5)[0] * spacing / 2, spacing / 2))
+    for number in range(n_peaks - len(indices)):
+        centers.append(x[0] + span * (number + 1) / (n_peaks - len(indices) + 1))
+        heights.append(max(height.max(), 0) / 2)
+        half_widths.append(span / (4 * n_peaks))
+    order = np.argsort(centers)
+    return np.take(centers, order), np.take(heights, order), np.take(half_widths, order), background
+
+
+class FitModel(object):
+    """
+    A model for curve_fit with its analytic jacobian, initial parameters
+    guessed from the peaks of a profile and bounds of the parameters.
+    """
+    name = None
+    parameter_names = []
+
+    def function(self, x, *params):
+        raise NotImplementedError
+
+    def jacobian(self, x, *params):
+        """Derivatives by the parameters, of shape (len(x), len(params))."""
+        raise NotImplementedError
+
+    def guess(self, x, y):
+        raise NotImplementedError
+
+    def get_bounds(self, x, y):
+        raise NotImplementedError
+
+
+class PeakModel(FitModel):
+    """
+    A sum of n_peaks peaks of one shape and a constant background. Every
+    peak has its height a, center x0 and half width at half maximum w, and
+    pseudo-Voigt peaks the Lorentzian fraction eta as well. All peaks are
+    computed at once, by broadcasting over x and the peaks.
+    """
+    SHAPES = ['lorentzian', 'gaussian', 'pseudo_voigt']
+
+    def __init__(self, shape, n_peaks=1):
+        assert shape in self.SHAPES, f'unknown peak shape {shape}'
+        self.shape = shape
+        self.n_peaks = n_peaks
+        self.name = shape if n_peaks == 1 else f'{shape} x{n_peaks}'
+        peak_names = ['a', 'x0', 'w'] + (['eta'] if shape == 'pseudo_voigt' else [])
+        self.n_peak_params = len(peak_names)
+        suffixes = [''] if n_peaks == 1 else [f'_{number}' for number in range(n_peaks)]
+        self.parameter_names = [name + suffix for suffix in suffixes for name in peak_names] + ['background']
+
+    def _get_peaks(self, x, params):
+        params = np.asarray(params, dtype=float)
+        peaks = params[:-1].reshape(self.n_peaks, self.n_peak_params)
+        a, x0, w = peaks[:, 0], peaks[:, 1], peaks[:, 2]
+        u = (np.asarray(x, dtype=float)[:, None] - x0) / w
+        return peaks, a, w, u, params[-1]
+
+    def _get_shape(self, u, peaks):
+        # the shape of peaks of unit height at u = (x - x0) / w, and -d shape / du / u
+        if self.shape == 'gaussian':
+            shape = np.exp(-LN2 * u * u)
+            return shape, 2 * LN2 * shape, None
+        lorentz = 1 / (1 + u * u)
+        if self.shape == 'lorentzian':
+            return lorentz, 2 * lorentz * lorentz, None
+        eta = peaks[:, 3]
+        gauss = np.exp(-LN2 * u * u)
+        shape = eta * lorentz + (1 - eta) * gauss
+        slope = eta * 2 * lorentz * lorentz + (1 - eta) * 2 * LN2 * gauss
+        return shape, slope, lorentz - gauss
+
+    def function(self, x, *params):
+        peaks, a, w, u, background = self._get_peaks(x, params)
+        shape, _, _ = self._get_shape(u, peaks)
+        return (a * shape).sum(axis=1) + background
+
+    def jacobian(self, x, *params):
+        peaks, a, w, u, background = self._get_peaks(x, params)
+        shape, slope, by_eta = self._get_shape(u, peaks)
+        by_x0 = a * slope * u / w
+        derivatives = [shape, by_x0, by_x0 * u]
+        if by_eta is not None:
+            derivatives.append(a * by_eta)
+        jacobian = np.empty((len(u), len(self.parameter_names)))
+        jacobian[:, :-1] = np.stack(derivatives, axis=2).reshape(len(u), -1)
+        jacobian[:, -1] = 1
+        return jacobian
+
+    def guess(self, x, y):
+        centers, heights, half_widths, background = find_peak_guesses(x, y, self.n_peaks)
+        peaks = [heights, centers, half_widths] + ([np.full(self.n_peaks, 0.5)] if self.shape == 'pseudo_voigt' else [])
+        return np.append(np.stack(peaks, axis=1).ravel(), background)
+
+    def get_bounds(self, x, y):
+        spacing = _get_spacing(x)
+        span = max(x.max() - x.min(), spacing)
+        lower = [0, x.min(), spacing / 10] + ([0] if self.shape == 'pseudo_voigt' else [])
+        upper = [np.inf, x.max(), span] + ([1] if self.shape == 'pseudo_voigt' else [])
+        return np.append(np.tile(lower, self.n_peaks), -np.inf), np.append(np.tile(upper, self.n_peaks), np.inf)
+
+
+class ThreeLorentzians(FitModel):
+    """
+    three_lorentzians: a central Lorentzian at zero and two equal side ones
+    at -side_x0 and side_x0, in the a / ((x - x0) ** 2 + w) form of the cut window.
+    """
+    name = 'three_lorentzians'
+    parameter_names = list(signature(three_lorentzians).parameters)[1:]
+
+    def function(self, x, *params):
+        return three_lorentzians(np.asarray(x, dtype=float), *params)
+
+    def jacobian(self, x, central_a, central_w, side_a, side_w, side_x0):
+        x = np.asarray(x, dtype=float)
+        # a / (d ** 2 + w) by a, w and x0, for the central and the two side peaks
+        central = 1 / (x * x + central_w)
+        right_d, left_d = x - side_x0, x + side_x0
+        right, left = 1 / (right_d * right_d + side_w), 1 / (left_d * left_d + side_w)
+        jacobian = np.empty((len(x), 5))
+        jacobian[:, 0] = central
+        jacobian[:, 1] = -central_a * central * central
+        jacobian[:, 2] = right + left
+        jacobian[:, 3] = -side_a * (right * right + left * left)
+        jacobian[:, 4] = 2 * side_a * (right_d * right * right - left_d * left * left)
+        return jacobian
+
+    def guess(self, x, y):
+        centers, heights, half_widths, _ = find_peak_guesses(x, y, 3)
+        central = np.argmin(np.abs(centers))
+        sides = [number for number in range(3) if number != central]
+        central_w = half_widths[central] ** 2
+        side_w = np.mean(half_widths[sides]) ** 2
+        return np.array([heights[central] * central_w, central_w, np.mean(heights[sides]) * side_w, side_w,
+                         np.mean(np.abs(centers[sides]))])
+
+    def get_bounds(self, x, y):
+        spacing = _get_spacing(x)
+        span = max(x.max() - x.min(), spacing)
+        min_w, max_w = (spacing / 10) ** 2, span ** 2
+        return np.array([0, min_w, 0, min_w, -span]), np.array([np.inf, max_w, np.inf, max_w, span])
+
+
+# models by name, the names are stored with batch fit results
+MODELS = {model.name: model for model in
+          [ThreeLorentzians()] + [PeakModel(shape, n_peaks) for shape in PeakModel.SHAPES for n_peaks in (1, 2, 3)]}
+DEFAULT_MODEL = 'three_lorentzians'
+
+
+def get_parameter_names(model_name):
+    return list(MODELS[model_name].parameter_names)
+
+
+def fit_profile(model_name, x, y, p0=None):
+    """
+    Fits a profile by curve_fit with the jacobian and within the bounds of
+    the model, from p0 moved into the bounds and, if that fails, from the
+    guess of the model. NaN values are left out. Returns popt and pcov.
+    """
+    model = MODELS[model_name]
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = x[valid], y[valid]
+    if len(x) < len(model.parameter_names):
+        raise ValueError(f'{len(x)} points are not enough to fit {len(model.parameter_names)} parameters')
+    lower, upper = model.get_bounds(x, y)
+    starts = [] if p0 is None else [np.clip(np.asarray(p0, dtype=float), lower, upper)]
+    starts.append(np.clip(model.guess(x, y), lower, upper))
+    for start in starts:
+        try:
+            return _fit(model, x, y, start, lower, upper)
+        except (RuntimeError, ValueError) as err:
+            error = err
+    raise error
+
+
+def _fit(model, x, y, start, lower, upper):
+    # unbounded Levenberg-Marquardt is several times faster than the bounded
+    # trust region method, which is used only if the result leaves the bounds
+    try:
+        popt, pcov = curve_fit(model.function, x, y, p0=start, jac=model.jacobian, method='lm')
+        if np.all(popt >= lower) and np.all(popt <= upper):
+            return popt, pcov
+    except RuntimeError:
+        pass
+    return curve_fit(model.function, x, y, p0=start, jac=model.jacobian, bounds=(lower, upper))
+
+
+def fit_profiles(model_name, profiles, p0=None):
+    """
+    Fits (x, y) profiles one after another, each starting from the
+    parameters of the last successful fit. Returns the parameters and their
+    standard errors, NaN for the profiles that could not be fitted. Runs in
+    the worker processes of batch fits.
+    """
+    n_params = len(get_parameter_names(model_name))
+    params = np.full((len(profiles), n_params), np.nan)
+    errors = np.full((len(profiles), n_params), np.nan)
+    for number, (x, y) in enumerate(profiles):
+        try:
+            popt, pcov = fit_profile(model_name, x, y, p0)
+        except (RuntimeError, ValueError):
+            continue
+        params[number] = popt
+        errors[number] = np.sqrt(np.abs(np.diag(pcov)))
+        p0 = popt
+    return params, errors
@@ -0,0 +1,302 @@
+import atexit
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import Qt, QTimer, pyqtSignal
+
+from myGUIApplication_ver2.plot_data import LoadCancelled
+
+__all__ = ['FrameRingBuffer', 'FramePlayer', 'get_rate']
+
+_buffers = weakref.WeakSet()
+
+
+@atexit.register
+def _stop_buffers():
+    # a reader stopped in the middle of a read would keep the lock of h5py,
+    # which it takes to close the files at exit; this runs before it
+    for buffer in list(_buffers):
+        buffer.stop(wait=True)
+
+
+def get_rate(times):
+    """Events per second over the last second, from their perf_counter times."""
+    now = time.perf_counter()
+    times = [event for event in times if event > now - 1]
+    if len(times) < 2:
+        return 0.
+    return (len(times) - 1) / (times[-1] - times[0])
+
+
+class FrameRingBuffer(object):
+    """
+    The next capacity frames from the position, in the direction of
+    playback and wrapping around, read ahead by reader threads.
+    read_frame(number, is_cancelled) runs in the readers. Frames that the
+    position leaves behind are dropped, so the buffer never holds more
+    than capacity frames.
+    """
+
+    def __init__(self, read_frame, n_frames, capacity, n_readers=2):
+        self.read_frame = read_frame
+        self.n_frames = n_frames
+        self.capacity = max(1, min(capacity, n_frames))
+        self.position = 0
+        self.direction = 1
+        self.frames = {}
+        self.reading = set()
+        self.error = None
+        self.stopped = False
+        self.read_times = deque(maxlen=1000)
+        self.condition = threading.Condition()
+        self.readers = [threading.Thread(target=self._run, daemon=True) for _ in range(n_readers)]
+        for reader in self.readers:
+            reader.start()
+        _buffers.add(self)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _get_wanted(self):
+        return [(self.position + step * self.direction) % self.n_frames for step in range(self.capacity)]
+
+    def _get_next(self):
+        for number in self._get_wanted():
+            if number not in self.frames and number not in self.reading:
+                return number
+        return None
+
+    def _run(self):
+        while True:
+            with self.condition:
+                number = None
+                while not self.stopped and number is None:
+                    number = self._get_next()
+                    if number is None:
+                        self.condition.wait()
+                if self.stopped:
+                    return
+                self.reading.add(number)
+            try:
+                frame = self.read_frame(number, self.is_stopped)
+            except LoadCancelled:
+                return
+            except Exception as err:
+                with self.condition:
+                    self.error = err
+                    self.stopped = True
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.reading.discard(number)
+                self.read_times.append(time.perf_counter())
+                if number in self._get_wanted():
+                    self.frames[number] = frame
+                self.condition.notify_all()
+
+    def is_stopped(self):
+        return self.stopped
+
+    def seek(self, position, direction=None):
+        with self.condition:
+            self.position = position % self.n_frames
+            if direction is not None:
+                self.direction = direction
+            wanted = set(self._get_wanted())
+            for number in list(self.frames):
+                if number not in wanted:
+                    del self.frames[number]
+            self.condition.notify_all()
+
+    def get(self, number):
+        """The frame if it is read already, or None."""
+        with self.condition:
+            return self.frames.get(number)
+
+    def get_read_rate(self):
+        with self.condition:
+            return get_rate(self.read_times)
+
+    def stop(self, wait=False):
+        # readers finish the frame they read and exit
+        with self.condition:
+            self.stopped = True
+            self.frames.clear()
+            self.condition.notify_all()
+        if wait:
+            for reader in self.readers:
+                reader.join()
+
+
+class FramePlayer(QtWidgets.QWidget):
+    """
+    Plays a stack of frames at a chosen frame rate, from a FrameRingBuffer.
+    A frame that is not read yet when it is due is waited for, instead of
+    being skipped, and the rates shown are the real ones. frame_ready is
+    emitted with the number of the frame and the frame to show.
+    """
+    DEFAULT_FPS = 25
+    MAX_FPS = 200
+    DEFAULT_CAPACITY = 16
+    MAX_BYTES = 512 * 1024 ** 2
+    # deflated frames are decompressed by the readers at once, see plot_data.read_chunks
+    N_READERS = max(2, min(4, os.cpu_count() or 1))
+    STATUS_INTERVAL = 500
+
+    frame_ready = pyqtSignal(int, object)
+
+    def __init__(self, parent=None):
+        super(FramePlayer, self).__init__(parent)
+        self.key = None
+        self.n_frames = 0
+        self.position = 0
+        self.read_frame = None
+        self.capacity = self.DEFAULT_CAPACITY
+        self.buffer = None
+        self.playing = False
+        # the frame that was scrubbed to and is not shown yet
+        self.pending = False
+        self.shown_times = deque(maxlen=2 * self.MAX_FPS)
+
+        self.play_button = QtWidgets.QPushButton('Play')
+        self.play_button.clicked.connect(self.toggle_playing)
+        self.slider = QtWidgets.QSlider(Qt.Horizontal)
+        self.slider.valueChanged.connect(self.seek)
+        self.frame_label = QtWidgets.QLabel()
+        self.fps_box = QtWidgets.QSpinBox()
+        self.fps_box.setRange(1, self.MAX_FPS)
+        self.fps_box.setValue(self.DEFAULT_FPS)
+        self.fps_box.setSuffix(' fps')
+        self.fps_box.valueChanged.connect(self.set_fps)
+        self.status_label = QtWidgets.QLabel()
+
+        layout = QtWidgets.QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+        layout.addWidget(self.play_button)
+        layout.addWidget(self.slider)
+        layout.addWidget(self.frame_label)
+        layout.addWidget(self.fps_box)
+        layout.addWidget(self.status_label)
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(self.on_tick)
+        self.set_fps(self.DEFAULT_FPS)
+        self.status_timer = QTimer(self)
+        self.status_timer.setInterval(self.STATUS_INTERVAL)
+        self.status_timer.timeout.connect(self.update_status)
+
+    def set_frames(self, key, n_frames, position, read_frame, frame_bytes=0):
+        """
+        Sets the stack of n_frames frames shown at position. A stack with the
+        same key keeps its buffer, only the position is moved.
+        """
+        if key == self.key and self.buffer is not None:
+            self._set_position(position)
+            self.buffer.seek(position)
+            return
+        self.clear()
+        self.key = key
+        self.n_frames = n_frames
+        self.read_frame = read_frame
+        self.capacity = self.DEFAULT_CAPACITY
+        if frame_bytes:
+            self.capacity = max(2, min(self.capacity, self.MAX_BYTES // frame_bytes))
+        self.slider.blockSignals(True)
+        self.slider.setMaximum(n_frames - 1)
+        self.slider.blockSignals(False)
+        self._set_position(position)
+        self.show()
+
+    def clear(self):
+        self.pending = False
+        self.pause()
+        self._stop_buffer()
+        self.key = None
+        self.read_frame = None
+        self.hide()
+
+    def _stop_buffer(self):
+        if self.buffer is not None:
+            self.buffer.stop()
+            self.buffer = None
+
+    def _get_buffer(self):
+        if self.buffer is None:
+            self.buffer = FrameRingBuffer(self.read_frame, self.n_frames, self.capacity, self.N_READERS)
+            self.buffer.seek(self.position)
+        return self.buffer
+
+    def _set_position(self, position):
+        self.position = position
+        self.slider.blockSignals(True)
+        self.slider.setValue(position)
+        self.slider.blockSignals(False)
+        self.frame_label.setText(f'{position + 1}/{self.n_frames}')
+
+    def set_fps(self, fps):
+        self.timer.setInterval(int(round(1000 / fps)))
+
+    def toggle_playing(self):
+        if self.playing:
+            self.pause()
+        else:
+            self.play()
+
+    def play(self):
+        if self.read_frame is None or self.playing:
+            return
+        self.playing = True
+        self.play_button.setText('Pause')
+        self.shown_times.clear()
+        if not self.pending:
+            # the shown frame is not shown again
+            self._get_buffer().seek(self.position + 1)
+            self._set_position((self.position + 1) % self.n_frames)
+        self.timer.start()
+        self.status_timer.start()
+
+    def pause(self):
+        self.playing = False
+        self.play_button.setText('Play')
+        self.status_timer.stop()
+        if not self.pending:
+            self.timer.stop()
+
+    def seek(self, position):
+        if self.read_frame is None:
+            return
+        self._set_position(position)
+        self._get_buffer().seek(position)
+        self.pending = True
+        self.timer.start()
+
+    def on_tick(self):
+        buffer = self._get_buffer()
+        if buffer.error is not None:
+            print(buffer.error)
+            self.clear()
+            return
+        frame = buffer.get(self.position)
+        if frame is None:
+            return
+        self.pending = False
+        self.frame_ready.emit(self.position, frame)
+        self.shown_times.append(time.perf_counter())
+        if not self.playing:
+            self.timer.stop()
+            return
+        position = (self.position + 1) % self.n_frames
+        buffer.seek(position)
+        self._set_position(position)
+
+    def update_status(self):
+        if self.buffer is None:
+            return
+        self.status_label.setText(f'{get_rate(self.shown_times):.1f} fps shown, '
+                                  f'{self.buffer.get_read_rate():.1f} frames/s read, '
+                                  f'{len(self.buffer)}/{self.buffer.capacity} buffered')
@@ -0,0 +1,44 @@
+import os
+import shutil
+import h5py
+
+from myGUIApplication_ver2.h5_transfer import H5Transfer
+
+__all__ = ['compact_to_temp', 'get_temp_filename']
+
+
+def get_temp_filename(filename):
+    # next to the file, so that os.replace stays on the same file system
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, f'.{name}.compact')
+
+
+def compact_to_temp(filename, progress=None, is_cancelled=None):
+    """
+    Writes the objects reachable in filename into a new file next to it and
+    returns its name. Space of deleted objects is not copied, so replacing
+    filename by the new file reclaims it. Datasets keep their chunking and
+    filters, chunks are copied without decompression.
+    """
+    temp_filename = get_temp_filename(filename)
+    try:
+        with h5py.File(filename, 'r') as source:
+            userblock_size = source.userblock_size
+            with h5py.File(temp_filename, 'w', libver=source.libver,
+                           userblock_size=userblock_size) as dest:
+                H5Transfer(progress, is_cancelled).copy_file(source, dest)
+        if userblock_size:
+            _copy_userblock(filename, temp_filename, userblock_size)
+        shutil.copymode(filename, temp_filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+    return temp_filename
+
+
+def _copy_userblock(source_filename, dest_filename, size):
+    with open(source_filename, 'rb') as source:
+        userblock = source.read(size)
+    with open(dest_filename, 'r+b') as dest:
+        dest.write(userblock)
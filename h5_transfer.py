@@ -0,0 +1,222 @@
+import numpy as np
+import h5py
+
+__all__ = ['H5Transfer', 'TransferCancelled']
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+class H5Transfer(object):
+    """
+    Copies a group or a dataset into any opened h5 file. Chunks of chunked
+    datasets are copied as they are stored, still compressed, into a
+    dataset created with the same creation property list, so the filter
+    pipeline always matches and nothing is decompressed. Other datasets are
+    copied in blocks of at most block_bytes.
+
+    Object references stored in attributes or datasets are pointed to the
+    copies of their targets if those are copied too. References to objects
+    outside of the copied subtree are kept within the same file and dropped
+    otherwise; their locations are collected in dropped_references.
+
+    An object reached twice through hard links is copied once and linked
+    again. copy_file copies a whole file and keeps soft and external links
+    as links.
+    """
+    DEFAULT_BLOCK_BYTES = 64 * 1024 ** 2
+
+    def __init__(self, progress=None, is_cancelled=None, block_bytes=DEFAULT_BLOCK_BYTES):
+        self.progress = progress or (lambda done, total: None)
+        self.is_cancelled = is_cancelled or (lambda: False)
+        self.block_bytes = block_bytes
+        self.total_bytes = 0
+        self.done_bytes = 0
+        self.passthrough_datasets = 0
+        self.dropped_references = []
+        self._copied = {}
+        self._deferred_refs = []
+        self._keep_links = False
+
+    def _start(self, source, keep_links):
+        self.total_bytes = self.storage_size(source)
+        self.done_bytes = 0
+        self._copied = {}
+        self._deferred_refs = []
+        self._keep_links = keep_links
+        self.dropped_references = []
+
+    def copy(self, source, dest_group, name):
+        self._start(source, keep_links=False)
+        if name in dest_group:
+            raise ValueError(f'{name} already exists in {dest_group.name}')
+        try:
+            copied = self._copy_object(source, dest_group, name)
+            self._fix_references(source.file, dest_group.file)
+        except BaseException:
+            if name in dest_group:
+                del dest_group[name]
+            raise
+        return copied
+
+    def copy_file(self, source_file, dest_file):
+        self._start(source_file, keep_links=True)
+        self._copied[h5py.h5o.get_info(source_file.id).addr] = '/'
+        self._copy_members(source_file, dest_file)
+        self._copy_attrs(source_file, dest_file)
+        self._fix_references(source_file, dest_file)
+
+    @staticmethod
+    def storage_size(obj):
+        if isinstance(obj, h5py.Dataset):
+            return obj.id.get_storage_size()
+        sizes = []
+        obj.visititems(lambda _, item: sizes.append(item.id.get_storage_size())
+                       if isinstance(item, h5py.Dataset) else None)
+        return sum(sizes)
+
+    def _check_cancelled(self):
+        if self.is_cancelled():
+            raise TransferCancelled()
+
+    def _add_progress(self, nbytes):
+        self.done_bytes += nbytes
+        self.progress(self.done_bytes, self.total_bytes)
+
+    def _copy_object(self, source, dest_group, name):
+        self._check_cancelled()
+        addr = h5py.h5o.get_info(source.id).addr
+        if addr in self._copied:
+            dest_group[name] = dest_group.file[self._copied[addr]]
+            return dest_group[name]
+        if isinstance(source, h5py.Dataset):
+            copied = self._copy_dataset(source, dest_group, name)
+            self._copied[addr] = copied.name
+        else:
+            copied = dest_group.create_group(name)
+            self._copied[addr] = copied.name
+            self._copy_members(source, copied)
+        self._copy_attrs(source, copied)
+        return copied
+
+    def _copy_members(self, source, dest_group):
+        for key in source.keys():
+            if self._keep_links:
+                link = source.get(key, getlink=True)
+                if isinstance(link, (h5py.SoftLink, h5py.ExternalLink)):
+                    dest_group[key] = link
+                    continue
+            child = source.get(key)
+            if child is None:
+                # dangling soft or external link
+                continue
+            self._copy_object(child, dest_group, key)
+
+    def _copy_attrs(self, source, dest):
+        for key in source.attrs.keys():
+            dtype = source.attrs.get_id(key).dtype
+            value = source.attrs[key]
+            if h5py.check_dtype(ref=dtype) is not None:
+                self._deferred_refs.append(('attr', dest.name, key, value, dtype))
+                continue
+            dest.attrs.create(key, value, dtype=dtype)
+
+    def _copy_dataset(self, source, dest_group, name):
+        dcpl = source.id.get_create_plist()
+        if dcpl.get_layout() != h5py.h5d.CHUNKED:
+            # the plist of virtual or external datasets would map onto the files of the source
+            dest = dest_group.create_dataset_like(name, source)
+            self._copy_decoded(source, dest)
+            return dest
+        try:
+            dest_id = h5py.h5d.create(dest_group.id, name.encode('utf-8'), source.id.get_type(),
+                                      source.id.get_space(), dcpl=dcpl)
+            dest = h5py.Dataset(dest_id)
+        except (ValueError, RuntimeError, OSError):
+            # e.g. a filter of the source pipeline is not available here
+            dest = dest_group.create_dataset_like(name, source)
+            self._copy_decoded(source, dest)
+            return dest
+        if source.dtype.hasobject:
+            # variable length data and references point into the file heap
+            self._copy_decoded(source, dest)
+        else:
+            self._copy_chunks(source, dest)
+            self.passthrough_datasets += 1
+        return dest
+
+    def _get_chunk_offsets(self, source):
+        if hasattr(source.id, 'chunk_iter'):
+            offsets = []
+            source.id.chunk_iter(lambda info: offsets.append(info.chunk_offset))
+            return offsets
+        # each get_chunk_info looks the chunk up from the first one
+        offsets = []
+        for idx in range(source.id.get_num_chunks()):
+            self._check_cancelled()
+            offsets.append(source.id.get_chunk_info(idx).chunk_offset)
+        return offsets
+
+    def _copy_chunks(self, source, dest):
+        for offset in self._get_chunk_offsets(source):
+            self._check_cancelled()
+            filter_mask, chunk = source.id.read_direct_chunk(offset)
+            dest.id.write_direct_chunk(offset, chunk, filter_mask)
+            self._add_progress(len(chunk))
+
+    def _copy_decoded(self, source, dest):
+        if h5py.check_dtype(ref=source.dtype) is not None:
+            self._deferred_refs.append(('dataset', dest.name, None, source[()], source.dtype))
+            return
+        if not source.shape:
+            dest[()] = source[()]
+            return
+        row_bytes = max(1, source.dtype.itemsize * int(np.prod(source.shape[1:])))
+        rows = max(1, self.block_bytes // row_bytes)
+        if source.chunks:
+            rows = max(source.chunks[0], rows // source.chunks[0] * source.chunks[0])
+        total_rows = source.shape[0]
+        storage_per_row = source.id.get_storage_size() / max(1, total_rows)
+        for start in range(0, total_rows, rows):
+            self._check_cancelled()
+            stop = min(total_rows, start + rows)
+            dest[start:stop] = source[start:stop]
+            self._add_progress(int(storage_per_row * (stop - start)))
+
+    def _fix_references(self, source_file, dest_file):
+        for kind, dest_name, key, value, dtype in self._deferred_refs:
+            self._check_cancelled()
+            location = f'{dest_name}.attrs[{key}]' if kind == 'attr' else dest_name
+            new_value = self._map_references(value, dtype, source_file, dest_file, location)
+            if kind == 'attr':
+                if new_value is not None:
+                    dest_file[dest_name].attrs.create(key, new_value, dtype=dtype)
+            else:
+                dest_file[dest_name][()] = new_value
+
+    def _map_references(self, value, dtype, source_file, dest_file, location):
+        if isinstance(value, (h5py.Reference, h5py.RegionReference)):
+            return self._map_reference(value, source_file, dest_file, location)
+        null_ref = h5py.check_dtype(ref=dtype)()
+        mapped = np.empty(value.shape, dtype=dtype)
+        for idx in np.ndindex(value.shape):
+            new_ref = self._map_reference(value[idx], source_file, dest_file, location)
+            mapped[idx] = new_ref if new_ref is not None else null_ref
+        return mapped
+
+    def _map_reference(self, ref, source_file, dest_file, location):
+        if not ref:
+            return ref
+        if isinstance(ref, h5py.RegionReference):
+            if source_file == dest_file:
+                return ref
+            self.dropped_references.append(location)
+            return None
+        addr = h5py.h5o.get_info(source_file[ref].id).addr
+        if addr in self._copied:
+            return dest_file[self._copied[addr]].ref
+        if source_file == dest_file:
+            return ref
+        self.dropped_references.append(location)
+        return None
@@ -0,0 +1,509 @@
+from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt
+from PyQt5 import QtGui
+from collections import namedtuple
+from array import array
+import numpy as np
+import h5py
+
+from myGUIApplication_ver2.tree_cache import list_link_names
+
+__all__ = ['H5TreeModel', 'NodeTable', 'FileItemKeys']
+
+FileItemKeys = namedtuple('FileItemKeys',
+                          'short_name key parent_name filename')
+
+
+class NodeTable(object):
+    """
+    Tree nodes stored column-wise: a node is an index into numpy arrays of
+    parents, rows, interned names and file ids. Only listed groups own a
+    children array, and only listed groups keep their h5py object id, so
+    that a node is opened from its parent by a single link name. The rows
+    of removed subtrees are cleared and reused by the next nodes, so that
+    a tree refreshed again and again does not grow the table.
+    """
+    ROOT = 0
+    NOT_LISTED = -1
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self):
+        capacity = self.INITIAL_CAPACITY
+        self.size = 0
+        # rows that are not used are zero, a node of the root with the empty name
+        self.parent = np.zeros(capacity, dtype=np.int32)
+        self.row = np.zeros(capacity, dtype=np.int32)
+        self.name_id = np.zeros(capacity, dtype=np.int32)
+        self.file_id = np.zeros(capacity, dtype=np.int16)
+        self.is_group = np.zeros(capacity, dtype=np.bool_)
+        # number of links listed from the h5 group so far, NOT_LISTED before the first fetch
+        self.fetched_count = np.zeros(capacity, dtype=np.int32)
+        self.link_count = np.zeros(capacity, dtype=np.int32)
+        # rows of removed nodes, reused by add
+        self.free = array('i')
+        self.children = {}
+        # link names of partially listed groups
+        self.pending_names = {}
+        self.object_ids = {}
+        self.colors = {}
+        self.names = []
+        self._name_ids = {}
+        self.filenames = []
+        self._file_ids = {}
+        self.add(-1, '', '', True)
+        self.children[self.ROOT] = array('i')
+
+    def __len__(self):
+        # the number of nodes in use
+        return self.size - len(self.free)
+
+    def _grow(self):
+        capacity = 2 * len(self.parent)
+        for attr in ('parent', 'row', 'name_id', 'file_id', 'is_group',
+                     'fetched_count', 'link_count'):
+            old = getattr(self, attr)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, attr, new)
+
+    def _intern(self, value, values, ids):
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = len(values)
+            values.append(value)
+            ids[value] = value_id
+        return value_id
+
+    def add(self, parent, name, filename, is_group):
+        if self.free:
+            node = self.free.pop()
+        else:
+            if self.size == len(self.parent):
+                self._grow()
+            node = self.size
+            self.size += 1
+        self.parent[node] = parent
+        self.row[node] = 0
+        self.name_id[node] = self._intern(name, self.names, self._name_ids)
+        self.file_id[node] = self._intern(filename, self.filenames, self._file_ids)
+        self.is_group[node] = is_group
+        self.fetched_count[node] = self.NOT_LISTED
+        self.link_count[node] = 0
+        return node
+
+    def name(self, node):
+        return self.names[self.name_id[node]]
+
+    def filename(self, node):
+        return self.filenames[self.file_id[node]]
+
+    def is_file(self, node):
+        return node != self.ROOT and self.parent[node] == self.ROOT
+
+    def key(self, node):
+        if self.is_file(node):
+            return '__root__'
+        names = []
+        while not self.is_file(node):
+            names.append(self.name(node))
+            node = int(self.parent[node])
+        return '/'.join(reversed(names))
+
+    def get_children(self, node):
+        return self.children.get(node, ())
+
+    def set_children(self, node, nodes):
+        self.children[node] = array('i', nodes)
+        self.renumber(node, 0)
+
+    def renumber(self, node, start):
+        children = self.children[node]
+        if start < len(children):
+            nodes = np.frombuffer(children, dtype=np.int32)[start:]
+            self.row[nodes] = np.arange(start, len(children), dtype=np.int32)
+
+    def forget_objects(self, filename):
+        file_id = self._file_ids.get(filename)
+        for node in [node for node in self.object_ids if self.file_id[node] == file_id]:
+            del self.object_ids[node]
+
+    def forget_subtree(self, node):
+        """Frees the rows of node and of the nodes below it, once it is removed from its parent."""
+        stack = [node]
+        nodes = []
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            self.object_ids.pop(node, None)
+            self.pending_names.pop(node, None)
+            self.colors.pop(node, None)
+            stack.extend(self.children.pop(node, ()))
+        for attr in ('parent', 'row', 'name_id', 'file_id', 'is_group', 'fetched_count', 'link_count'):
+            getattr(self, attr)[nodes] = 0
+        self.free.extend(nodes)
+
+
+class H5TreeModel(QAbstractItemModel):
+    """
+    Lazy model of the opened h5 files. A group lists its links only when
+    the view expands it, FETCH_BATCH links at a time. Files with a tree
+    snapshot are listed from the snapshot without reading the file.
+    """
+    FETCH_BATCH = 1000
+
+    def __init__(self, get_file, parent=None):
+        super(H5TreeModel, self).__init__(parent)
+        self.get_file = get_file
+        self.table = NodeTable()
+        self.snapshots = {}
+
+    def add_file(self, filename):
+        self._insert_nodes(NodeTable.ROOT, [self._file_node(filename)],
+                           len(self.table.get_children(NodeTable.ROOT)))
+
+    def add_filtered_file(self, filename, results):
+        # shows only the found objects and their parent groups
+        table = self.table
+        file_node = self._file_node(filename)
+        nodes = {'__root__': file_node}
+        children = {file_node: []}
+        for key, is_group in results:
+            self._get_filtered_node(nodes, children, filename, key, is_group)
+        for node, node_children in children.items():
+            if node_children:
+                table.set_children(node, node_children)
+                table.fetched_count[node] = table.link_count[node] = len(node_children)
+        self._insert_nodes(NodeTable.ROOT, [file_node],
+                           len(table.get_children(NodeTable.ROOT)))
+
+    def _get_filtered_node(self, nodes, children, filename, key, is_group):
+        node = nodes.get(key)
+        if node is None:
+            parent_key, _, name = key.rpartition('/')
+            parent = self._get_filtered_node(nodes, children, filename, parent_key or '__root__', True)
+            node = self.table.add(parent, name, filename, is_group)
+            children.setdefault(parent, []).append(node)
+            children[node] = []
+            nodes[key] = node
+        return node
+
+    def _file_node(self, filename):
+        short_name = filename.split('\\')[-1].split('/')[-1]
+        return self.table.add(NodeTable.ROOT, short_name, filename, True)
+
+    def filenames(self):
+        return [self.table.filename(node) for node in self.table.get_children(NodeTable.ROOT)]
+
+    def clear(self):
+        self.beginResetModel()
+        self.table = NodeTable()
+        self.snapshots = {}
+        self.endResetModel()
+
+    def forget_objects(self, filename):
+        # called when the file is closed, its object ids are no longer valid
+        self.table.forget_objects(filename)
+
+    def set_snapshot(self, filename, snapshot):
+        self.snapshots[filename] = snapshot
+
+    def drop_snapshot(self, filename):
+        self.snapshots.pop(filename, None)
+
+    def node_from_index(self, index):
+        if index.isValid():
+            return index.internalId()
+        return NodeTable.ROOT
+
+    def index_from_node(self, node):
+        if node == NodeTable.ROOT:
+            return QModelIndex()
+        return self.createIndex(int(self.table.row[node]), 0, node)
+
+    def item_data(self, index):
+        table = self.table
+        node = self.node_from_index(index)
+        parent = int(table.parent[node])
+        parent_name = '__root__' if table.is_file(node) or table.is_file(parent) else table.name(parent)
+        return FileItemKeys(table.name(node), table.key(node), parent_name, table.filename(node))
+
+    def is_group(self, index):
+        return bool(self.table.is_group[self.node_from_index(index)])
+
+    def is_within(self, index, ancestor_index):
+        node = self.node_from_index(index)
+        ancestor = self.node_from_index(ancestor_index)
+        while node >= 0:
+            if node == ancestor:
+                return True
+            node = self.table.parent[node]
+        return False
+
+    def get_object(self, index):
+        node = self.node_from_index(index)
+        # reopens the file if it was closed and marks it as recently used
+        self.get_file(self.table.filename(node))
+        try:
+            return self._open(node)
+        except (KeyError, RuntimeError, ValueError):
+            # dangling soft or external link
+            return None
+
+    def _open(self, node):
+        table = self.table
+        if table.is_file(node):
+            return self.get_file(table.filename(node))
+        object_id = table.object_ids.get(node)
+        if object_id is not None and object_id.valid:
+            return h5py.Group(object_id)
+        obj = self._open(int(table.parent[node]))[table.name(node)]
+        if isinstance(obj, h5py.Group) and node in table.children:
+            table.object_ids[node] = obj.id
+        return obj
+
+    def index(self, row, column, parent=QModelIndex()):
+        children = self.table.get_children(self.node_from_index(parent))
+        if column != 0 or not 0 <= row < len(children):
+            return QModelIndex()
+        return self.createIndex(row, column, children[row])
+
+    def parent(self, index=QModelIndex()):
+        if not index.isValid():
+            return QModelIndex()
+        return self.index_from_node(int(self.table.parent[index.internalId()]))
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.table.get_children(self.node_from_index(parent)))
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node_from_index(parent)
+        if self.table.fetched_count[node] == NodeTable.NOT_LISTED:
+            return bool(self.table.is_group[node])
+        return len(self.table.get_children(node)) > 0 or self.canFetchMore(parent)
+
+    def canFetchMore(self, parent):
+        table = self.table
+        node = self.node_from_index(parent)
+        if not table.is_group[node] or node == NodeTable.ROOT:
+            return False
+        # Qt needs a bool, not a numpy one
+        return bool(table.fetched_count[node] == NodeTable.NOT_LISTED or
+                    table.fetched_count[node] < table.link_count[node])
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        node = self.node_from_index(parent)
+        snapshot = self.snapshots.get(self.table.filename(node))
+        links = snapshot.get_children(self.table.key(node)) if snapshot is not None else None
+        if links is not None:
+            self._fetch_from_snapshot(node, links)
+        else:
+            self._fetch_from_file(node)
+
+    def _start_listing(self, node, link_count):
+        table = self.table
+        if table.fetched_count[node] == NodeTable.NOT_LISTED:
+            table.fetched_count[node] = 0
+            table.link_count[node] = link_count
+            table.children[node] = array('i')
+        start = int(table.fetched_count[node])
+        return start, min(int(table.link_count[node]), start + self.FETCH_BATCH)
+
+    def _fetch_from_snapshot(self, node, links):
+        table = self.table
+        start, stop = self._start_listing(node, len(links))
+        filename = table.filename(node)
+        new_nodes = [table.add(node, name, filename, is_group)
+                     for name, is_group in links[start:stop]]
+        table.fetched_count[node] = stop
+        self._insert_nodes(node, new_nodes, len(table.get_children(node)))
+
+    def _fetch_from_file(self, node):
+        table = self.table
+        group_id = self._open(node).id
+        names = table.pending_names.get(node)
+        if names is None:
+            names = list_link_names(group_id)
+            table.pending_names[node] = names
+        start, stop = self._start_listing(node, len(names))
+        if not table.is_file(node):
+            table.object_ids[node] = group_id
+        filename = table.filename(node)
+        new_nodes = [table.add(node, name, filename, self._is_group_link(group_id, name))
+                     for name in names[start:stop]]
+        table.fetched_count[node] = stop
+        if stop == len(names):
+            del table.pending_names[node]
+        self._insert_nodes(node, new_nodes, len(table.get_children(node)))
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalId()
+        if role == Qt.DisplayRole:
+            return self.table.name(node)
+        if role == Qt.ToolTipRole:
+            return self._tooltip(node)
+        if role == Qt.ForegroundRole:
+            while node >= 0:
+                color = self.table.colors.get(node)
+                if color is not None:
+                    return QtGui.QBrush(color)
+                node = self.table.parent[node]
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return 'Name'
+        return None
+
+    def _tooltip(self, node):
+        snapshot = self.snapshots.get(self.table.filename(node))
+        info = snapshot.get_info(self.table.key(node)) if snapshot is not None else None
+        if info is None:
+            return None
+        shape, dtype, attr_names = info
+        tooltip = f'shape {shape}, {dtype}' if dtype is not None else 'Group'
+        if attr_names:
+            tooltip += f'\nattrs: {", ".join(attr_names)}'
+        return tooltip
+
+    def insert_child(self, parent_index, name, is_group, row=0):
+        table = self.table
+        node = self.node_from_index(parent_index)
+        if not self._is_fully_fetched(node):
+            self._reset_children(node)
+            return
+        child = table.add(node, name, table.filename(node), is_group)
+        table.fetched_count[node] += 1
+        table.link_count[node] += 1
+        self._insert_nodes(node, [child], row)
+
+    def remove_row(self, index):
+        table = self.table
+        node = self.node_from_index(index)
+        parent = int(table.parent[node])
+        if parent != NodeTable.ROOT and not self._is_fully_fetched(parent):
+            self._reset_children(parent)
+            return
+        self._remove_child(parent, node)
+        if parent != NodeTable.ROOT:
+            table.fetched_count[parent] -= 1
+            table.link_count[parent] -= 1
+
+    def _remove_child(self, parent, node):
+        table = self.table
+        row = int(table.row[node])
+        self.beginRemoveRows(self.index_from_node(parent), row, row)
+        del table.children[parent][row]
+        table.renumber(parent, row)
+        table.forget_subtree(node)
+        self.endRemoveRows()
+
+    def fetched_groups(self, filename):
+        table = self.table
+        nodes = []
+        stack = [node for node in table.get_children(NodeTable.ROOT)
+                 if table.filename(node) == filename]
+        while stack:
+            node = stack.pop()
+            if table.fetched_count[node] != NodeTable.NOT_LISTED:
+                nodes.append(node)
+                stack.extend(child for child in table.get_children(node) if table.is_group[child])
+        return nodes
+
+    def refresh_group(self, node):
+        """
+        Compares the link count of a listed group with the file and inserts
+        or removes only the changed links. Returns added (key, is_group)
+        pairs and removed keys.
+        """
+        table = self.table
+        if table.fetched_count[node] == NodeTable.NOT_LISTED or not self._is_attached(node):
+            return [], []
+        group_id = self._open(node).id
+        link_count = group_id.get_num_objs()
+        if link_count == table.link_count[node]:
+            return [], []
+        if not self._is_fully_fetched(node):
+            self._reset_children(node)
+            return [], []
+        names = list_link_names(group_id)
+        link_count = len(names)
+        name_set = set(names)
+        removed = []
+        for child in reversed(list(table.get_children(node))):
+            if table.name(child) not in name_set:
+                removed.append(table.key(child))
+                self._remove_child(node, child)
+        existing = {table.name(child) for child in table.get_children(node)}
+        filename = table.filename(node)
+        key = table.key(node)
+        added = []
+        new_nodes = []
+        for idx, name in enumerate(names + [None]):
+            if name is not None and name not in existing:
+                is_group = self._is_group_link(group_id, name)
+                new_nodes.append(table.add(node, name, filename, is_group))
+                added.append((name if key == '__root__' else f'{key}/{name}', is_group))
+            elif new_nodes:
+                self._insert_nodes(node, new_nodes, idx - len(new_nodes))
+                new_nodes = []
+        table.fetched_count[node] = table.link_count[node] = link_count
+        return added, removed
+
+    def _is_attached(self, node):
+        table = self.table
+        while node != NodeTable.ROOT:
+            parent = int(table.parent[node])
+            children = table.get_children(parent)
+            row = int(table.row[node])
+            if row >= len(children) or children[row] != node:
+                return False
+            node = parent
+        return True
+
+    def set_color(self, index, color):
+        self.table.colors[self.node_from_index(index)] = color
+        self.dataChanged.emit(index, index, [Qt.ForegroundRole])
+
+    def _insert_nodes(self, node, new_nodes, row):
+        if not new_nodes:
+            return
+        children = self.table.children[node]
+        self.beginInsertRows(self.index_from_node(node), row, row + len(new_nodes) - 1)
+        children[row:row] = array('i', new_nodes)
+        self.table.renumber(node, row)
+        self.endInsertRows()
+
+    def _reset_children(self, node):
+        table = self.table
+        children = table.get_children(node)
+        if children:
+            self.beginRemoveRows(self.index_from_node(node), 0, len(children) - 1)
+            for child in children:
+                table.forget_subtree(child)
+            table.children[node] = array('i')
+            self.endRemoveRows()
+        table.children.pop(node, None)
+        table.pending_names.pop(node, None)
+        table.object_ids.pop(node, None)
+        table.fetched_count[node] = NodeTable.NOT_LISTED
+
+    def _is_fully_fetched(self, node):
+        table = self.table
+        return table.fetched_count[node] != NodeTable.NOT_LISTED and \
+            table.fetched_count[node] == table.link_count[node]
+
+    @staticmethod
+    def _is_group_link(group_id, name):
+        try:
+            return h5py.h5o.get_info(group_id, name.encode('utf-8')).type == h5py.h5o.TYPE_GROUP
+        except (KeyError, RuntimeError, ValueError):
+            # dangling soft or external link
+            return False
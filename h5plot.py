@@ -1,12 +1,19 @@
 import numpy as np
 from matplotlib.figure import Figure
 from PyQt5.QtWidgets import QSizePolicy, QWidget, QVBoxLayout
+from PyQt5.QtCore import QTimer
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 from matplotlib import use as matplotlib_use
+from functools import partial
 
 from myGUIApplication_ver2.axes_1d import Axes1D
 from myGUIApplication_ver2.axes_2d import Axes2D
+from myGUIApplication_ver2.batch_fit import get_frame_names
+from myGUIApplication_ver2.data_loader import DataLoader
+from myGUIApplication_ver2.frame_player import FramePlayer
+from myGUIApplication_ver2.plot_data import SliceReader, ImageData, TraceData, DisplayData, read_2d
+from myGUIApplication_ver2.slice_navigator import SliceNavigator
 
 matplotlib_use("Qt5Agg")
 
@@ -19,9 +26,15 @@ class H5Plot(QWidget):
         self.toolbar = NavigationToolbar(self.canvas, self, coordinates=True)
         self.layout().addWidget(self.toolbar)
         self.layout().addWidget(self.canvas)
+        self.layout().addWidget(self.canvas.navigator)
+        self.layout().addWidget(self.canvas.player)
 
 
 class WidgetPlot(FigureCanvas):
+    MIN_TARGET_SIZE = 512
+    # data found in the cache is shown without redrawing for the loading text
+    LOADING_TEXT_DELAY = 100
+
     def __init__(self, parent=None):
         self.status = 0
         self.params_2d = {}
@@ -39,21 +52,227 @@ class WidgetPlot(FigureCanvas):
         ax_2d.set_visible(False)
         self.axes_2d = Axes2D(ax_2d, self)
         self.axes_dict = {0: None, 1: self.axes_1d, 2: self.axes_2d}
+        self.loading_text = self.fig.text(0.5, 0.5, '', ha='center', va='center')
+        self.loading_timer = QTimer(self)
+        self.loading_timer.setSingleShot(True)
+        self.loading_timer.setInterval(self.LOADING_TEXT_DELAY)
+        self.loading_timer.timeout.connect(self._show_loading_text)
+        self.loader = DataLoader(self)
+        self.loader.loaded.connect(self.show_data)
+        self.loader.failed.connect(self.on_loading_failed)
+        self.navigator = SliceNavigator()
+        self.navigator.hide()
+        self.navigator.selection_changed.connect(self.load_slice)
+        self.slice_reader = None
+        self.pending_prefetch = None
+        self.prefetch_loader = DataLoader(self)
+        # the (dataset, file) shown last by update_plot
+        self.shown_source = None
+        self.player = FramePlayer()
+        self.player.hide()
+        self.player.frame_ready.connect(self.show_frame)
+        self.frames_loader = DataLoader(self)
+        self.frames_loader.loaded.connect(self._set_player_frames)
+        self.frames_loader.failed.connect(print)
         FigureCanvas.setSizePolicy(self,
                                    QSizePolicy.Expanding,
                                    QSizePolicy.Expanding)
         FigureCanvas.updateGeometry(self)
 
+    def can_plot(self, selected_obj):
+        # decided from the metadata, without reading any data
+        if len(selected_obj.shape) == 1:
+            return selected_obj.dtype.type in self.allowed_types
+        return len(selected_obj.shape) >= 2
+
     def update_plot(self, selected_obj, file):
+        """
+        Reads the dataset in a worker thread and draws it when it is loaded,
+        unless another dataset was requested in the meantime. N-d datasets
+        are shown slice by slice, as chosen in the navigator.
+        """
+        self.pending_prefetch = None
+        self.shown_source = (selected_obj, file)
+        self.frames_loader.cancel()
+        self.player.clear()
+        if len(selected_obj.shape) > 2:
+            self.slice_reader = SliceReader(selected_obj)
+            self.navigator.set_shape(selected_obj.shape)
+            self.navigator.show()
+            self.load_slice()
+            return
+        self.slice_reader = None
+        self.navigator.hide()
         if len(selected_obj.shape) not in [1, 2]:
+            self.cancel_loading()
+            return
+        self.set_loading(True)
+        self.loader.load(self.get_load_job(selected_obj, file))
+
+    def get_load_job(self, selected_obj, file):
+        """
+        The read that update_plot does for a dataset, as job(is_cancelled),
+        or None if it is not plotted. Used to prefetch datasets.
+        """
+        if not self.can_plot(selected_obj):
+            return None
+        with_stats = self.axes_2d.needs_stats()
+        if len(selected_obj.shape) > 2:
+            shown_axes, indices, scrub_axis = self.navigator.get_selection(selected_obj.shape)
+            return partial(self._load_slice, SliceReader(selected_obj), shown_axes, indices, scrub_axis,
+                           with_stats)
+        return partial(self._load_data, self.axes_dict[len(selected_obj.shape)], selected_obj, file,
+                       self.get_target_shape(), with_stats)
+
+    @staticmethod
+    def _load_data(axes, selected_obj, file, target_shape, with_stats, is_cancelled):
+        # stats are read with images only for a colormap preset, else the colormap window computes them
+        if len(selected_obj.shape) == 2:
+            return 2, axes.load_data(selected_obj, file, is_cancelled, target_shape, with_stats)
+        return len(selected_obj.shape), axes.load_data(selected_obj, file, is_cancelled, target_shape)
+
+    def get_target_shape(self):
+        # canvas size in device pixels, the resolution worth reading
+        ratio = self.devicePixelRatioF()
+        return (max(self.MIN_TARGET_SIZE, int(self.height() * ratio)),
+                max(self.MIN_TARGET_SIZE, int(self.width() * ratio)))
+
+    def load_slice(self):
+        reader = self.slice_reader
+        if reader is None:
+            return
+        shown_axes = self.navigator.get_shown_axes()
+        indices = self.navigator.get_indices()
+        scrub_axis = self.navigator.get_scrub_axis()
+        self.player.pause()
+        self.set_loading(True)
+        self.loader.load(partial(self._load_slice, reader, shown_axes, indices, scrub_axis,
+                                 self.axes_2d.needs_stats()))
+        # the next block along the scrubbed axis is read once this slice is shown
+        self.pending_prefetch = partial(reader.prefetch, shown_axes, indices, scrub_axis,
+                                        self.navigator.direction)
+
+    @staticmethod
+    def _load_slice(reader, shown_axes, indices, scrub_axis, with_stats, is_cancelled):
+        data = reader.read(shown_axes, indices, scrub_axis, is_cancelled)
+        if len(shown_axes) == 1:
+            return 1, TraceData(np.arange(len(data)), data, None, None, None)
+        rows, cols = data.shape
+        stats = reader.get_stats(shown_axes, indices, data) if with_stats else None
+        return 2, ImageData(data, np.arange(cols), np.arange(rows), [0, cols - 1, 0, rows - 1], 1, None, stats)
+
+    def cancel_loading(self):
+        self.loader.cancel()
+        self.pending_prefetch = None
+        self.set_loading(False)
+
+    def set_loading(self, loading):
+        if loading:
+            self.loading_timer.start()
             return
-        new_status = len(selected_obj.shape)
+        self.loading_timer.stop()
+        if self.loading_text.get_text():
+            self.loading_text.set_text('')
+            self.draw_idle()
+
+    def _show_loading_text(self):
+        self.loading_text.set_text('Loading...')
+        self.draw_idle()
+
+    def show_data(self, result):
+        new_status, data = result
+        self.loading_timer.stop()
+        # a blitted image would leave the text on the rest of the figure
+        loading_shown = bool(self.loading_text.get_text())
+        self.loading_text.set_text('')
         current_ax = self.axes_dict[new_status]
         if new_status != self.status and self.status:
             self.axes_dict[self.status].ax.set_visible(False)
         current_ax.ax.set_visible(True)
-        current_ax.update_plot(selected_obj, file)
         self.status = new_status
+        current_ax.show_data(data)
+        if loading_shown:
+            self.draw_idle()
+        if self.pending_prefetch is not None:
+            self.prefetch_loader.load(self.pending_prefetch)
+            self.pending_prefetch = None
+        self.update_player()
+
+    def update_player(self):
+        """
+        Offers playback of the stack of images that the shown one belongs
+        to: the 2d slices along the scrubbed axis of an N-d dataset, or the
+        images in the group of a 2d dataset, which are listed in a worker
+        thread.
+        """
+        if self.status != 2:
+            self.player.clear()
+            return
+        frame_bytes = self.axes_2d.image.data.nbytes
+        if self.slice_reader is not None:
+            shown_axes = self.navigator.get_shown_axes()
+            scrub_axis = self.navigator.get_scrub_axis()
+            indices = self.navigator.get_indices()
+            obj = self.slice_reader.obj
+            fixed = indices[:scrub_axis] + indices[scrub_axis + 1:]
+            key = (obj.file.filename, obj.name, shown_axes, scrub_axis, fixed)
+            self.player.set_frames(key, obj.shape[scrub_axis], indices[scrub_axis],
+                                   partial(self._read_slice_frame, self.axes_2d, self.slice_reader, shown_axes,
+                                           indices, scrub_axis), frame_bytes)
+        elif self.shown_source is not None and len(self.shown_source[0].shape) == 2:
+            obj, file = self.shown_source
+            self.frames_loader.load(partial(self._get_group_frames, self.axes_2d, obj, file,
+                                            self.get_target_shape(), frame_bytes))
+
+    @staticmethod
+    def _get_group_frames(axes, obj, file, target_shape, frame_bytes, is_cancelled):
+        # runs in a worker thread, groups may hold many datasets
+        group = obj.parent
+        names = get_frame_names(group)
+        name = obj.name.rsplit('/', 1)[-1]
+        if len(names) < 2 or name not in names:
+            return None
+        return ((file.filename, group.name), len(names), names.index(name),
+                partial(WidgetPlot._read_group_frame, axes, group, names, file, target_shape), frame_bytes)
+
+    def _set_player_frames(self, frames):
+        if frames is None:
+            self.player.clear()
+        else:
+            self.player.set_frames(*frames)
+
+    @staticmethod
+    def _prepare_frame(axes, image):
+        # the log of a frame is taken by the reader thread, not by the plot
+        display = DisplayData(image.data, image.stats)
+        if axes.apply_log_status:
+            display.get_log()
+        return image, display
+
+    @staticmethod
+    def _read_slice_frame(axes, reader, shown_axes, indices, scrub_axis, number, is_cancelled):
+        indices = indices[:scrub_axis] + (number,) + indices[scrub_axis + 1:]
+        data = reader.read(shown_axes, indices, scrub_axis, is_cancelled)
+        rows, cols = data.shape
+        image = ImageData(data, np.arange(cols), np.arange(rows), [0, cols - 1, 0, rows - 1], 1, None)
+        return WidgetPlot._prepare_frame(axes, image)
+
+    @staticmethod
+    def _read_group_frame(axes, group, names, file, target_shape, number, is_cancelled):
+        # the range is held while playing, the stats are computed only if they are asked for
+        image = read_2d(group[names[number]], file, is_cancelled, target_shape, with_stats=False)
+        return WidgetPlot._prepare_frame(axes, image)
+
+    def show_frame(self, number, frame):
+        """Shows a frame of the player, in the colormap range of the shown image."""
+        image, display = frame
+        self.axes_2d.show_data(image, display, hold_range=True)
+        if self.slice_reader is not None:
+            self.navigator.set_index(self.navigator.get_scrub_axis(), number)
+
+    def on_loading_failed(self, message):
+        self.set_loading(False)
+        print(message)
 
     def context_menu(self, event):
         if event.button == 3 and self.status:
@@ -1,20 +1,26 @@
 from PyQt5.QtWidgets import QTreeView
 from PyQt5 import QtWidgets, QtCore, QtGui
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QStandardItemModel, QStandardItem
+from PyQt5.QtCore import Qt, QModelIndex, QPersistentModelIndex, pyqtSignal
 from myGUIApplication_ver2.dataframe_window import DataFrameWindow
-from collections import namedtuple
-from copy import deepcopy
+from myGUIApplication_ver2.h5_tree_model import H5TreeModel
+from myGUIApplication_ver2.file_loader import FileLoader
+from myGUIApplication_ver2.search_index import compile_query
+from myGUIApplication_ver2.live_follow import LiveFollower
+from myGUIApplication_ver2.h5_transfer import H5Transfer
+from myGUIApplication_ver2.background_job import BackgroundJob
+from myGUIApplication_ver2.file_pool import FilePool
+from myGUIApplication_ver2.h5_compact import compact_to_temp
+from myGUIApplication_ver2.data_cache import data_cache
+from myGUIApplication_ver2.batch_fit import RESULTS_NAME, RESULT_DATASETS, get_frame_names, get_resume_state, \
+    batch_fit
 from pandas import DataFrame
 import h5py
 from functools import partial
+import os
+import re
 
 __all__ = ['H5Tree']
 
-MyItem = namedtuple('MyItem', 'parent_id item')
-FileItemKeys = namedtuple('FileItemKeys',
-                          'short_name key parent_name filename')
-
 
 class MyWindow(QtWidgets.QMainWindow):
     def __init__(self, parent=None):
@@ -68,77 +74,221 @@ class MyWindow(QtWidgets.QMainWindow):
 
 
 class H5Tree(QTreeView):
+    MAX_SEARCH_RESULTS = 2000
+
+    search_status_changed = pyqtSignal(str)
+    # the file and the path of the plotted dataset, after its file was compacted
+    shown_dataset_replaced = pyqtSignal(str, str)
+
     def __init__(self, parent=None, file_list=None):
         super(QTreeView, self).__init__(parent)
         self.header().setDefaultSectionSize(200)
         # self.setSelectionMode(QtWidgets.QAbstractItemView.MultiSelection)
-        self.items_to_cut = {}
         self.current_df_win = None
         self.connect_context_menu(self.context_menu)
         self.selected_moving_item = None
-        self.model_ = MyItemModel()
+        self.clipboard_mode = None
+        self.current_job = None
+        # returns the FitSetup of batch fits, or None
+        self.get_fit_setup = None
+        self.file_pool = FilePool(on_closed=self.on_file_closed)
+        # the file of the plotted dataset, pinned while it is shown
+        self.shown_filename = None
+        self.shown_name = None
+        self.model_ = H5TreeModel(self.get_file)
         self.setModel(self.model_)
-        self.number_of_files = 0
+        self.setUniformRowHeights(True)
         self.adjustSize()
         self.setContextMenuPolicy(Qt.CustomContextMenu)
-        self.file_dict = {}
+        self.loader = FileLoader(self)
+        self.loader.file_opened.connect(self.on_file_opened)
+        self.loader.file_failed.connect(self.on_file_failed)
+        self.loader.file_indexed.connect(self.on_file_indexed)
+        self.opened_names = {}
+        self.edited_files = set()
+        self.search_indexes = {}
+        self.search_model = None
+        self.search_query = None
+        self.live_follower = LiveFollower(self.model_, parent=self)
+        self.live_follower.links_changed.connect(self.on_links_changed)
         if file_list is not None:
             for filename in file_list:
                 self.add_h5(filename)
 
     def open_new_h5(self, filename):
         self.close_files()
-        self.model().removeRows(0, self.model().rowCount())
-        self.file_dict = {}
-        self.number_of_files = 0
+        self.selected_moving_item = None
+        self.search('')
+        self.model_.clear()
+        self.opened_names = {}
+        self.edited_files = set()
+        self.search_indexes = {}
         self.add_file_to_tree(filename)
 
     def add_h5(self, filename):
         self.add_file_to_tree(filename)
 
+    def add_live_h5(self, filename):
+        self.loader.open(filename, swmr=True)
+
     def add_file_to_tree(self, filename):
-        file = h5py.File(filename, 'a')
-        self.file_dict.update({file.filename: file})
-        item_dict = {}
-
-        def add_to_item_list(name):
-            name_list = name.split('/')
-            short_name = name_list[-1]
-            parent_name = '/'.join(name_list[:-1]) if len(name_list) > 1 else '__root__'
-            item = QStandardItem(short_name)
-            data = FileItemKeys(short_name, name, parent_name, file.filename)
-            item.setData(data)
-            item_dict.update({name: item})
-
-        file.visit(add_to_item_list)
-        file_short_name = file.filename.split('\\')[-1].split('/')[-1]
-        file_item = QStandardItem(file_short_name)
-        data = FileItemKeys(file_short_name, '__root__', '', file.filename)
-        file_item.setData(data)
-        self.model_.setItem(self.number_of_files, 0, file_item)
-        self.number_of_files += 1
-        for item in item_dict.values():
-            data = item.data()
-            if data.parent_name == '__root__':
-                file_item.appendRow(item)
-            else:
-                item_dict[data.parent_name].appendRow(item)
-        self.model().layoutChanged.emit()
+        self.loader.open(filename)
+
+    def on_file_opened(self, filename, file, snapshot):
+        # pinned while the loader still reads it to build the snapshot and the index
+        self.file_pool.add(file, pinned=True)
+        if file.swmr_mode:
+            self.file_pool.pin(file.filename)
+        self.opened_names[filename] = file.filename
+        if snapshot is not None:
+            self.model_.set_snapshot(file.filename, snapshot)
+        if file.swmr_mode:
+            self.live_follower.add_file(file.filename)
+        self.model_.add_file(file.filename)
+
+    def on_file_indexed(self, filename, snapshot, path_index):
+        h5_filename = self.opened_names.get(filename)
+        if h5_filename not in self.file_pool:
+            return
+        self.file_pool.unpin(h5_filename)
+        if h5_filename in self.edited_files:
+            return
+        if not self.live_follower.is_live(h5_filename):
+            self.model_.set_snapshot(h5_filename, snapshot)
+        self.search_indexes[h5_filename] = path_index
+        if self.search_query is not None:
+            self.search(*self.search_query)
+
+    def on_links_changed(self, filename, added, removed):
+        path_index = self.search_indexes.get(filename)
+        if path_index is None:
+            return
+        for key in removed:
+            path_index.remove(key)
+        path_index.add_many(added)
+
+    def search(self, text, mode='substring', scope='name'):
+        if not text:
+            self.search_query = None
+            self.search_model = None
+            self._set_view_model(self.model_)
+            self.search_status_changed.emit('')
+            return
+        self.search_query = (text, mode, scope)
+        try:
+            regex = compile_query(text, mode)
+        except re.error as err:
+            self.search_status_changed.emit(f'Invalid pattern: {err}')
+            return
+        search_model = H5TreeModel(self.get_file)
+        search_model.snapshots = self.model_.snapshots
+        found = 0
+        not_indexed = 0
+        for filename in self.model_.filenames():
+            path_index = self.search_indexes.get(filename)
+            if path_index is None:
+                not_indexed += 1
+                continue
+            results = path_index.search_regex(regex, scope, limit=self.MAX_SEARCH_RESULTS - found)
+            found += len(results)
+            if results:
+                search_model.add_filtered_file(filename, results)
+            if found >= self.MAX_SEARCH_RESULTS:
+                break
+        self.search_model = search_model
+        self._set_view_model(search_model)
+        self._expand_filtered(QModelIndex())
+        status = f'{found} found'
+        if found >= self.MAX_SEARCH_RESULTS:
+            status += ' (showing the first results only)'
+        if not_indexed:
+            status += f', {not_indexed} file(s) still indexing'
+        self.search_status_changed.emit(status)
+
+    def _set_view_model(self, model):
+        if self.model() is model:
+            return
+        selection_model = self.selectionModel()
+        self.setModel(model)
+        selection_model.deleteLater()
+
+    def _expand_filtered(self, parent):
+        model = self.model()
+        for row in range(model.rowCount(parent)):
+            index = model.index(row, 0, parent)
+            if model.rowCount(index):
+                self.expand(index)
+                self._expand_filtered(index)
+
+    def is_editable(self, index=None):
+        if self.model() is not self.model_:
+            return False
+        if index is not None:
+            return self.file_pool.mode(self.get_item_data(index).filename) != 'r'
+        return True
+
+    def mark_edited(self, filename):
+        self.edited_files.add(filename)
+        self.model_.drop_snapshot(filename)
+
+    @staticmethod
+    def on_file_failed(filename, message):
+        print(f'Could not open {filename}: {message}')
+
+    def get_file(self, filename):
+        return self.file_pool.get(filename)
+
+    def on_file_closed(self, filename):
+        self.model_.forget_objects(filename)
+        if self.search_model is not None:
+            self.search_model.forget_objects(filename)
+        self.restamp_snapshot(filename)
+
+    def restamp_snapshot(self, filename):
+        # opening a file for writing touches it even if nothing was changed
+        snapshot = self.model_.snapshots.get(filename)
+        if snapshot is not None and filename not in self.edited_files:
+            snapshot.restamp(filename)
+
+    def set_shown_file(self, filename, name=None):
+        """
+        Keeps the file of the plotted dataset open: its objects are still
+        read by the plot, the player, the live follower and the prefetches.
+        """
+        self.shown_name = name
+        if filename == self.shown_filename:
+            return
+        if self.shown_filename is not None and self.shown_filename in self.file_pool:
+            self.file_pool.unpin(self.shown_filename)
+        self.shown_filename = filename
+        if filename is not None:
+            self.file_pool.pin(filename)
+
+    def set_max_open_files(self, max_open):
+        self.file_pool.set_max_open(max_open)
 
     def context_menu(self, position):
 
         index = self.selectedIndexes()[0]
         selected_object = self.get_selected_object_by_index(index)
         if self.selected_moving_item is not None:
-            selected_item = self.model_.itemFromIndex(index)
-            cutted_items = [my_item.item.data().key for my_item in
-                            self.items_to_cut.values()]
-            forbidden_action = selected_item.data().key in cutted_items
+            moving_index = QModelIndex(self.selected_moving_item)
+            # search results have nodes of their own, the cut item is in the tree
+            forbidden_action = index.model() is moving_index.model() and \
+                index.model().is_within(index, moving_index)
         else:
             forbidden_action = False
+        # the tree is not edited while it shows search results
+        forbidden_action = forbidden_action or not self.is_editable(index)
 
         menu = QtWidgets.QMenu()
 
+        if selected_object is None:
+            # a dangling link can only be deleted
+            link_action = menu.addAction(self.tr("Dangling link"))
+            link_action.setEnabled(False)
+            menu.addSeparator()
+
         new_ = menu.addMenu(self.tr("New"))
         create_action = new_.addAction(self.tr("New group"))
         create_action.triggered.connect(self.open_text_box)
@@ -148,27 +298,35 @@ class H5Tree(QTreeView):
 
         menu.addSeparator()
 
-        copy_action = menu.addAction(self.tr("Cut"))
-        copy_action.triggered.connect(self.cut_item)
+        copy_action = menu.addAction(self.tr("Copy"))
+        copy_action.triggered.connect(self.copy_item)
         copy_action.setEnabled(type(selected_object) in [h5py.Group,
-                                                         h5py.Dataset])
+                                                         h5py.Dataset]
+                               and self.model() is self.model_)
+
+        cut_action = menu.addAction(self.tr("Cut"))
+        cut_action.triggered.connect(self.cut_item)
+        cut_action.setEnabled(type(selected_object) in [h5py.Group,
+                                                        h5py.Dataset]
+                              and self.is_editable(index))
 
-        cancel_cut_action = menu.addAction(self.tr("Cancel cut"))
+        cancel_cut_action = menu.addAction(self.tr("Cancel copy") if self.clipboard_mode == 'copy'
+                                           else self.tr("Cancel cut"))
         cancel_cut_action.triggered.connect(self.cancel_cut)
         cancel_cut_action.setEnabled(self.selected_moving_item is not None)
 
         paste_action = menu.addAction(self.tr("Paste"))
-        paste_action.triggered.connect(self.move_item)
+        paste_action.triggered.connect(self.paste_item)
         paste_action.setEnabled(type(selected_object) in [h5py.Group,
                                                           h5py.File] \
                                 and not forbidden_action
-                                and len(self.items_to_cut) > 0)
+                                and self.selected_moving_item is not None)
         menu.addSeparator()
 
         remove_action = menu.addAction(self.tr("Delete"))
         remove_action.triggered.connect(self.remove_item)
-        remove_action.setEnabled(type(selected_object) in [h5py.Group,
-                                                           h5py.Dataset]
+        remove_action.setEnabled((selected_object is None or type(selected_object) in [h5py.Group,
+                                                                                       h5py.Dataset])
                                  and not forbidden_action)
 
         menu.addSeparator()
@@ -178,6 +336,18 @@ class H5Tree(QTreeView):
         show_action.triggered.connect(open_df)
         show_action.setEnabled(isinstance(selected_object, h5py.Dataset))
 
+        menu.addSeparator()
+
+        compact_action = menu.addAction(self.tr("Compact file"))
+        compact_action.triggered.connect(partial(self.compact_files, [self.get_item_data(index).filename]))
+        compact_action.setEnabled(self.is_editable(index))
+
+        batch_fit_action = menu.addAction(self.tr("Batch fit cut"))
+        batch_fit_action.triggered.connect(partial(self.batch_fit, index))
+        batch_fit_action.setEnabled(isinstance(selected_object, h5py.Group)
+                                    and self.get_fit_setup is not None
+                                    and not forbidden_action)
+
         menu.addSeparator()
         attrs_menu = menu.addMenu(self.tr('Attributes'))
         add_reference = attrs_menu.addAction(self.tr('Create reference'))
@@ -189,7 +359,7 @@ class H5Tree(QTreeView):
     def open_dataframe_window(self, obj):
         assert isinstance(obj, h5py.Dataset)
         if obj.shape:
-            df = DataFrame(obj[()])
+            df = DataFrame(data_cache.get_array(obj))
         else:
             df = DataFrame()
         self.current_df_win = DataFrameWindow(df)
@@ -202,180 +372,335 @@ class H5Tree(QTreeView):
             self.create_item(text)
 
     def create_item(self, text):
-        item = self.model_.itemFromIndex(self.selectedIndexes()[0])
-        data = item.data()
-        filename = data.filename
-        new_key = text if data.key == '__root__' else f'{data.key}/{text}'
-        parent_key = data.key
-        new_item = QStandardItem(text)
-        new_item.setData(FileItemKeys(text, new_key, parent_key, filename))
-        item.insertRow(0, new_item)
-        selected_obj = self.get_selected_object()
+        index = self.selectedIndexes()[0]
+        selected_obj = self.get_selected_object_by_index(index)
+        if not isinstance(selected_obj, h5py.Group):
+            return
         selected_obj.create_group(text)
+        data = self.get_item_data(index)
+        self.mark_edited(data.filename)
+        path_index = self.search_indexes.get(data.filename)
+        if path_index is not None:
+            path_index.add(text if data.key == '__root__' else f'{data.key}/{text}', True)
+        self.model_.insert_child(index, text, is_group=True)
 
     def remove_item(self):
         index, = self.selectedIndexes()
-        item_to_remove = self.model_.itemFromIndex(index)
-        name = item_to_remove.data().short_name
+        name = self.get_item_data(index).short_name
         buttonReply = QtWidgets.QMessageBox.question(self, 'PyQt5 message',
                                                      f"Do you really want to delete {name}"
                                                      f" from h5 file?",
                                                      QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
                                                      QtWidgets.QMessageBox.No)
         if buttonReply == QtWidgets.QMessageBox.Yes:
-            self._remove_by_item(item_to_remove)
-
-    def _remove_by_item(self, item):
-        file = self.file_dict[item.data().filename]
-        key = item.data().key
-        del file[key]
-        parent = item.parent() or self.model_
-        parent.removeRow(item.index().row())
+            self._remove_by_index(index)
+
+    def _remove_by_index(self, index):
+        data = self.get_item_data(index)
+        file = self.get_file(data.filename)
+        # None for a dangling link, which is deleted as any other link
+        obj = self.get_selected_object_by_index(index)
+        if isinstance(obj, h5py.Dataset):
+            data_cache.invalidate_object(obj)
+        else:
+            # the objects below a group are not known to the cache
+            data_cache.invalidate(data.filename)
+        del file[data.key]
+        self.mark_edited(data.filename)
+        path_index = self.search_indexes.get(data.filename)
+        if path_index is not None:
+            path_index.remove(data.key)
+        self.model_.remove_row(index)
 
     def cut_item(self):
+        self._set_clipboard('cut', Qt.red)
+
+    def copy_item(self):
+        self._set_clipboard('copy', Qt.darkGreen)
+
+    def _set_clipboard(self, mode, color):
         if self.selected_moving_item is not None:
             self.apply_color(self.selected_moving_item, Qt.black)
-
-        def iterate_over_branch(item, parent_id, id_):
-            id_ += 1
-            number_of_children = item.rowCount()
-            my_id = deepcopy(id_)
-            copied_item = QStandardItem(item.text())
-            copied_item.setData(item.data())
-            my_item = MyItem(parent_id, copied_item)
-            self.items_to_cut.update({id_: my_item})
-            for num in range(number_of_children):
-                id_ = iterate_over_branch(item.child(num), my_id, id_)
-            return id_
-
-        self.items_to_cut = {}
         index, = self.selectedIndexes()
-        item_to_copy = self.model_.itemFromIndex(index)
-        iterate_over_branch(item_to_copy, 0, 0)
-        self.selected_moving_item = item_to_copy
-        self.apply_color(item_to_copy, Qt.red)
+        self.selected_moving_item = QPersistentModelIndex(index)
+        self.clipboard_mode = mode
+        self.apply_color(self.selected_moving_item, color)
 
-    def apply_color(self, item, color=None):
+    def apply_color(self, index, color=None):
         color = color or Qt.black
-
-        def _paint(item_):
-            self.model_.setData(item_.index(),
-                                QtGui.QBrush(color),
-                                QtCore.Qt.ForegroundRole)
-            number_of_children = item_.rowCount()
-            for num in range(number_of_children):
-                _paint(item_.child(num))
-
-        _paint(item)
+        index = QModelIndex(index)
+        index.model().set_color(index, color)
+        self.viewport().update()
 
     def cancel_cut(self):
-        self.apply_color(self.selected_moving_item)
+        if self.selected_moving_item.isValid():
+            self.apply_color(self.selected_moving_item)
         self.selected_moving_item = None
-        self.items_to_cut = {}
+        self.clipboard_mode = None
 
-    def move_item(self):
-        item_to_move_to = self.model_.itemFromIndex(self.selectedIndexes()[0])
-        root_item = MyItem(-1, item_to_move_to)
-        if item_to_move_to == self.selected_moving_item.parent():
-            self.apply_color(self.selected_moving_item)
+    def paste_item(self):
+        target_index = QPersistentModelIndex(self.selectedIndexes()[0])
+        source_index = QModelIndex(self.selected_moving_item)
+        if not source_index.isValid():
+            self.cancel_cut()
+            return
+        source = self.get_item_data(source_index)
+        target = self.get_item_data(QModelIndex(target_index))
+        if self.clipboard_mode == 'cut' and source.filename == target.filename:
+            self.move_item(source_index, target_index)
+        else:
+            self.transfer_item(source_index, target_index,
+                               remove_source=self.clipboard_mode == 'cut')
+
+    def move_item(self, source_index, target_index):
+        if self.model_.parent(source_index) == QModelIndex(target_index):
+            self.cancel_cut()
+            return
+        source = self.get_item_data(source_index)
+        target = self.get_item_data(QModelIndex(target_index))
+        file = self.get_file(source.filename)
+        old_key = source.key
+        name = source.short_name
+        new_key = name if target.key == '__root__' else f'{target.key}/{name}'
+        message = f'Do you want to move item from {old_key} to {new_key}?'
+        buttonReply = QtWidgets.QMessageBox.question(self,
+                                                     'PyQt5 message',
+                                                     message,
+                                                     QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                                     QtWidgets.QMessageBox.No)
+        if buttonReply == QtWidgets.QMessageBox.Yes:
+            try:
+                file[new_key] = file[old_key]
+            except RuntimeError as err:
+                print(err)
+                return
+            is_group = source_index.model().is_group(source_index)
+            path_index = self.search_indexes.get(source.filename)
+            if path_index is not None:
+                path_index.move(old_key, new_key)
+            self._remove_by_index(source_index)
+            self.model_.insert_child(QModelIndex(target_index), name, is_group)
             self.selected_moving_item = None
-            self.items_to_cut = {}
+            self.clipboard_mode = None
+
+    def transfer_item(self, source_index, target_index, remove_source=False):
+        source = self.get_item_data(source_index)
+        target = self.get_item_data(QModelIndex(target_index))
+        source_obj = self.get_selected_object_by_index(source_index)
+        dest_group = self.get_selected_object_by_index(QModelIndex(target_index))
+        name = source.short_name
+        new_key = name if target.key == '__root__' else f'{target.key}/{name}'
+        if name in dest_group:
+            QtWidgets.QMessageBox.warning(self, 'PyQt5 message',
+                                          f'{new_key} already exists in {target.filename}')
             return
-        items_to_copy = {0: root_item}
-        items_to_copy.update(self.items_to_cut)
-        old_filename = next(iter(self.items_to_cut.values())).item.data().filename
-        new_filename = root_item.item.data().filename
-        if old_filename == new_filename:
-            file = self.file_dict[old_filename]
-            old_key = items_to_copy[1].item.data().key
-            name = items_to_copy[1].item.data().short_name
-            root_item_key = root_item.item.data().key
-            if root_item_key == '__root__':
-                new_key = name
-            else:
-                new_key = f'{root_item_key}/{name}'
-            message = f'Do you want to move item from {old_key} to {new_key}?'
-            buttonReply = QtWidgets.QMessageBox.question(self,
-                                                         'PyQt5 message',
-                                                         message,
+        action = 'move' if remove_source else 'copy'
+        message = f'Do you want to {action} {source.filename}:{source.key} ' \
+                  f'to {target.filename}:{new_key}?'
+        buttonReply = QtWidgets.QMessageBox.question(self,
+                                                     'PyQt5 message',
+                                                     message,
+                                                     QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+                                                     QtWidgets.QMessageBox.No)
+        if buttonReply != QtWidgets.QMessageBox.Yes:
+            return
+        job = BackgroundJob(f'Copying {name}', partial(self._copy_job, source_obj, dest_group, name), self)
+        job.finished.connect(partial(self.on_transfer_finished,
+                                     QPersistentModelIndex(source_index), target_index,
+                                     source_index.model().is_group(source_index), new_key, remove_source))
+        job.failed.connect(partial(QtWidgets.QMessageBox.warning, self, 'Copy error'))
+        # both files stay open while the job reads and writes them
+        filenames = (source.filename, target.filename)
+        for filename in filenames:
+            self.file_pool.pin(filename)
+        job.finished.connect(partial(self._unpin_files, filenames))
+        job.failed.connect(partial(self._unpin_files, filenames))
+        job.cancelled.connect(partial(self._unpin_files, filenames))
+        self.current_job = job
+        job.start()
+
+    def _unpin_files(self, filenames, *args):
+        for filename in filenames:
+            self.file_pool.unpin(filename)
+
+    @staticmethod
+    def _copy_job(source, dest_group, name, progress, is_cancelled):
+        transfer = H5Transfer(progress, is_cancelled)
+        transfer.copy(source, dest_group, name)
+        return transfer.dropped_references
+
+    def on_transfer_finished(self, source_index, target_index, is_group, new_key,
+                             remove_source, dropped_references):
+        self.current_job = None
+        if not source_index.isValid() or not target_index.isValid():
+            return
+        source = self.get_item_data(QModelIndex(source_index))
+        target = self.get_item_data(QModelIndex(target_index))
+        self.mark_edited(target.filename)
+        source_path_index = self.search_indexes.get(source.filename)
+        target_path_index = self.search_indexes.get(target.filename)
+        if source_path_index is not None and target_path_index is not None:
+            target_path_index.add_many([(new_key + path[len(source.key):], flag) for path, flag in
+                                        source_path_index.get_subtree(source.key)])
+        self.model_.insert_child(QModelIndex(target_index), source.short_name, is_group)
+        if remove_source:
+            self._remove_by_index(QModelIndex(source_index))
+            self.selected_moving_item = None
+            self.clipboard_mode = None
+        if dropped_references:
+            QtWidgets.QMessageBox.warning(self, 'PyQt5 message',
+                                          'References to objects outside of the copied item '
+                                          'were dropped:\n' + '\n'.join(dropped_references))
+
+    def batch_fit(self, index):
+        setup = self.get_fit_setup()
+        if setup is None:
+            QtWidgets.QMessageBox.information(self, 'Batch fit', 'Select a cut in the cut window of an image first.')
+            return
+        group = self.get_selected_object_by_index(index)
+        filename = self.get_item_data(index).filename
+        names = get_frame_names(group)
+        if not names:
+            QtWidgets.QMessageBox.information(self, 'Batch fit', f'There are no images in {group.name}.')
+            return
+        created = RESULTS_NAME not in group
+        if get_resume_state(group, names, setup) is None:
+            buttonReply = QtWidgets.QMessageBox.question(self, 'Batch fit',
+                                                         f'{group.name}/{RESULTS_NAME} has results of another '
+                                                         f'cut or model. Do you want to replace them?',
                                                          QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
                                                          QtWidgets.QMessageBox.No)
-            if buttonReply == QtWidgets.QMessageBox.Yes:
-                try:
-                    file[new_key] = file[old_key]
-                except RuntimeError as err:
-                    print(err)
-                    return
-                id_list = list(self.items_to_cut.keys())
-                id_list.sort()
-
-                for id_ in id_list:
-                    my_item = self.items_to_cut[id_]
-                    parent_id = my_item.parent_id
-                    parent = items_to_copy[parent_id].item
-                    if parent.data().key == '__root__':
-                        new_key = my_item.item.data().short_name
-                        parent_name = '__root__'
-                    else:
-                        new_key = '/'.join([parent.data().key,
-                                            my_item.item.data().short_name])
-                        parent_name = parent.data().short_name
-
-                    data = FileItemKeys(my_item.item.data().short_name,
-                                        new_key, parent_name,
-                                        new_filename)
-                    print(data)
-                    my_item.item.setData(data)
-                    if parent_id == 0:
-                        parent.insertRow(0, my_item.item)
-                    else:
-                        parent.appendRow(my_item.item)
-
-                self._remove_by_item(self.selected_moving_item)
-                self.selected_moving_item = None
-                self.items_to_cut = {}
-        else:
-            QtWidgets.QMessageBox.question(self, 'PyQt5 message',
-                                           'Moving between different'
-                                           'h5 files is not supported yet',
-                                           QtWidgets.QMessageBox.Ok)
+            if buttonReply != QtWidgets.QMessageBox.Yes:
+                return
+        job = BackgroundJob(f'Fitting {len(names)} images in {group.name}', partial(batch_fit, group, setup), self)
+        # the results of a cancelled fit are kept for resuming it
+        on_finished = partial(self.on_batch_fit_finished, QPersistentModelIndex(index), filename, created)
+        job.finished.connect(on_finished)
+        job.cancelled.connect(on_finished)
+        job.failed.connect(partial(QtWidgets.QMessageBox.warning, self, 'Batch fit error'))
+        job.failed.connect(on_finished)
+        self.file_pool.pin(filename)
+        for signal in (job.finished, job.failed, job.cancelled):
+            signal.connect(partial(self._unpin_files, (filename,)))
+        self.current_job = job
+        job.start()
+
+    def on_batch_fit_finished(self, index, filename, created, result=None):
+        self.current_job = None
+        self.mark_edited(filename)
+        # the results are written over in place when a fit is resumed
+        data_cache.invalidate(filename)
+        if index.isValid() and created and RESULTS_NAME in self.get_selected_object_by_index(QModelIndex(index)):
+            self._add_batch_fit_results(QModelIndex(index), filename)
+        if isinstance(result, tuple):
+            name, finished, failed = result
+            QtWidgets.QMessageBox.information(self, 'Batch fit',
+                                              f'Fitted {finished} images into {name}, {failed} fits failed.')
+
+    def _add_batch_fit_results(self, index, filename):
+        self.model_.insert_child(index, RESULTS_NAME, True)
+        path_index = self.search_indexes.get(filename)
+        if path_index is not None:
+            key = self.get_item_data(index).key
+            results_key = RESULTS_NAME if key == '__root__' else f'{key}/{RESULTS_NAME}'
+            path_index.add_many([(results_key, True)] +
+                                [(f'{results_key}/{name}', False) for name in RESULT_DATASETS])
+
+    def compact_all_files(self):
+        self.compact_files([filename for filename in self.file_pool.filenames()
+                            if self.file_pool.mode(filename) != 'r'])
+
+    def compact_files(self, filenames):
+        # files still read by the loader are left for later, the shown one is compacted
+        # and its dataset is shown again from the new file
+        filenames = [filename for filename in filenames
+                     if self.file_pool.pins.get(filename, 0) <= (filename == self.shown_filename)]
+        if not filenames:
+            return
+        job = BackgroundJob('Compacting files', partial(self._compact_job, filenames), self)
+        job.finished.connect(self.on_compact_finished)
+        job.failed.connect(partial(QtWidgets.QMessageBox.warning, self, 'Compaction error'))
+        self.current_job = job
+        job.start()
+
+    @staticmethod
+    def _compact_job(filenames, progress, is_cancelled):
+        results = []
+        try:
+            for number, filename in enumerate(filenames):
+                message = f'{os.path.basename(filename)} ({number + 1}/{len(filenames)})'
+                temp_filename = compact_to_temp(filename, partial(progress, message=message), is_cancelled)
+                results.append((filename, temp_filename))
+        except BaseException:
+            for _, temp_filename in results:
+                os.remove(temp_filename)
+            raise
+        return results
+
+    def on_compact_finished(self, results):
+        self.current_job = None
+        lines = []
+        total = 0
+        replaced = []
+        for filename, temp_filename in results:
+            old_size = os.path.getsize(filename)
+            self.file_pool.close(filename)
+            replaced.append(filename)
+            self.model_.forget_objects(filename)
+            # the objects are at other addresses in the compacted file
+            data_cache.invalidate(filename)
+            if self.search_model is not None:
+                self.search_model.forget_objects(filename)
+            try:
+                os.replace(temp_filename, filename)
+            except OSError as err:
+                print(err)
+                os.remove(temp_filename)
+                lines.append(f'{filename}: {err}')
+                continue
+            self.restamp_snapshot(filename)
+            reclaimed = old_size - os.path.getsize(filename)
+            total += reclaimed
+            lines.append(f'{filename}: {reclaimed / 1024 ** 2:.1f} MB')
+        lines.append(f'Reclaimed {total / 1024 ** 2:.1f} MB in total')
+        # the objects held by the plot were closed with the file
+        if self.shown_filename in replaced and self.shown_name is not None:
+            self.shown_dataset_replaced.emit(self.shown_filename, self.shown_name)
+        QtWidgets.QMessageBox.information(self, 'Compact files', '\n'.join(lines))
 
     def connect_context_menu(self, callback):
         self.customContextMenuRequested.connect(callback)
 
     def get_selected_object_by_index(self, index):
-        item = self.model_.itemFromIndex(index)
-        data = item.data()
-        file = self.file_dict[data.filename]
-        if data.key == '__root__':
-            return file
-        else:
-            return file[data.key]
+        return self.model().get_object(index)
+
+    @staticmethod
+    def get_item_data(index):
+        # the nodes of search results are in the search model, not in model_
+        return index.model().item_data(index)
 
     def get_obj_with_file(self, index):
-        item = self.model_.itemFromIndex(index)
-        data = item.data()
-        file = self.file_dict[data.filename]
-        if data.key == '__root__':
-            selected_obj = file
-        else:
-            selected_obj = file[data.key]
+        model = self.model()
+        selected_obj = model.get_object(index)
+        file = self.get_file(model.item_data(index).filename)
         return selected_obj, file
 
     def get_selected_object(self):
+        # None if the selection is a dangling link
         index = self.selectedIndexes()[0]
         return self.get_selected_object_by_index(index)
 
     def close_files(self):
-        for file in self.file_dict.values():
-            file.close()
-
-
-class MyItemModel(QStandardItemModel):
-    def __init__(self):
-        super(QStandardItemModel, self).__init__()
-        self.setHorizontalHeaderLabels(['Name'])
-        self.setRowCount(0)
+        self.loader.cancel_all()
+        self.live_follower.clear()
+        open_files = [filename for filename in self.file_pool.filenames() if self.file_pool.is_open(filename)]
+        for filename in self.file_pool.filenames():
+            data_cache.invalidate(filename)
+        self.file_pool.close_all()
+        self.shown_filename = None
+        self.shown_name = None
+        for filename in open_files:
+            self.restamp_snapshot(filename)
 
 
 if __name__ == '__main__':
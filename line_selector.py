@@ -0,0 +1,162 @@
+import numpy as np
+from matplotlib.lines import Line2D
+from matplotlib.patches import Polygon
+
+__all__ = ['LineSelector']
+
+
+class LineSelector(object):
+    """
+    An interactive line with a band of the given width around it, drawn
+    with blitting. Pressing and dragging draws a new line, the ends are
+    moved by their handles and the whole line by dragging it elsewhere
+    near the line. onmove(start, end) is called while dragging and
+    onselect(start, end) on release.
+    """
+    # distance to the handles and the line in pixels
+    GRAB_RANGE = 10
+
+    def __init__(self, ax, onselect, onmove=None, width=0, color='red'):
+        self.ax = ax
+        self.canvas = ax.figure.canvas
+        self.onselect = onselect
+        self.onmove = onmove
+        self.width = width
+        self.start = None
+        self.end = None
+        self.action = None
+        self.press_position = None
+        self.background = None
+        # artists are added without changing the data limits of the image
+        self.line = ax.add_artist(Line2D([], [], color=color, animated=True))
+        self.handles = ax.add_artist(Line2D([], [], color=color, marker='o', linestyle='', animated=True))
+        self.band = ax.add_artist(Polygon(np.zeros((4, 2)), closed=True, color=color, alpha=0.2,
+                                          animated=True, visible=False))
+        self.artists = [self.band, self.line, self.handles]
+        self.cids = [self.canvas.mpl_connect('button_press_event', self.on_press),
+                     self.canvas.mpl_connect('motion_notify_event', self.on_move),
+                     self.canvas.mpl_connect('button_release_event', self.on_release),
+                     self.canvas.mpl_connect('draw_event', self.on_draw)]
+
+    @property
+    def coordinates(self):
+        if self.start is None:
+            return None
+        return self.start[0], self.start[1], self.end[0], self.end[1]
+
+    def set_line(self, start, end):
+        self.start, self.end = tuple(start), tuple(end)
+        self._update_artists()
+        self.update()
+
+    def set_width(self, width):
+        self.width = width
+        self._update_artists()
+        self.update()
+
+    def set_visible(self, visible):
+        for artist in self.artists:
+            artist.set_visible(visible)
+        if visible:
+            self._update_artists()
+
+    def disconnect_events(self):
+        for cid in self.cids:
+            self.canvas.mpl_disconnect(cid)
+        self.cids = []
+        for artist in self.artists:
+            try:
+                artist.remove()
+            except (ValueError, NotImplementedError):
+                # already removed by cla()
+                pass
+
+    def ignore(self, event):
+        # the zoom and pan modes of the toolbar lock the canvas
+        return event.inaxes is not self.ax or event.button != 1 or \
+            not self.canvas.widgetlock.available(self) or event.xdata is None
+
+    def _update_artists(self):
+        if self.start is None:
+            return
+        (x1, y1), (x2, y2) = self.start, self.end
+        self.line.set_data([x1, x2], [y1, y2])
+        self.handles.set_data([x1, x2], [y1, y2])
+        length = np.hypot(x2 - x1, y2 - y1)
+        if self.width > 0 and length > 0:
+            nx, ny = (y1 - y2) / length * self.width / 2, (x2 - x1) / length * self.width / 2
+            self.band.set_xy([(x1 + nx, y1 + ny), (x2 + nx, y2 + ny), (x2 - nx, y2 - ny), (x1 - nx, y1 - ny)])
+            self.band.set_visible(self.line.get_visible())
+        else:
+            self.band.set_visible(False)
+
+    def _get_action(self, event):
+        if self.start is None or not self.line.get_visible():
+            return 'new'
+        points = self.ax.transData.transform([self.start, self.end])
+        position = np.array([event.x, event.y])
+        distances = np.hypot(*(points - position).T)
+        if distances.min() < self.GRAB_RANGE:
+            return 'start' if distances.argmin() == 0 else 'end'
+        direction = points[1] - points[0]
+        length = np.hypot(*direction)
+        if length > 0:
+            offset = position - points[0]
+            along = np.dot(offset, direction) / length
+            across = abs(direction[0] * offset[1] - direction[1] * offset[0]) / length
+            if 0 <= along <= length and across < self.GRAB_RANGE:
+                return 'move'
+        return 'new'
+
+    def on_press(self, event):
+        if self.ignore(event):
+            return
+        self.action = self._get_action(event)
+        self.press_position = (event.xdata, event.ydata, self.start, self.end)
+        if self.action == 'new':
+            self.start = self.end = (event.xdata, event.ydata)
+            self.set_visible(True)
+
+    def on_move(self, event):
+        if self.action is None or event.inaxes is not self.ax or event.xdata is None:
+            return
+        x, y = event.xdata, event.ydata
+        x0, y0, start, end = self.press_position
+        if self.action in ('new', 'end'):
+            self.end = (x, y)
+        elif self.action == 'start':
+            self.start = (x, y)
+        else:
+            dx, dy = x - x0, y - y0
+            self.start = (start[0] + dx, start[1] + dy)
+            self.end = (end[0] + dx, end[1] + dy)
+        self._update_artists()
+        self.update()
+        if self.onmove is not None:
+            self.onmove(self.start, self.end)
+
+    def on_release(self, event):
+        if self.action is None:
+            return
+        self.action = None
+        if self.start == self.end:
+            # a click without a drag does not make a line
+            self.start = self.end = None
+            self.set_visible(False)
+            self.update()
+            return
+        self.onselect(self.start, self.end)
+
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+
+    def update(self):
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.ax.bbox)
@@ -0,0 +1,68 @@
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+import h5py
+
+__all__ = ['LiveFollower']
+
+
+class LiveFollower(QObject):
+    """
+    Polls files opened in SWMR read mode. Only the groups listed in the tree
+    and the watched dataset are checked, by link count and shape, so the
+    cost of a poll does not grow with the file.
+    """
+    DEFAULT_INTERVAL = 1000
+
+    links_changed = pyqtSignal(str, object, object)
+    dataset_grown = pyqtSignal(object, object)
+
+    def __init__(self, model, interval=DEFAULT_INTERVAL, parent=None):
+        super(LiveFollower, self).__init__(parent)
+        self.model = model
+        self.filenames = set()
+        self.watched = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.poll)
+
+    def set_interval(self, interval):
+        self.timer.setInterval(interval)
+
+    def add_file(self, filename):
+        self.filenames.add(filename)
+        self.timer.start()
+
+    def clear(self):
+        self.filenames = set()
+        self.watched = None
+        self.timer.stop()
+
+    def is_live(self, filename):
+        return filename in self.filenames
+
+    def watch(self, obj, file):
+        if isinstance(obj, h5py.Dataset) and file.filename in self.filenames:
+            self.watched = (obj, file, obj.shape)
+        else:
+            self.watched = None
+
+    def poll(self):
+        for filename in list(self.filenames):
+            for node in self.model.fetched_groups(filename):
+                try:
+                    added, removed = self.model.refresh_group(node)
+                except (KeyError, RuntimeError, OSError, ValueError) as err:
+                    print(err)
+                    continue
+                if added or removed:
+                    self.links_changed.emit(filename, added, removed)
+        if self.watched is not None:
+            obj, file, shape = self.watched
+            try:
+                obj.refresh()
+            except (RuntimeError, OSError, ValueError) as err:
+                print(err)
+                self.watched = None
+                return
+            if obj.shape != shape:
+                self.watched = (obj, file, obj.shape)
+                self.dataset_grown.emit(obj, file)
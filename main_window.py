@@ -1,6 +1,7 @@
 from PyQt5 import QtWidgets
 from PyQt5.QtGui import QIcon
 from myGUIApplication_ver2.my_app import MyApp
+from myGUIApplication_ver2.data_cache import data_cache
 from directories import Directories
 import sys
 
@@ -30,6 +31,22 @@ class MainWindow(QtWidgets.QMainWindow):
         add_file_action.triggered.connect(self.add_file)
         file_menu.addAction(add_file_action)
 
+        add_live_file_action = QtWidgets.QAction('Add h5 file (live, SWMR)', self)
+        add_live_file_action.triggered.connect(self.add_live_file)
+        file_menu.addAction(add_live_file_action)
+
+        compact_files_action = QtWidgets.QAction('Compact all files', self)
+        compact_files_action.triggered.connect(self.app_widget.tree.compact_all_files)
+        file_menu.addAction(compact_files_action)
+
+        max_open_files_action = QtWidgets.QAction('Max open files...', self)
+        max_open_files_action.triggered.connect(self.set_max_open_files)
+        file_menu.addAction(max_open_files_action)
+
+        data_cache_action = QtWidgets.QAction('Data cache size...', self)
+        data_cache_action.triggered.connect(self.set_data_cache_size)
+        file_menu.addAction(data_cache_action)
+
     def init_toolbar(self):
         add_action = QtWidgets.QAction(QIcon('add.png'), 'Add', self)
         add_action.setShortcut('Ctrl+A')
@@ -55,6 +72,24 @@ class MainWindow(QtWidgets.QMainWindow):
     def add_file(self):
         self.open_file_name_dialog(self.app_widget.tree.add_h5)
 
+    def add_live_file(self):
+        self.open_file_name_dialog(self.app_widget.tree.add_live_h5)
+
+    def set_max_open_files(self):
+        tree = self.app_widget.tree
+        max_open, ok = QtWidgets.QInputDialog.getInt(self, 'Max open files',
+                                                     'Files kept open at the same time:',
+                                                     tree.file_pool.max_open, 1, 10000)
+        if ok:
+            tree.set_max_open_files(max_open)
+
+    def set_data_cache_size(self):
+        size, ok = QtWidgets.QInputDialog.getInt(self, 'Data cache size',
+                                                 'Memory for datasets read from files, MB:',
+                                                 data_cache.max_bytes // 1024 ** 2, 0, 1024 ** 2)
+        if ok:
+            data_cache.set_max_bytes(size * 1024 ** 2)
+
     def open_file(self):
         self.open_file_name_dialog(self.app_widget.tree.open_new_h5)
 
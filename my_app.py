@@ -4,6 +4,9 @@ import h5py
 from myGUIApplication_ver2.h5tree import H5Tree
 from myGUIApplication_ver2.my_label import DescriptiveLabel
 from myGUIApplication_ver2.h5plot import H5Plot
+from myGUIApplication_ver2.file_loader import FileLoadingPanel
+from myGUIApplication_ver2.search_bar import SearchBar
+from myGUIApplication_ver2.sibling_prefetch import SiblingPrefetcher
 
 
 class MyApp(QtWidgets.QWidget):
@@ -11,17 +14,33 @@ class MyApp(QtWidgets.QWidget):
         super(MyApp, self).__init__(parent)
         self.setWindowTitle('My H5 Viewer')
         self.current_df_win = None
-        self.tree = H5Tree(self, h5file_list)
+        # the files are added once the loading panel listens to the loader
+        self.tree = H5Tree(self)
         self.tree.clicked.connect(self.on_clicked)
         self.plot_widget = H5Plot()
         self.plot_handler = self.plot_widget.canvas
         self.h5InfoWidget = DescriptiveLabel()
+        self.loading_panel = FileLoadingPanel(self.tree.loader)
+        self.search_bar = SearchBar()
+        self.search_bar.search_changed.connect(self.tree.search)
+        self.tree.search_status_changed.connect(self.search_bar.set_status)
+        self.tree.live_follower.dataset_grown.connect(self.on_dataset_grown)
+        self.tree.shown_dataset_replaced.connect(self.on_shown_dataset_replaced)
+        self.prefetcher = SiblingPrefetcher(self.tree, self.plot_handler.get_load_job, parent=self)
+        self.tree.get_fit_setup = self.plot_handler.axes_2d.get_fit_setup
 
         self.grid = QtWidgets.QGridLayout()
         self.setLayout(self.grid)
-        self.grid.addWidget(self.tree, 0, 0, 0, 1)
+        self.tree_layout = QtWidgets.QVBoxLayout()
+        self.tree_layout.addWidget(self.search_bar)
+        self.tree_layout.addWidget(self.tree)
+        self.tree_layout.addWidget(self.loading_panel)
+        self.grid.addLayout(self.tree_layout, 0, 0, 0, 1)
         self.grid.addWidget(self.h5InfoWidget, 0, 1)
         self.grid.addWidget(self.plot_widget, 1, 1)
+        if h5file_list is not None:
+            for filename in h5file_list:
+                self.tree.add_h5(filename)
 
     def open_new_h5(self, filename):
         self.tree.change_file(filename)
@@ -30,22 +49,42 @@ class MyApp(QtWidgets.QWidget):
         self.tree.add_file(filename)
 
     def on_clicked(self, signal):
-        selected_object, file = self.tree.get_obj_with_file(signal)
-        self.update_label(selected_object)
         try:
-            if isinstance(selected_object, h5py.Dataset):
-                if selected_object.shape:
-                    if type(selected_object[0]) in self.plot_handler.allowed_types:
-                        self.plot_handler.update_plot(selected_obj=selected_object, file=file)
-                    else:
-                        print(selected_object[0])
-                        print(type(selected_object[0]))
+            selected_object, file = self.tree.get_obj_with_file(signal)
+            self.update_label(selected_object)
+            self.tree.live_follower.watch(selected_object, file)
+            self.prefetcher.on_selected(signal)
+            if isinstance(selected_object, h5py.Dataset) and selected_object.shape \
+                    and self.plot_handler.can_plot(selected_object):
+                self.tree.set_shown_file(file.filename, selected_object.name)
+                self.plot_handler.update_plot(selected_obj=selected_object, file=file)
+                return
         except Exception as err:
-            print('ERROR OCCURED!!!')
             print(err)
+        # a pending read of the previous selection is not drawn anymore
+        self.plot_handler.cancel_loading()
+
+    def on_dataset_grown(self, obj, file):
+        try:
+            self.plot_handler.update_plot(selected_obj=obj, file=file)
+        except Exception as err:
+            print(err)
+
+    def on_shown_dataset_replaced(self, filename, name):
+        # the plotted objects are invalid once the file is compacted, they are read from the new file
+        self.prefetcher.cancel()
+        try:
+            file = self.tree.get_file(filename)
+            obj = file[name]
+            self.tree.live_follower.watch(obj, file)
+            self.plot_handler.update_plot(selected_obj=obj, file=file)
+        except Exception as err:
+            print(err)
+            self.plot_handler.cancel_loading()
 
     def update_label(self, obj):
         self.h5InfoWidget.update_table(obj)
 
     def close_files(self):
+        self.prefetcher.cancel()
         self.tree.close_files()
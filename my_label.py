@@ -4,6 +4,8 @@ from PyQt5.QtWidgets import QSizePolicy, QHeaderView
 import numpy as np
 import h5py
 
+from myGUIApplication_ver2.data_cache import data_cache
+
 _TYPE_DICT = {h5py.Dataset: 'Dataset', h5py.Group: 'Group',
               h5py.File: 'File'}
 
@@ -22,8 +24,12 @@ class DescriptiveLabel(QTableView):
     def update_table(self, obj):
         self.model().removeRows(0, self.model().rowCount())
         self.model().removeColumns(0, self.model().columnCount())
+        if obj is None:
+            self.model().appendRow(QStandardItem('Dangling link'))
+            return
         name = self._get_label(obj)
-        attrs_keys = list(obj.attrs.keys())
+        attrs = data_cache.get_attrs(obj)
+        attrs_keys = list(attrs.keys())
         if len(attrs_keys) == 0:
             self.model().appendRow(QStandardItem(name))
         else:
@@ -31,20 +37,20 @@ class DescriptiveLabel(QTableView):
             self.model().appendRow([QStandardItem(name)] + first_row)
             second_row = []
             for k in attrs_keys:
-                if isinstance(obj.attrs[k], float):
-                    second_row.append(QStandardItem(str(obj.attrs[k])))
-                elif isinstance(obj.attrs[k], str):
-                    second_row.append(QStandardItem(obj.attrs[k]))
-                elif isinstance(obj.attrs[k], np.ndarray):
-                    second_row.append(QStandardItem(f'Array of shape {obj.attrs[k].shape}'))
-                elif isinstance(obj.attrs[k], h5py.Reference):
+                if isinstance(attrs[k], float):
+                    second_row.append(QStandardItem(str(attrs[k])))
+                elif isinstance(attrs[k], str):
+                    second_row.append(QStandardItem(attrs[k]))
+                elif isinstance(attrs[k], np.ndarray):
+                    second_row.append(QStandardItem(f'Array of shape {attrs[k].shape}'))
+                elif isinstance(attrs[k], h5py.Reference):
                     second_row.append(QStandardItem('Reference'))
                 else:
                     try:
-                        second_row.append(QStandardItem(str(obj.attrs[k])))
+                        second_row.append(QStandardItem(str(attrs[k])))
                     except Exception as err:
                         print(err)
-                        second_row.append(QStandardItem(str(type(obj.attrs[k]))))
+                        second_row.append(QStandardItem(str(type(attrs[k]))))
             self.model().appendRow([QStandardItem('Attrs')] + second_row)
 
     @staticmethod
@@ -0,0 +1,536 @@
+import os
+import zlib
+from collections import namedtuple
+from functools import partial
+from hashlib import sha1
+from itertools import product
+import numpy as np
+
+from myGUIApplication_ver2.tree_cache import get_cache_dir, file_identity, prune_cache, touch_cache_entry
+from myGUIApplication_ver2.data_cache import data_cache
+
+__all__ = ['LoadCancelled', 'ImageData', 'TraceData', 'read_array', 'read_1d', 'read_2d', 'get_2d_axes',
+           'get_step', 'read_strided', 'read_overview', 'get_region', 'get_region_extent',
+           'get_x_axis_dataset', 'read_envelope', 'SliceReader', 'ImageStats', 'get_image_stats',
+           'get_value_range',
+           'DisplayData', 'get_deflate_filters', 'read_chunks']
+
+BLOCK_BYTES = 16 * 1024 ** 2
+# contiguous datasets are read row by row above this step, chunked ones always in blocks
+ROW_BY_ROW_STEP = 4
+# overviews of smaller datasets are not worth a cache file
+OVERVIEW_CACHE_MIN_BYTES = 64 * 1024 ** 2
+# the least recently used overviews are removed beyond this size
+OVERVIEW_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# values below are clipped before the log
+MIN_LOG_ARG = 0.1
+HISTOGRAM_BINS = 256
+# quantiles and histograms of larger images are taken from a subsample
+STATS_SAMPLES = 2 ** 20
+# quantiles kept for the percentiles, every 0.1%
+QUANTILES = np.linspace(0, 1, 1001)
+# HDF5 filters that read_chunks undoes itself
+H5Z_FILTER_DEFLATE = 1
+H5Z_FILTER_SHUFFLE = 2
+
+# data and x1, x2 axes as shown, possibly every step-th pixel of the dataset;
+# extent of the whole dataset; source is (dataset, file); stats of the data
+ImageData = namedtuple('ImageData', 'data x1 x2 extent step source stats', defaults=(None,))
+# range of the values, their QUANTILES and (counts, edges) of the values and of their log
+ImageStats = namedtuple('ImageStats', 'range quantiles histogram log_histogram')
+# x, y and their sample indices in the dataset; source is (dataset, file)
+# and n_bins the number of envelope bins if the trace is decimated
+TraceData = namedtuple('TraceData', 'x y indices source n_bins')
+
+
+class LoadCancelled(Exception):
+    pass
+
+
+def _rows_per_block(obj, block_bytes):
+    row_bytes = max(1, obj.dtype.itemsize * int(np.prod(obj.shape[1:])))
+    rows = max(1, block_bytes // row_bytes)
+    if obj.chunks:
+        # whole chunks only, so that no chunk is decompressed twice
+        rows = max(obj.chunks[0], rows // obj.chunks[0] * obj.chunks[0])
+    return rows
+
+
+def read_array(obj, is_cancelled=None, block_bytes=BLOCK_BYTES):
+    """
+    Reads a dataset in blocks of rows and raises LoadCancelled between
+    blocks once is_cancelled() is true. The result is kept in data_cache.
+    """
+    return data_cache.get(obj, (), partial(_read_blocks, obj, is_cancelled, block_bytes))
+
+
+def _read_blocks(obj, is_cancelled, block_bytes):
+    if is_cancelled is None or not obj.shape or obj.dtype.hasobject:
+        return obj[()]
+    deflated = get_deflate_filters(obj) is not None
+    out = np.empty(obj.shape, dtype=obj.dtype)
+    rows = _rows_per_block(obj, block_bytes)
+    for start in range(0, obj.shape[0], rows):
+        if is_cancelled():
+            raise LoadCancelled()
+        selection = np.s_[start:min(obj.shape[0], start + rows)]
+        if deflated:
+            read_chunks(obj, (selection,), out[selection])
+        else:
+            obj.read_direct(out, selection, selection)
+    return out
+
+
+def get_deflate_filters(obj):
+    """
+    The filters of a chunked dataset compressed by deflate only, or by
+    shuffle and deflate, in the order they were applied, or None for any
+    other dataset.
+    """
+    if not obj.chunks or obj.dtype.hasobject:
+        return None
+    plist = obj.id.get_create_plist()
+    filters = tuple(plist.get_filter(number)[0] for number in range(plist.get_nfilters()))
+    if filters in [(H5Z_FILTER_DEFLATE,), (H5Z_FILTER_SHUFFLE, H5Z_FILTER_DEFLATE)]:
+        return filters
+    return None
+
+
+def _decode_chunk(obj, filters, raw, filter_mask):
+    # a set bit of filter_mask means that the filter at its position was skipped
+    for position in reversed(range(len(filters))):
+        if filter_mask & (1 << position):
+            continue
+        if filters[position] == H5Z_FILTER_DEFLATE:
+            raw = zlib.decompress(raw, bufsize=obj.dtype.itemsize * int(np.prod(obj.chunks)))
+        else:
+            raw = np.frombuffer(raw, np.uint8).reshape(obj.dtype.itemsize, -1).T.tobytes()
+    return np.frombuffer(raw, obj.dtype).reshape(obj.chunks)
+
+
+def read_chunks(obj, selection, out=None):
+    """
+    obj[selection] of a dataset with get_deflate_filters, for a selection of
+    integers and slices with step 1. h5py holds its lock while HDF5
+    decompresses, so the raw chunks are read and inflated here by zlib,
+    which releases the GIL, and reader threads decompress at once.
+    """
+    filters = get_deflate_filters(obj)
+    selection = tuple(selection) + (slice(None),) * (obj.ndim - len(selection))
+    ranges = []
+    for index, size in zip(selection, obj.shape):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(size)
+            assert step == 1, 'read_chunks takes slices with step 1'
+        else:
+            start = index + size if index < 0 else index
+            stop = start + 1
+        ranges.append((start, max(start, stop)))
+    shape = tuple(stop - start for start, stop in ranges)
+    # integers drop their axes, as in obj[selection]
+    dropped = tuple(axis for axis, index in enumerate(selection) if not isinstance(index, slice))
+    if out is None:
+        out = np.empty(tuple(size for axis, size in enumerate(shape) if axis not in dropped), dtype=obj.dtype)
+    block = np.expand_dims(out, dropped)
+    starts = [range(start // chunk * chunk, stop, chunk) for (start, stop), chunk in zip(ranges, obj.chunks)]
+    for offset in product(*starts):
+        source, target = [], []
+        for chunk_start, chunk, (start, stop) in zip(offset, obj.chunks, ranges):
+            low, high = max(start, chunk_start), min(stop, chunk_start + chunk)
+            source.append(slice(low - chunk_start, high - chunk_start))
+            target.append(slice(low - start, high - start))
+        try:
+            filter_mask, raw = obj.id.read_direct_chunk(offset)
+        except RuntimeError:
+            # a chunk that was never written
+            block[tuple(target)] = obj.fillvalue
+            continue
+        block[tuple(target)] = _decode_chunk(obj, filters, raw, filter_mask)[tuple(source)]
+    return out
+
+
+def _read_axis(obj, file, name):
+    return data_cache.get_array(file[data_cache.get_attrs(obj)[name]])
+
+
+def read_1d(obj, file, is_cancelled=None):
+    y = read_array(obj, is_cancelled)
+    try:
+        x = _read_axis(obj, file, 'x_axis')
+        assert len(x) == len(y)
+    except (AssertionError, TypeError, KeyError):
+        x = np.arange(len(y))
+    return x, y
+
+
+def get_x_axis_dataset(obj, file):
+    try:
+        x_obj = file[data_cache.get_attrs(obj)['x_axis']]
+        assert x_obj.shape == obj.shape
+        return x_obj
+    except (AssertionError, TypeError, KeyError, AttributeError):
+        return None
+
+
+def _envelope_indices(y, bin_size):
+    # positions of the minimum and the maximum of every bin, in order
+    full = len(y) // bin_size * bin_size
+    parts = []
+    if full:
+        bins = y[:full].reshape(-1, bin_size)
+        pairs = np.sort(np.stack([bins.argmin(axis=1), bins.argmax(axis=1)], axis=1), axis=1)
+        parts.append((pairs + np.arange(0, full, bin_size)[:, None]).ravel())
+    if full < len(y):
+        tail = y[full:]
+        parts.append(np.sort([tail.argmin(), tail.argmax()]) + full)
+    return np.concatenate(parts)
+
+
+def read_envelope(obj, n_bins, index_range=None, x_obj=None, is_cancelled=None, block_bytes=BLOCK_BYTES):
+    """
+    Minimum and maximum of every one of n_bins bins of a 1d dataset region,
+    read in blocks, so that peaks stay visible at any decimation. Returns
+    TraceData with two points per bin, or every point if there are few.
+    """
+    start, stop = index_range or (0, obj.shape[0])
+    selection = ('envelope', n_bins, start, stop, x_obj.name if x_obj is not None else None)
+    return data_cache.get(obj, selection, partial(_read_envelope, obj, n_bins, start, stop, x_obj,
+                                                  is_cancelled, block_bytes))
+
+
+def _read_envelope(obj, n_bins, start, stop, x_obj, is_cancelled, block_bytes):
+    is_cancelled = is_cancelled or (lambda: False)
+    bin_size = max(1, -(-(stop - start) // n_bins))
+    if bin_size <= 2:
+        indices = np.arange(start, stop)
+        y = obj[start:stop]
+        x = x_obj[start:stop] if x_obj is not None else indices
+        return TraceData(x, y, indices, None, n_bins)
+    block_size = max(1, block_bytes // (bin_size * obj.dtype.itemsize)) * bin_size
+    indices, xs, ys = [], [], []
+    for block_start in range(start, stop, block_size):
+        if is_cancelled():
+            raise LoadCancelled()
+        block_stop = min(stop, block_start + block_size)
+        y = obj[block_start:block_stop]
+        local = _envelope_indices(y, bin_size)
+        indices.append(local + block_start)
+        ys.append(y[local])
+        if x_obj is not None:
+            xs.append(x_obj[block_start:block_stop][local])
+    indices = np.concatenate(indices)
+    x = np.concatenate(xs) if xs else indices
+    return TraceData(x, np.concatenate(ys), indices, None, n_bins)
+
+
+def get_step(shape, target_shape):
+    return max(1, int(np.ceil(max(size / max(1, target) for size, target in zip(shape, target_shape)))))
+
+
+def read_strided(obj, step, row_range=None, col_range=None, is_cancelled=None, block_bytes=BLOCK_BYTES):
+    """
+    Reads every step-th row and column of a region of a 2d dataset. Strided
+    hyperslabs are slow in HDF5, so chunk aligned blocks of rows are read
+    whole and subsampled, and only the needed rows of contiguous datasets
+    and of datasets with chunks of fewer than step rows, from the chunks
+    that hold their columns.
+    """
+    is_cancelled = is_cancelled or (lambda: False)
+    r0, r1 = row_range or (0, obj.shape[0])
+    c0, c1 = col_range or (0, obj.shape[1])
+    rows = range(r0, r1, step)
+    out = np.empty((len(rows), len(range(c0, c1, step))), dtype=obj.dtype)
+    if obj.chunks is None and step >= ROW_BY_ROW_STEP or obj.chunks and step >= obj.chunks[0]:
+        # the chunks between the rows, and between the columns if they are as small, are not read
+        skip_columns = obj.chunks is not None and step >= obj.chunks[1]
+        for idx, row in enumerate(rows):
+            if idx % 64 == 0 and is_cancelled():
+                raise LoadCancelled()
+            out[idx] = obj[row, c0:c1:step] if skip_columns else obj[row, c0:c1][::step]
+        return out
+    row_bytes = max(1, obj.dtype.itemsize * (c1 - c0))
+    block_rows = max(1, block_bytes // row_bytes)
+    if obj.chunks:
+        block_rows = max(obj.chunks[0], block_rows // obj.chunks[0] * obj.chunks[0])
+        start = r0 // obj.chunks[0] * obj.chunks[0]
+    else:
+        start = r0
+    for start in range(start, r1, block_rows):
+        if is_cancelled():
+            raise LoadCancelled()
+        stop = min(r1, start + block_rows)
+        first = r0 + -(-(max(start, r0) - r0) // step) * step
+        if first >= stop:
+            continue
+        block = obj[first:stop, c0:c1][::step, ::step]
+        idx = (first - r0) // step
+        out[idx:idx + len(block)] = block
+    return out
+
+
+def _overview_path(obj, step):
+    key = f'{file_identity(obj.file.filename)}:{obj.name}:{obj.shape}:{step}'
+    return os.path.join(get_cache_dir(), 'overviews', sha1(key.encode('utf-8')).hexdigest() + '.npy')
+
+
+def read_overview(obj, step, is_cancelled=None):
+    """
+    Every step-th pixel of a large image. Overviews of datasets larger than
+    OVERVIEW_CACHE_MIN_BYTES are kept in the user cache while the file is
+    unchanged, so that they are shown at once the next time, up to
+    OVERVIEW_CACHE_MAX_BYTES of them.
+    """
+    return data_cache.get(obj, ('overview', step), partial(_read_overview, obj, step, is_cancelled))
+
+
+def _read_overview(obj, step, is_cancelled):
+    if obj.size * obj.dtype.itemsize < OVERVIEW_CACHE_MIN_BYTES:
+        return read_strided(obj, step, is_cancelled=is_cancelled)
+    path = _overview_path(obj, step)
+    try:
+        overview = np.load(path)
+        touch_cache_entry(path)
+        return overview
+    except (OSError, ValueError):
+        pass
+    overview = read_strided(obj, step, is_cancelled=is_cancelled)
+    tmp_path = f'{path}.{os.getpid()}.tmp.npy'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(tmp_path, overview)
+        os.replace(tmp_path, path)
+    except OSError as err:
+        print(f'Could not save overview {path}: {err}')
+        return overview
+    prune_cache(os.path.dirname(path), OVERVIEW_CACHE_MAX_BYTES)
+    return overview
+
+
+def get_region(extent, shape, xlim, ylim):
+    """
+    Rows and columns of an image shown by imshow with the default upper
+    origin and the given extent that are visible within xlim and ylim.
+    """
+    left, right, bottom, top = extent
+    cols = sorted((x - left) / (right - left) * shape[1] for x in xlim)
+    rows = sorted((y - top) / (bottom - top) * shape[0] for y in ylim)
+    c0, c1 = max(0, int(np.floor(cols[0]))), min(shape[1], int(np.ceil(cols[1])))
+    r0, r1 = max(0, int(np.floor(rows[0]))), min(shape[0], int(np.ceil(rows[1])))
+    return r0, max(r0, r1), c0, max(c0, c1)
+
+
+def get_region_extent(extent, shape, r0, r1, c0, c1):
+    left, right, bottom, top = extent
+    dx = (right - left) / shape[1]
+    dy = (bottom - top) / shape[0]
+    return [left + c0 * dx, left + c1 * dx, top + r1 * dy, top + r0 * dy]
+
+
+def get_2d_axes(obj, file, shape):
+    """Returns the x and y axes of an image from its x_axis and y_axis attributes."""
+    try:
+        x_ax = _read_axis(obj, file, 'x_axis')
+        y_ax = _read_axis(obj, file, 'y_axis')
+        assert (len(x_ax), len(y_ax)) == shape \
+               or (len(y_ax), len(x_ax)) == shape, 'shapes are wrong'
+        if (len(y_ax), len(x_ax)) == shape:
+            y_ax, x_ax = x_ax, y_ax
+        return y_ax, x_ax
+    except (AssertionError, TypeError, KeyError):
+        return np.arange(shape[1]), np.arange(shape[0])
+
+
+def read_2d(obj, file, is_cancelled=None, target_shape=None, with_stats=False):
+    """
+    Reads an image, or an overview of it if it is larger than target_shape
+    (height, width) in pixels, and its stats if with_stats is true.
+    """
+    step = get_step(obj.shape, target_shape) if target_shape else 1
+    if step > 1:
+        data = read_overview(obj, step, is_cancelled)
+    else:
+        data = read_array(obj, is_cancelled)
+    x1, x2 = get_2d_axes(obj, file, obj.shape)
+    extent = [x1[0], x1[-1], x2[0], x2[-1]]
+    stats = data_cache.get(obj, ('stats', step), partial(get_image_stats, data)) if with_stats else None
+    return ImageData(data, x1[::step], x2[::step], extent, step, (obj, file), stats)
+
+
+class SliceReader(object):
+    """
+    Reads 1d and 2d slices of an N-d dataset. The slices are read in blocks
+    of neighbours along the scrubbed axis, aligned to the chunks of the
+    dataset, so that every chunk is decompressed once and the next slices
+    are already in memory. The blocks are kept in data_cache.
+    """
+    BLOCK_BYTES = 32 * 1024 ** 2
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def _block_range(self, shown_axes, scrub_axis, index):
+        obj = self.obj
+        slice_bytes = obj.dtype.itemsize * int(np.prod([obj.shape[axis] for axis in shown_axes]))
+        length = obj.chunks[scrub_axis] if obj.chunks else 1
+        length = max(1, min(length, self.BLOCK_BYTES // max(1, slice_bytes)))
+        start = index // length * length
+        return start, min(obj.shape[scrub_axis], start + length)
+
+    def _get_block(self, shown_axes, indices, scrub_axis, start, stop, is_cancelled):
+        fixed = tuple(index for axis, index in enumerate(indices)
+                      if axis not in shown_axes and axis != scrub_axis)
+        key = ('block', shown_axes, scrub_axis, fixed, start, stop)
+        return data_cache.get(self.obj, key, partial(self._read_block, shown_axes, indices, scrub_axis,
+                                                      start, stop, is_cancelled))
+
+    def _read_block(self, shown_axes, indices, scrub_axis, start, stop, is_cancelled):
+        if is_cancelled is not None and is_cancelled():
+            raise LoadCancelled()
+        selection = tuple(slice(None) if axis in shown_axes else
+                          slice(start, stop) if axis == scrub_axis else index
+                          for axis, index in enumerate(indices))
+        if get_deflate_filters(self.obj) is not None:
+            return read_chunks(self.obj, selection)
+        return self.obj[selection]
+
+    def read(self, shown_axes, indices, scrub_axis, is_cancelled=None):
+        """
+        The slice along shown_axes, in their order, at indices of the other
+        axes; scrub_axis is the axis that is moved through.
+        """
+        index = indices[scrub_axis]
+        start, stop = self._block_range(shown_axes, scrub_axis, index)
+        block = self._get_block(shown_axes, indices, scrub_axis, start, stop, is_cancelled)
+        block_axes = sorted(shown_axes + (scrub_axis,))
+        frame = np.take(block, index - start, axis=block_axes.index(scrub_axis))
+        return frame.transpose([sorted(shown_axes).index(axis) for axis in shown_axes])
+
+    def get_stats(self, shown_axes, indices, frame):
+        """The stats of a frame returned by read, kept in data_cache."""
+        fixed = tuple(index for axis, index in enumerate(indices) if axis not in shown_axes)
+        return data_cache.get(self.obj, ('stats', shown_axes, fixed), partial(get_image_stats, frame))
+
+    def prefetch(self, shown_axes, indices, scrub_axis, direction, is_cancelled=None):
+        start, stop = self._block_range(shown_axes, scrub_axis, indices[scrub_axis])
+        index = stop if direction > 0 else start - 1
+        if 0 <= index < self.obj.shape[scrub_axis]:
+            start, stop = self._block_range(shown_axes, scrub_axis, index)
+            self._get_block(shown_axes, indices, scrub_axis, start, stop, is_cancelled)
+
+
+def get_log_bounds(value_range):
+    """
+    The values that the log of an image is clipped to. Images with no value
+    above MIN_LOG_ARG are clipped to MIN_LOG_ARG.
+    """
+    low = max([MIN_LOG_ARG, value_range[0]])
+    return low, max([low, value_range[1]])
+
+
+def _get_log_range(value_range):
+    # the log is monotonic, so its range is the log of the clipped range
+    low, high = get_log_bounds(value_range)
+    return np.log(low), np.log(high)
+
+
+def get_value_range(data):
+    """The range of the finite values of an image, or its range if there are none."""
+    if data.dtype.kind == 'b':
+        data = data.view(np.uint8)
+    value_range = (np.amin(data), np.amax(data))
+    if data.dtype.kind in 'fc' and not np.isfinite(value_range).all():
+        finite = data[np.isfinite(data)]
+        if finite.size:
+            value_range = (finite.min(), finite.max())
+    return value_range
+
+
+def get_image_stats(data, n_bins=HISTOGRAM_BINS, n_samples=STATS_SAMPLES):
+    """
+    The range of an image, the quantiles of its finite values and their
+    histograms, as shown and as their log. Quantiles and histograms of
+    images larger than n_samples pixels are taken from every k-th pixel,
+    overviews of large datasets are such subsamples already.
+    """
+    data = np.asarray(data)
+    if data.dtype.kind == 'b':
+        # np.histogram does not take booleans
+        data = data.view(np.uint8)
+    value_range = (np.amin(data), np.amax(data))
+    sample = data.ravel()[::max(1, data.size // n_samples)]
+    if sample.dtype.kind in 'fc':
+        sample = sample[np.isfinite(sample)]
+    if not sample.size:
+        return ImageStats(value_range, None, None, None)
+    if not np.isfinite(value_range).all():
+        value_range = (sample.min(), sample.max())
+    quantiles = np.quantile(sample, QUANTILES)
+    sample = sample.astype(np.float32)
+    histogram = np.histogram(sample, n_bins, range=value_range)
+    low, high = get_log_bounds(value_range)
+    if not np.isfinite(high) or high <= MIN_LOG_ARG:
+        # the log of the image is constant
+        return ImageStats(value_range, quantiles, histogram, None)
+    np.clip(sample, low, high, out=sample)
+    log_histogram = np.histogram(np.log(sample, out=sample), n_bins, range=_get_log_range(value_range))
+    return ImageStats(value_range, quantiles, histogram, log_histogram)
+
+
+class DisplayData(object):
+    """
+    The range, the percentiles and the histograms of an image and its log,
+    clipped to at least MIN_LOG_ARG, each computed once, when it is asked
+    for, or taken from the stats read with the image. The log is computed in place in a float32
+    buffer, unless the values do not fit in float32.
+    """
+    MIN_LOG_ARG = MIN_LOG_ARG
+
+    def __init__(self, data, stats=None):
+        self.data = data
+        self.stats = stats
+        self._range = stats.range if stats is not None else None
+        self._log = None
+
+    def get_range(self, log=False):
+        if self._range is None:
+            self._range = get_value_range(np.asarray(self.data))
+        return _get_log_range(self._range) if log else self._range
+
+    def _get_log_bounds(self):
+        return get_log_bounds(self.get_range())
+
+    def get_stats(self):
+        if self.stats is None:
+            self.stats = get_image_stats(self.data)
+        return self.stats
+
+    def get_histogram(self, log=False):
+        """Counts and edges over get_range(log), or None."""
+        stats = self.get_stats()
+        return stats.log_histogram if log else stats.histogram
+
+    def get_percentiles(self, low, high, log=False):
+        """The values at the low and high percent, or the range if they are equal."""
+        quantiles = self.get_stats().quantiles
+        if quantiles is None:
+            return self.get_range(log)
+        values = np.interp([low / 100, high / 100], QUANTILES, quantiles)
+        if log:
+            values = np.log(np.clip(values, *self._get_log_bounds()))
+        if not values[0] < values[1]:
+            return self.get_range(log)
+        return values[0], values[1]
+
+    def get_log(self):
+        if self._log is None:
+            low, high = self._get_log_bounds()
+            data = self.data
+            if data.dtype.kind in 'biuf' and high < np.finfo(np.float32).max:
+                log = np.empty(data.shape, dtype=np.float32)
+                log[...] = data
+                np.clip(log, low, high, out=log)
+                np.log(log, out=log)
+            else:
+                log = np.log(np.clip(data, low, high))
+            self._log = log
+        return self._log
@@ -0,0 +1,143 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from matplotlib import rcParams
+from matplotlib.colors import Normalize
+from matplotlib.image import AxesImage
+
+__all__ = ['RasterImage', 'raster_imshow', 'get_lut', 'map_to_rgba']
+
+# outputs of more pixels are colormapped in blocks of rows by several threads
+PARALLEL_PIXELS = 2 ** 20
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(min(8, os.cpu_count() or 1))
+    return _executor
+
+
+def get_lut(cmap):
+    """The colors of cmap as uint8 RGBA: under, the N colors, over and bad."""
+    colors = cmap(np.arange(-1, cmap.N + 2), bytes=True)
+    colors[-1] = cmap(np.nan, bytes=True)
+    return colors
+
+
+def _map_block(values, vmin, vmax, lut, out):
+    n_colors = len(lut) - 3
+    scaled = np.subtract(values, vmin, dtype=np.float32)
+    if vmax > vmin:
+        scaled *= np.float32(n_colors / (vmax - vmin))
+    else:
+        scaled[...] = 0
+    # the top of the range is the last color, as in Colormap
+    np.putmask(scaled, (scaled >= n_colors) & (values <= vmax), n_colors - 1)
+    np.clip(scaled, -1, n_colors, out=scaled)
+    np.floor(scaled, out=scaled)
+    bad = np.isnan(scaled) if values.dtype.kind == 'f' else None
+    if bad is not None:
+        scaled[bad] = 0
+    indices = scaled.astype(np.intp)
+    indices += 1
+    if bad is not None:
+        indices[bad] = n_colors + 2
+    np.take(lut, indices, axis=0, out=out)
+
+
+def map_to_rgba(values, vmin, vmax, lut, out=None):
+    """
+    Colormaps a 2d array linearly between vmin and vmax through lut of
+    get_lut into uint8 RGBA. Large arrays are mapped by several threads,
+    numpy releases the GIL.
+    """
+    if out is None:
+        out = np.empty(values.shape + (4,), dtype=np.uint8)
+    if values.size <= PARALLEL_PIXELS:
+        _map_block(values, vmin, vmax, lut, out)
+        return out
+    rows = max(1, PARALLEL_PIXELS // 4 // max(1, values.shape[1]))
+    futures = [_get_executor().submit(_map_block, values[start:start + rows], vmin, vmax, lut,
+                                      out[start:start + rows])
+               for start in range(0, len(values), rows)]
+    for future in futures:
+        future.result()
+    return out
+
+
+class RasterImage(AxesImage):
+    """
+    An AxesImage that samples only the data under the screen pixels it
+    covers, the nearest pixel for each, and colormaps them through a uint8
+    lookup table, instead of resampling and colormapping the whole array.
+    Images that it does not handle, with other norms, RGB data or
+    non-affine transforms, are drawn by AxesImage.
+    """
+
+    def set_data(self, A):
+        # NaN are colored as bad through the lookup table, a plain image is
+        # kept without the masked copy of it that AxesImage makes
+        if type(A) is not np.ndarray or A.ndim != 2 or A.dtype.kind not in 'biuf':
+            return super(RasterImage, self).set_data(A)
+        self._A = A
+        self._imcache = None
+        self.stale = True
+
+    def _can_rasterize(self):
+        return type(self.norm) is Normalize and self._A is not None and self._A.ndim == 2 and \
+            self._A.dtype.kind in 'biuf' and self.get_transform().is_affine and \
+            np.ndim(self.get_alpha()) == 0
+
+    def make_image(self, renderer, magnification=1.0, unsampled=False):
+        if unsampled or not self._can_rasterize():
+            if not np.ma.isMaskedArray(self._A):
+                self._A = self._normalize_image_array(self._A)
+            return super(RasterImage, self).make_image(renderer, magnification, unsampled)
+        data = self._A
+        if not self.norm.scaled():
+            self.norm.autoscale_None(np.ma.masked_invalid(data, copy=False))
+        left, right, bottom, top = self.get_extent()
+        (x_left, y_bottom), (x_right, y_top) = self.get_transform().transform([(left, bottom), (right, top)])
+        # display coordinates of the edges of the first and the last rows
+        y_first, y_last = (y_top, y_bottom) if self.origin == 'upper' else (y_bottom, y_top)
+        clip = (self.get_clip_box() or self.axes.bbox) if self.get_clip_on() else self.get_figure(root=True).bbox
+        x0 = max(int(np.floor(min(x_left, x_right) * magnification)), int(np.floor(clip.x0 * magnification)))
+        x1 = min(int(np.ceil(max(x_left, x_right) * magnification)), int(np.ceil(clip.x1 * magnification)))
+        y0 = max(int(np.floor(min(y_bottom, y_top) * magnification)), int(np.floor(clip.y0 * magnification)))
+        y1 = min(int(np.ceil(max(y_bottom, y_top) * magnification)), int(np.ceil(clip.y1 * magnification)))
+        if x1 <= x0 or y1 <= y0 or x_left == x_right or y_first == y_last:
+            return None, 0, 0, None
+        # the data pixel under the center of every screen pixel, rows from the
+        # bottom, as the renderer takes them
+        x = (np.arange(x0, x1) + 0.5) / magnification
+        y = (np.arange(y0, y1) + 0.5) / magnification
+        cols = np.floor((x - x_left) / (x_right - x_left) * data.shape[1]).astype(np.intp)
+        rows = np.floor((y - y_first) / (y_last - y_first) * data.shape[0]).astype(np.intp)
+        valid_cols = (cols >= 0) & (cols < data.shape[1])
+        valid_rows = (rows >= 0) & (rows < data.shape[0])
+        values = np.take(np.take(data, np.clip(rows, 0, data.shape[0] - 1), axis=0),
+                         np.clip(cols, 0, data.shape[1] - 1), axis=1)
+        if np.ma.isMaskedArray(values):
+            values = values.filled(np.nan)
+        out = map_to_rgba(values, self.norm.vmin, self.norm.vmax, get_lut(self.get_cmap()))
+        # pixels beyond the edges of the data are left transparent
+        out[~valid_rows] = 0
+        out[:, ~valid_cols] = 0
+        return out, x0 / magnification, y0 / magnification, None
+
+
+def raster_imshow(ax, data, cmap=None, norm=None, aspect=None, vmin=None, vmax=None, origin=None,
+                  extent=None, **kwargs):
+    """Adds data to ax as ax.imshow does, as a RasterImage."""
+    image = RasterImage(ax, cmap=cmap, norm=norm, origin=origin, extent=extent, **kwargs)
+    ax.set_aspect(rcParams['image.aspect'] if aspect is None else aspect)
+    image.set_data(data)
+    image.set_clip_path(ax.patch)
+    if vmin is not None or vmax is not None:
+        image.set_clim(vmin, vmax)
+    # updates the data limits and the view as imshow does
+    image.set_extent(image.get_extent())
+    ax.add_image(image)
+    return image
@@ -0,0 +1,41 @@
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import pyqtSignal
+
+from myGUIApplication_ver2.search_index import SEARCH_MODES, SEARCH_SCOPES
+
+__all__ = ['SearchBar']
+
+
+class SearchBar(QtWidgets.QWidget):
+    search_changed = pyqtSignal(str, str, str)
+
+    def __init__(self, parent=None):
+        super(SearchBar, self).__init__(parent)
+        self.line_edit = QtWidgets.QLineEdit()
+        self.line_edit.setPlaceholderText('Search')
+        self.line_edit.setClearButtonEnabled(True)
+        self.mode_box = QtWidgets.QComboBox()
+        self.mode_box.addItems([mode.capitalize() for mode in SEARCH_MODES])
+        self.scope_box = QtWidgets.QComboBox()
+        self.scope_box.addItems([scope.capitalize() for scope in SEARCH_SCOPES])
+        self.status_label = QtWidgets.QLabel()
+
+        self.line_edit.textChanged.connect(self._emit_search)
+        self.mode_box.currentIndexChanged.connect(self._emit_search)
+        self.scope_box.currentIndexChanged.connect(self._emit_search)
+
+        grid = QtWidgets.QGridLayout()
+        grid.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(grid)
+        grid.addWidget(self.line_edit, 0, 0)
+        grid.addWidget(self.mode_box, 0, 1)
+        grid.addWidget(self.scope_box, 0, 2)
+        grid.addWidget(self.status_label, 1, 0, 1, 3)
+
+    def _emit_search(self, *args):
+        self.search_changed.emit(self.line_edit.text(),
+                                 SEARCH_MODES[self.mode_box.currentIndex()],
+                                 SEARCH_SCOPES[self.scope_box.currentIndex()])
+
+    def set_status(self, text):
+        self.status_label.setText(text)
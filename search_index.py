@@ -0,0 +1,167 @@
+import re
+from bisect import bisect_left
+from heapq import merge
+import numpy as np
+
+__all__ = ['PathIndex', 'compile_query', 'SEARCH_MODES', 'SEARCH_SCOPES']
+
+SEARCH_MODES = ('substring', 'glob', 'regex')
+SEARCH_SCOPES = ('name', 'path')
+
+
+def glob_to_regex(pattern):
+    result = []
+    i, n = 0, len(pattern)
+    while i < n:
+        char = pattern[i]
+        i += 1
+        if char == '*':
+            result.append('[^\n]*')
+        elif char == '?':
+            result.append('[^\n]')
+        elif char == '[':
+            j = pattern.find(']', i + 1 if i < n and pattern[i] in '!]' else i)
+            if j == -1:
+                result.append('\\[')
+                continue
+            chars = pattern[i:j].replace('\\', '\\\\')
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            result.append(f'[{chars}]')
+            i = j + 1
+        else:
+            result.append(re.escape(char))
+    return ''.join(result)
+
+
+def compile_query(text, mode='substring', case_sensitive=False):
+    flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+    if mode == 'substring':
+        pattern = re.escape(text)
+    elif mode == 'glob':
+        pattern = f'^{glob_to_regex(text)}$'
+    elif mode == 'regex':
+        pattern = text
+    else:
+        raise ValueError(f'Unknown search mode {mode}')
+    return re.compile(pattern, flags)
+
+
+class PathIndex(object):
+    """
+    Sorted paths of all objects of a file. Paths and names are also joined
+    into two newline separated strings, so that a query is a single regular
+    expression scan and matches are mapped back to rows with searchsorted.
+    Added paths are kept aside and merged in, and the strings joined again,
+    only when the index is read.
+    """
+
+    def __init__(self, paths, is_group):
+        pairs = sorted(zip(paths, is_group))
+        self.paths = [path for path, _ in pairs]
+        self.is_group = [flag for _, flag in pairs]
+        self._pending = []
+        self._update()
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        paths, is_group = [], []
+        stack = ['__root__']
+        while stack:
+            key = stack.pop()
+            for name, group_flag in snapshot.get_children(key) or ():
+                child_key = name if key == '__root__' else f'{key}/{name}'
+                paths.append(child_key)
+                is_group.append(group_flag)
+                if group_flag:
+                    stack.append(child_key)
+        return cls(paths, is_group)
+
+    def __len__(self):
+        return len(self.paths) + len(self._pending)
+
+    def _update(self):
+        names = [path.rsplit('/', 1)[-1] for path in self.paths]
+        self.path_blob, self.path_offsets = self._join(self.paths)
+        self.name_blob, self.name_offsets = self._join(names)
+        self._stale = False
+
+    def _merge_pending(self):
+        if not self._pending:
+            return
+        pairs = list(merge(zip(self.paths, self.is_group), sorted(self._pending)))
+        self._pending = []
+        self.paths = [path for path, _ in pairs]
+        self.is_group = [flag for _, flag in pairs]
+        self._stale = True
+
+    @staticmethod
+    def _join(lines):
+        lengths = np.fromiter((len(line) + 1 for line in lines), dtype=np.int64, count=len(lines))
+        offsets = np.zeros(len(lines), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        return '\n'.join(lines) + '\n', offsets
+
+    def search(self, text, mode='substring', scope='path', case_sensitive=False, limit=None):
+        regex = compile_query(text, mode, case_sensitive)
+        return self.search_regex(regex, scope, limit)
+
+    def search_regex(self, regex, scope='path', limit=None):
+        self._merge_pending()
+        if self._stale:
+            self._update()
+        if scope == 'path':
+            blob, offsets = self.path_blob, self.path_offsets
+        else:
+            blob, offsets = self.name_blob, self.name_offsets
+        starts = []
+        last_line_end = -1
+        for match in regex.finditer(blob):
+            start = match.start()
+            # an empty match after the last newline is not a line
+            if start <= last_line_end or start == len(blob):
+                continue
+            starts.append(start)
+            last_line_end = blob.find('\n', start)
+            if limit is not None and len(starts) >= limit:
+                break
+        rows = np.searchsorted(offsets, np.asarray(starts, dtype=np.int64), side='right') - 1
+        rows = rows[rows < len(self.paths)]
+        return [(self.paths[row], self.is_group[row]) for row in rows]
+
+    def _subtree(self, key):
+        self._merge_pending()
+        row = bisect_left(self.paths, key)
+        if row == len(self.paths) or self.paths[row] != key:
+            row = None
+        # '0' is the character following '/'
+        start = bisect_left(self.paths, key + '/')
+        stop = bisect_left(self.paths, key + '0')
+        return row, start, stop
+
+    def get_subtree(self, key):
+        row, start, stop = self._subtree(key)
+        rows = ([] if row is None else [row]) + list(range(start, stop))
+        return [(self.paths[row], self.is_group[row]) for row in rows]
+
+    def add(self, key, is_group):
+        self.add_many([(key, is_group)])
+
+    def add_many(self, pairs):
+        self._pending.extend(pairs)
+
+    def remove(self, key):
+        removed = self.get_subtree(key)
+        if removed:
+            row, start, stop = self._subtree(key)
+            del self.paths[start:stop]
+            del self.is_group[start:stop]
+            if row is not None:
+                del self.paths[row]
+                del self.is_group[row]
+            self._stale = True
+        return removed
+
+    def move(self, old_key, new_key):
+        removed = self.remove(old_key)
+        self.add_many([(new_key + path[len(old_key):], flag) for path, flag in removed])
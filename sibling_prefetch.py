@@ -0,0 +1,80 @@
+from PyQt5.QtCore import QObject
+import h5py
+
+from myGUIApplication_ver2.data_loader import DataLoader
+from myGUIApplication_ver2.data_cache import data_cache, get_size
+from myGUIApplication_ver2.plot_data import LoadCancelled
+
+__all__ = ['SiblingPrefetcher']
+
+
+class SiblingPrefetcher(QObject):
+    """
+    Notices steps through the items of a group in the tree and reads the
+    next count siblings in the same direction into data_cache, by the same
+    jobs the plot uses, so that the next step does not wait for the disk.
+    The axes that the datasets refer to are read by those jobs as well.
+    """
+    DEFAULT_COUNT = 8
+    DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+    # larger steps between rows are not taken for browsing
+    MAX_STRIDE = 4
+
+    def __init__(self, tree, get_job, count=DEFAULT_COUNT, max_bytes=DEFAULT_MAX_BYTES, parent=None):
+        super(SiblingPrefetcher, self).__init__(parent)
+        self.tree = tree
+        # get_job(obj, file) returns job(is_cancelled) or None
+        self.get_job = get_job
+        self.count = count
+        self.max_bytes = max_bytes
+        self.last_selected = None
+        self.loader = DataLoader(self)
+        self.loader.failed.connect(print)
+
+    def on_selected(self, index):
+        last_selected, self.last_selected = self.last_selected, (index.model(), index.parent(), index.row())
+        if last_selected is None or last_selected[:2] != self.last_selected[:2]:
+            return
+        stride = index.row() - last_selected[2]
+        if stride == 0 or abs(stride) > self.MAX_STRIDE:
+            return
+        model = index.model()
+        jobs = []
+        for step in range(1, self.count + 1):
+            sibling = model.index(index.row() + step * stride, 0, index.parent())
+            if not sibling.isValid():
+                break
+            if model.is_group(sibling):
+                continue
+            try:
+                obj, file = self.tree.get_obj_with_file(sibling)
+            except (KeyError, RuntimeError, OSError, ValueError) as err:
+                print(err)
+                continue
+            if not isinstance(obj, h5py.Dataset):
+                continue
+            job = self.get_job(obj, file)
+            if job is not None:
+                jobs.append((obj, job))
+        if jobs:
+            # prefetched data should not push the shown dataset out of the cache
+            max_bytes = min(self.max_bytes, data_cache.max_bytes // 2)
+            self.loader.load(lambda is_cancelled: self._prefetch(jobs, max_bytes, is_cancelled))
+        else:
+            self.loader.cancel()
+
+    @staticmethod
+    def _prefetch(jobs, max_bytes, is_cancelled):
+        size = 0
+        for obj, job in jobs:
+            if is_cancelled():
+                raise LoadCancelled()
+            data_cache.get_attrs(obj)
+            # a started read is finished, the plot may be waiting for it in data_cache
+            size += get_size(job(lambda: False))
+            if size >= max_bytes:
+                break
+
+    def cancel(self):
+        self.last_selected = None
+        self.loader.cancel()
@@ -0,0 +1,143 @@
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import Qt, pyqtSignal
+
+__all__ = ['SliceNavigator']
+
+
+class SliceNavigator(QtWidgets.QWidget):
+    """
+    Chooses a 2d or 1d slice of an N-d dataset: the shown axes and an
+    index for every other axis.
+    """
+    MODES = ('Image', 'Line')
+
+    selection_changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super(SliceNavigator, self).__init__(parent)
+        self.shape = ()
+        self.scrub_axis = None
+        self.direction = 1
+        self._last_value = 0
+        self.sliders = []
+        self.spin_boxes = []
+        self.labels = []
+        self._updating = False
+
+        self.mode_box = QtWidgets.QComboBox()
+        self.mode_box.addItems(self.MODES)
+        self.y_axis_box = QtWidgets.QComboBox()
+        self.x_axis_box = QtWidgets.QComboBox()
+        self.mode_box.currentIndexChanged.connect(self._on_axes_changed)
+        self.y_axis_box.currentIndexChanged.connect(self._on_axes_changed)
+        self.x_axis_box.currentIndexChanged.connect(self._on_axes_changed)
+
+        grid = QtWidgets.QGridLayout()
+        grid.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(grid)
+        grid.addWidget(self.mode_box, 0, 0)
+        grid.addWidget(QtWidgets.QLabel('y axis'), 0, 1)
+        grid.addWidget(self.y_axis_box, 0, 2)
+        grid.addWidget(QtWidgets.QLabel('x axis'), 0, 3)
+        grid.addWidget(self.x_axis_box, 0, 4)
+        self.slider_grid = QtWidgets.QGridLayout()
+        grid.addLayout(self.slider_grid, 1, 0, 1, 5)
+
+    def set_shape(self, shape):
+        # indices and axes are kept when a dataset of the same rank is shown
+        if len(shape) == len(self.shape):
+            self.shape = tuple(shape)
+            self._updating = True
+            for axis, size in enumerate(shape):
+                self.sliders[axis].setMaximum(size - 1)
+                self.spin_boxes[axis].setMaximum(size - 1)
+            self._updating = False
+            self._update_enabled()
+            return
+        self.shape = tuple(shape)
+        self.scrub_axis = None
+        self._updating = True
+        for widgets in (self.sliders, self.spin_boxes, self.labels):
+            for widget in widgets:
+                self.slider_grid.removeWidget(widget)
+                widget.deleteLater()
+        self.sliders, self.spin_boxes, self.labels = [], [], []
+        for box in (self.y_axis_box, self.x_axis_box):
+            box.clear()
+            box.addItems([f'{axis} ({size})' for axis, size in enumerate(shape)])
+        self.y_axis_box.setCurrentIndex(len(shape) - 2)
+        self.x_axis_box.setCurrentIndex(len(shape) - 1)
+        for axis, size in enumerate(shape):
+            label = QtWidgets.QLabel(f'axis {axis}')
+            slider = QtWidgets.QSlider(Qt.Horizontal)
+            slider.setMaximum(size - 1)
+            spin_box = QtWidgets.QSpinBox()
+            spin_box.setMaximum(size - 1)
+            slider.valueChanged.connect(spin_box.setValue)
+            spin_box.valueChanged.connect(slider.setValue)
+            slider.valueChanged.connect(lambda value, axis=axis: self._on_index_changed(axis, value))
+            self.slider_grid.addWidget(label, axis, 0)
+            self.slider_grid.addWidget(slider, axis, 1)
+            self.slider_grid.addWidget(spin_box, axis, 2)
+            self.labels.append(label)
+            self.sliders.append(slider)
+            self.spin_boxes.append(spin_box)
+        self._updating = False
+        self._update_enabled()
+
+    def get_shown_axes(self):
+        x_axis = self.x_axis_box.currentIndex()
+        if self.mode_box.currentIndex() == 1:
+            return (x_axis,)
+        y_axis = self.y_axis_box.currentIndex()
+        if y_axis == x_axis:
+            # the same axis twice is shown as a line
+            return (x_axis,)
+        return y_axis, x_axis
+
+    def get_selection(self, shape):
+        """Shown axes, indices and scrub axis that set_shape(shape) would leave."""
+        if len(shape) == len(self.shape):
+            indices = tuple(min(index, size - 1) for index, size in zip(self.get_indices(), shape))
+            return self.get_shown_axes(), indices, self.get_scrub_axis()
+        x_axis = len(shape) - 1
+        shown_axes = (x_axis,) if self.mode_box.currentIndex() == 1 else (x_axis - 1, x_axis)
+        return shown_axes, (0,) * len(shape), 0
+
+    def get_indices(self):
+        return tuple(slider.value() for slider in self.sliders)
+
+    def set_index(self, axis, index):
+        """Moves the slider of axis without emitting selection_changed."""
+        self._updating = True
+        self.sliders[axis].setValue(index)
+        self._updating = False
+        self._last_value = index
+
+    def get_scrub_axis(self):
+        shown_axes = self.get_shown_axes()
+        if self.scrub_axis is None or self.scrub_axis in shown_axes:
+            return next(axis for axis in range(len(self.shape)) if axis not in shown_axes)
+        return self.scrub_axis
+
+    def _update_enabled(self):
+        shown_axes = self.get_shown_axes()
+        self.y_axis_box.setEnabled(self.mode_box.currentIndex() == 0)
+        for axis, (slider, spin_box) in enumerate(zip(self.sliders, self.spin_boxes)):
+            slider.setEnabled(axis not in shown_axes)
+            spin_box.setEnabled(axis not in shown_axes)
+
+    def _on_axes_changed(self, *args):
+        if self._updating:
+            return
+        self._update_enabled()
+        self.selection_changed.emit()
+
+    def _on_index_changed(self, axis, value):
+        if self._updating:
+            return
+        if axis == self.scrub_axis:
+            self.direction = 1 if value >= self._last_value else -1
+        self.scrub_axis = axis
+        self._last_value = value
+        self.selection_changed.emit()
@@ -0,0 +1,177 @@
+import json
+import os
+import time
+from hashlib import sha1
+import h5py
+
+__all__ = ['TreeSnapshot', 'file_identity', 'get_cache_dir', 'list_link_names', 'prune_cache', 'touch_cache_entry']
+
+CACHE_DIR_ENV = 'H5VIEWER_CACHE_DIR'
+# entries of the caches that were not used for longer are removed
+CACHE_MAX_AGE = 30 * 24 * 3600
+
+
+def list_link_names(group_id):
+    # a single pass over the links: get_objname_by_idx walks the link index
+    # from the start on every call, which is quadratic in large groups
+    names = []
+    group_id.links.iterate(lambda name: names.append(name.decode('utf-8')))
+    return names
+
+
+def get_cache_dir():
+    cache_dir = os.environ.get(CACHE_DIR_ENV) or \
+                os.path.join(os.path.expanduser('~'), '.cache', 'h5viewer')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def prune_cache(directory, max_bytes, max_age=CACHE_MAX_AGE):
+    """
+    Removes the entries of a cache directory that were not used for max_age
+    seconds, and the least recently used ones beyond max_bytes in total.
+    """
+    entries = []
+    try:
+        with os.scandir(directory) as scan:
+            for entry in scan:
+                # files that are still being written by another process
+                if '.tmp' in entry.name or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError as err:
+        print(f'Could not prune cache {directory}: {err}')
+        return
+    now = time.time()
+    total = 0
+    for mtime, size, path in sorted(entries, reverse=True):
+        total += size
+        if total > max_bytes or now - mtime > max_age:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def touch_cache_entry(path):
+    # entries are pruned by their mtime, the ones that are used are kept
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def file_identity(filename):
+    stat = os.stat(filename)
+    return os.path.abspath(filename), stat.st_size, stat.st_mtime_ns
+
+
+class TreeSnapshot(object):
+    """
+    Hierarchy of an h5 file stored in the user cache: the links of every
+    group with object types, and shape, dtype and attribute names of every
+    object. A snapshot is valid while the file path, size and mtime match.
+    Snapshots are stored as json, the cache directory may be shared.
+    """
+    VERSION = 2
+    CACHE_NAME = 'trees'
+    MAX_CACHE_BYTES = 256 * 1024 ** 2
+
+    def __init__(self, identity, children, info):
+        self.identity = identity
+        # group key -> [(name, is_group), ...]; None for groups that are
+        # hard links to an already visited group and have to be listed live
+        self.children = children
+        # object key -> (shape, dtype, attr_names)
+        self.info = info
+
+    def get_children(self, key):
+        return self.children.get(key, None)
+
+    def get_info(self, key):
+        return self.info.get(key, None)
+
+    @classmethod
+    def build(cls, file, identity, is_cancelled=lambda: False):
+        # links are listed one h5py call at a time instead of file.visititems,
+        # which would hold the h5py lock for the whole walk
+        children, info = {}, {}
+        visited = {h5py.h5o.get_info(file.id).addr}
+        stack = ['__root__']
+        while stack:
+            key = stack.pop()
+            group = file if key == '__root__' else file[key]
+            group_id = group.id
+            entries = []
+            for name in list_link_names(group_id):
+                if is_cancelled():
+                    return None
+                child_key = name if key == '__root__' else f'{key}/{name}'
+                try:
+                    obj = group[name]
+                except (KeyError, OSError, RuntimeError, ValueError):
+                    entries.append((name, False))
+                    continue
+                is_group = isinstance(obj, h5py.Group)
+                entries.append((name, is_group))
+                attr_names = tuple(obj.attrs.keys())
+                if is_group:
+                    info[child_key] = (None, None, attr_names)
+                    addr = h5py.h5o.get_info(obj.id).addr
+                    if addr in visited:
+                        children[child_key] = None
+                    else:
+                        visited.add(addr)
+                        stack.append(child_key)
+                elif isinstance(obj, h5py.Dataset):
+                    info[child_key] = (obj.shape, str(obj.dtype), attr_names)
+                else:
+                    info[child_key] = (None, None, attr_names)
+            children[key] = entries
+        return cls(identity, children, info)
+
+    @classmethod
+    def cache_path(cls, filename):
+        name = sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+        return os.path.join(get_cache_dir(), cls.CACHE_NAME, f'{name}.json')
+
+    @classmethod
+    def load(cls, identity):
+        path = cls.cache_path(identity[0])
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = json.load(f)
+            if content.get('version') != cls.VERSION or tuple(content['identity']) != tuple(identity):
+                return None
+            # json has lists only, shapes and attribute names are tuples
+            info = {key: (None if shape is None else tuple(shape), dtype, tuple(attr_names))
+                    for key, (shape, dtype, attr_names) in content['info'].items()}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as err:
+            print(f'Could not read tree snapshot {path}: {err}')
+            return None
+        touch_cache_entry(path)
+        return cls(tuple(content['identity']), content['children'], info)
+
+    def save(self):
+        path = self.cache_path(self.identity[0])
+        content = dict(version=self.VERSION, identity=self.identity,
+                       children=self.children, info=self.info)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(content, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as err:
+            print(f'Could not save tree snapshot {path}: {err}')
+            return
+        prune_cache(os.path.dirname(path), self.MAX_CACHE_BYTES)
+
+    def restamp(self, filename):
+        # h5py touches the file mtime when a file opened for writing is closed,
+        # so an unchanged file gets its snapshot stamped again after closing
+        self.identity = file_identity(filename)
+        self.save()